@@ -0,0 +1,256 @@
+# bw_core.py
+"""
+Các hàm thuần của conftest.py cho Bookworms Store (không cần browser, pytest session hay file
+kết quả), tách riêng để test được bằng unit test (test_bw_core.py):
+- lpt_partition / conflict_units: chia test cho worker xdist / shard
+- knapsack: chọn test theo --time-budget
+- item_fingerprint: fingerprint của test cho --incremental
+- view_for_route + VIEW_MAP: map URL -> view
+- merge_rows: gộp dòng kết quả vào master cho --merge-results
+- CircuitBreaker: chặn test phụ thuộc fixture / precondition đang hỏng
+"""
+import inspect
+import time
+
+APP_BASE_URL = "http://localhost/bookstore/public"
+
+# VIEW_MAP (dựa trên router PHP bạn cung cấp)
+VIEW_MAP = {
+    "/": "Home",
+    "/home": "Home",
+    "/about": "About",
+    "/search": "Search Results",
+    "/product_all": "Product List",
+    "/product": "Product By Type",
+    "/detail": "Product Detail",
+    "/cart": "Cart",
+    "/addCart": "Cart Action",
+    "/del": "Cart Action",
+    "/delCart": "Cart Action",
+    "/pay": "Checkout",
+    "/payHistory": "Payment History",
+    "/detailBill": "Bill Detail",
+    "/cancleBill": "Bill Action",
+    "/recieved": "Bill Action",
+    "/received": "Bill Action",
+    "/manageProduct": "Manage Products",
+    "/manage": "Manage Product Detail",
+    "/create": "Create Product",
+    "/manageBill": "Manage Bills",
+    "/manageDetailBill": "Manage Bill Detail",
+    "/users": "Manage Users",
+    "/userInfo": "User Info",
+    "/passChange": "User Password Change",
+    "/manage/product": "Manage Products",
+    "/manage/create": "Manage Create Product",
+    "/manage/product/": "Manage Product Detail",
+    "/manage/bills": "Manage Bills",
+    "/manage/bill": "Manage Bill Detail",
+    "/login": "Login",
+    "/register": "Register",
+}
+
+
+def view_for_route(url, base_url=APP_BASE_URL):
+    """Map URL -> view theo segment đầu tiên của path (chính xác hơn phép `in` của _match_view_from_url)."""
+    path = (url or "").split("://")[-1].split("?")[0].split("#")[0]
+    path = path.split("/", 1)[-1] if "/" in path else ""
+    base = base_url.split("://")[-1].split("/", 1)[-1].strip("/")
+    if base and path.startswith(base):
+        path = path[len(base):]
+    parts = [p for p in path.split("/") if p]
+    for n in range(len(parts), 0, -1):
+        view = VIEW_MAP.get("/" + "/".join(parts[:n]))
+        if view:
+            return view
+    return VIEW_MAP.get("/", "") if not parts else ""
+
+
+# --------------------------
+# Chia test: LPT trên thời lượng ước lượng + cụm xung đột state
+# --------------------------
+ACCOUNT_SCOPE = "@account"
+
+
+def lpt_partition(durations, bins, units=None):
+    """
+    Chia index của durations vào `bins` nhóm: đơn vị dài nhất trước, luôn vào nhóm đang nhẹ nhất.
+    units: danh sách nhóm index phải đi cùng nhau (xem conflict_units); mặc định mỗi test một đơn vị.
+    """
+    import heapq
+    bins = max(1, int(bins))
+    units = units if units is not None else [[i] for i in range(len(durations))]
+    weights = [sum(durations[i] for i in unit) for unit in units]
+    heap = [(0.0, b) for b in range(bins)]
+    groups = [[] for _ in range(bins)]
+    loads = [0.0] * bins
+    for u in sorted(range(len(units)), key=lambda u: (-weights[u], min(units[u]))):
+        load, b = heapq.heappop(heap)
+        groups[b].extend(units[u])
+        loads[b] = load + weights[u]
+        heapq.heappush(heap, (loads[b], b))
+    return [sorted(g) for g in groups], loads
+
+
+def conflict_units(nodeids, access):
+    """
+    Nhóm index của nodeids thành các thành phần liên thông của đồ thị xung đột. Cạnh chỉ nối
+    test ghi với test đọc/ghi cùng resource; hai test chỉ đọc không nối với nhau, và resource
+    per_account (mỗi worker một tài khoản) không tạo cạnh nào.
+    """
+    parent = list(range(len(nodeids)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    touching, writers = {}, {}
+    for i, nodeid in enumerate(nodeids):
+        reads, writes = access.get(nodeid, ((), ()))
+        for res in reads:
+            if not res.endswith(ACCOUNT_SCOPE):
+                touching.setdefault(res, []).append(i)
+        for res in writes:
+            if not res.endswith(ACCOUNT_SCOPE):
+                writers.setdefault(res, []).append(i)
+    for res, writer_ids in writers.items():
+        for w in writer_ids:
+            for i in touching.get(res, ()):
+                parent[find(i)] = find(w)
+    units = {}
+    for i in range(len(nodeids)):
+        units.setdefault(find(i), []).append(i)
+    return list(units.values())
+
+
+# --------------------------
+# Time budget: knapsack 0/1 trên priority weight
+# --------------------------
+def knapsack(values, costs, capacity):
+    """Index các phần tử có tổng value lớn nhất với tổng cost (số nguyên) <= capacity."""
+    best = [0] * (capacity + 1)
+    take = []
+    for value, cost in zip(values, costs):
+        row = bytearray(capacity + 1)
+        for c in range(capacity, cost - 1, -1):
+            if best[c - cost] + value > best[c]:
+                best[c] = best[c - cost] + value
+                row[c] = 1
+        take.append(row)
+    chosen, c = [], capacity
+    for i in range(len(values) - 1, -1, -1):
+        if take[i][c]:
+            chosen.append(i)
+            c -= costs[i]
+    return sorted(chosen)
+
+
+# --------------------------
+# Incremental: fingerprint của test (source test + fixture, params, marker, token app)
+# --------------------------
+def item_fingerprint(item, app_token):
+    import hashlib
+    h = hashlib.sha1(app_token.encode("utf-8"))
+    try:
+        h.update(inspect.getsource(getattr(item, "obj", item)).encode("utf-8"))
+    except Exception:
+        h.update(item.nodeid.encode("utf-8"))
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    for name in sorted(getattr(item, "fixturenames", ())):
+        for fixturedef in (fixtureinfo.name2fixturedefs.get(name, ()) if fixtureinfo else ()):
+            try:
+                h.update(inspect.getsource(fixturedef.func).encode("utf-8"))
+            except Exception:
+                h.update(name.encode("utf-8"))
+    callspec = getattr(item, "callspec", None)
+    if callspec is not None:
+        h.update(repr(sorted(callspec.params.items(), key=lambda kv: kv[0])).encode("utf-8"))
+    for m in item.iter_markers():
+        h.update(f"{m.name}{m.args!r}{sorted(m.kwargs.items())!r}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+# --------------------------
+# Merge kết quả: dòng mới vào master, bỏ dòng trùng
+# --------------------------
+def merge_rows(old, incoming):
+    """
+    Nối incoming vào sau old, bỏ các dòng incoming trùng hoàn toàn (kể cả Run ID) với old hoặc với
+    nhau; dòng của old giữ nguyên. Trả về (DataFrame đã gộp, số dòng thêm mới, số dòng trùng bị bỏ).
+    """
+    import pandas as pd
+    df_all = pd.concat([old, incoming], ignore_index=True, sort=False)
+    columns = list(old.columns) + [c for c in incoming.columns if c not in old.columns]
+    df_all = df_all[columns]
+    # so sánh dạng chuỗi; cột số có ô trống được đọc thành float (3.0) thay vì int (3)
+    key = df_all.fillna("").astype(str).apply(lambda col: col.str.replace(r"\.0+$", "", regex=True))
+    dup = key.duplicated(keep="first").iloc[len(old):]
+    merged = pd.concat([df_all.iloc[:len(old)], df_all.iloc[len(old):][~dup.values]], ignore_index=True)
+    added = int((~dup).sum())
+    return merged, added, len(incoming) - added
+
+
+# --------------------------
+# Circuit breaker (xem conftest.py: circuit_breaker / observe_setup)
+# --------------------------
+class CircuitBreaker:
+    def __init__(self, threshold=3, cooldown=0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}     # key -> [cause, số lần liên tiếp, pretty_id đầu tiên]
+        self.open = {}         # key -> [cause, pretty_id đầu tiên, thời điểm mở, số test đã chặn]
+        self.probing = {}      # key -> pretty_id của test đang chạy thử (half-open)
+
+    def failure(self, key, cause, pretty_id):
+        if key in self.probing:
+            self.probing.pop(key)
+            self.open[key][2] = time.time()
+            print(f"\n[pytest] Circuit breaker probe {pretty_id} failed, {key} stays open: {cause}")
+            return
+        entry = self.failures.get(key)
+        if entry and entry[0] == cause:
+            entry[1] += 1
+        else:
+            entry = self.failures[key] = [cause, 1, pretty_id]
+        if self.threshold and entry[1] >= self.threshold and key not in self.open:
+            self.open[key] = [cause, entry[2], time.time(), 0]
+            print(f"\n[pytest] Circuit breaker open for {key} after {entry[1]} failures: {cause}")
+
+    def success(self, key):
+        self.failures.pop(key, None)
+        self.probing.pop(key, None)
+        if key in self.open:
+            cause, first, since, count = self.open.pop(key)
+            print(f"\n[pytest] Circuit breaker closed for {key} after {time.time() - since:.0f}s open "
+                  f"({count} tests blocked)")
+
+    def abandon(self, pretty_id):
+        """Test chạy thử kết thúc mà không pass / fail setup (vd. skip): chờ cooldown rồi thử lại."""
+        for key, probe in list(self.probing.items()):
+            if probe == pretty_id:
+                self.probing.pop(key)
+                self.open[key][2] = time.time()
+
+    def open_for(self, key):
+        return time.time() - self.open[key][2] if key in self.open else 0.0
+
+    def blocked(self, keys, probe_id=None):
+        """
+        (key, (cause, pretty_id đầu tiên)) nếu một key đang mở, ngược lại None.
+        probe_id: pretty_id của test sắp chạy; nếu breaker đã hết cooldown, test này được chạy thử.
+        """
+        for key in keys:
+            if key not in self.open:
+                continue
+            entry = self.open[key]
+            if (probe_id and key not in self.probing and self.cooldown
+                    and time.time() - entry[2] >= self.cooldown):
+                self.probing[key] = probe_id
+                print(f"\n[pytest] Circuit breaker half-open for {key} after {self.open_for(key):.0f}s: probing with {probe_id}")
+                continue
+            if probe_id:
+                entry[3] += 1
+            return key, (entry[0], entry[1])
+        return None
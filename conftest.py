@@ -10,15 +10,20 @@ Conftest hoàn chỉnh cho dự án Bookworms Store
 """
 import os
 import re
+import sys
 import time
 import shutil
 import json
 import inspect
+import threading
 from datetime import datetime
 
 import pandas as pd
 import pytest
 
+from bw_core import (ACCOUNT_SCOPE, APP_BASE_URL, VIEW_MAP, CircuitBreaker, conflict_units, item_fingerprint,
+                     knapsack, lpt_partition, merge_rows, view_for_route)
+
 MASTER_FILE = os.path.join(os.getcwd(), "test_results_master.xlsx")
 TEMP_FILE = os.path.join(os.getcwd(), f"test_results_temp.xlsx")
 
@@ -28,185 +33,3252 @@ _test_screenshots = {}    # { pretty_id: screenshot_path }
 RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
 _driver_instance = None
 
-# Lock helpers: prefer `filelock` if available, otherwise fallback to simple lockfile
-def _acquire_lock(lock_path, timeout=30):
+# Lock helpers: prefer `filelock` if available, otherwise fallback to simple lockfile
+def _acquire_lock(lock_path, timeout=30):
+    try:
+        from filelock import FileLock
+        lock = FileLock(lock_path, timeout=timeout)
+        lock.acquire()
+        return lock
+    except Exception:
+        # fallback: create a lock file atomically by O_EXCL
+        end = time.time() + timeout
+        while time.time() < end:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_RDWR)
+                try:
+                    os.write(fd, str(os.getpid()).encode())
+                except Exception:
+                    pass
+                os.close(fd)
+                return lock_path
+            except FileExistsError:
+                time.sleep(0.5)
+        return None
+
+def _release_lock(lock):
+    try:
+        # filelock.FileLock
+        if hasattr(lock, 'release'):
+            lock.release()
+            return
+    except Exception:
+        pass
+    try:
+        # fallback path string
+        if isinstance(lock, str) and os.path.exists(lock):
+            os.remove(lock)
+    except Exception:
+        pass
+
+
+# --------------------------
+# pytest options
+# --------------------------
+def pytest_addoption(parser):
+    parser.addoption("--browser", default="chrome")
+    parser.addoption("--env", default="local")
+    parser.addoption("--perf-threshold", type=float, default=2.0,
+                     help="Threshold in seconds to classify a long-running test as Performance test")
+    parser.addoption("--pool-size", type=int, default=1,
+                     help="Number of idle browsers kept warm between tests (0 = new browser per test)")
+    parser.addoption("--headless", action="store_true", default=False,
+                     help="Run Chrome headless with a fixed viewport (see --viewport)")
+    parser.addoption("--lean", action="store_true", default=False,
+                     help="Headless profile with GPU, extensions, background networking, component updates... disabled")
+    parser.addoption("--viewport", default="1366x768",
+                     help="Virtual viewport WIDTHxHEIGHT used by --headless/--lean")
+    parser.addoption("--contexts", action="store_true", default=False,
+                     help="Give each test its own isolated browser context (CDP) inside a shared Chrome")
+    parser.addoption("--prefetch", type=int, default=1,
+                     help="Browsers launched in the background ahead of upcoming tests (0 = off)")
+    parser.addoption("--resource-policy", default="on", choices=("on", "off"),
+                     help="Block images/fonts/media/third-party requests for non-visual tests (by Category or marker)")
+    parser.addoption("--page-load-strategy", default="normal", choices=PAGE_LOAD_STRATEGIES,
+                     help="Chrome pageLoadStrategy; with eager/none driver.get() waits on VIEW_READINESS contracts instead")
+    parser.addoption("--chromedriver", default="",
+                     help="Path to a pinned chromedriver binary (offline runs); also read from CHROMEDRIVER_PATH")
+    parser.addoption("--recycle-after", type=int, default=50,
+                     help="Restart a pooled browser after it has served N tests (0 = never)")
+    parser.addoption("--recycle-rss-mb", type=float, default=1024,
+                     help="Restart a pooled browser when its renderer RSS exceeds this many MB (0 = off)")
+    parser.addoption("--kill-stale-browsers", action="store_true", default=False,
+                     help="Before starting, kill chrome/chromedriver recorded by earlier pytest runs that have died")
+    parser.addoption("--schedule", default="lpt", choices=("lpt", "load"),
+                     help="With pytest-xdist -n: 'lpt' packs tests onto workers by historical duration, 'load' keeps xdist's own")
+    parser.addoption("--changed", default="",
+                     help="Comma-separated changed routes/templates/views (or a file listing them): run only impacted tests")
+    parser.addoption("--history-first", action="store_true", default=False,
+                     help="Run last run's failures, then historically flaky tests, before the rest (from the master)")
+    parser.addoption("--stop-on-new-failure", action="store_true", default=False,
+                     help="Stop the session at the first failure of a test that did not fail in its previous run")
+    parser.addoption("--time-budget", type=float, default=0,
+                     help="Run the highest-priority tests whose estimated durations fit in N seconds (0 = off)")
+    parser.addoption("--incremental", action="store_true", default=False,
+                     help="Skip tests whose fingerprint (source, fixtures, app version) matches a recent PASSED run")
+    parser.addoption("--app-version", default="",
+                     help="App build token for --incremental (default: BOOKSTORE_BUILD or ETags of the bookstore assets)")
+    parser.addoption("--preflight", default="skip", choices=("skip", "abort", "off"),
+                     help="Probe the bookstore before running; when it is down skip the affected tests or abort the session")
+    parser.addoption("--shard", default="",
+                     help="Run only shard i of n (e.g. 2/4); tests are split by historical duration")
+    parser.addoption("--shard-history", default="",
+                     help="Durations used to weight --shard: .json or results .xlsx (default: .test_durations.json)")
+    parser.addoption("--store-durations", action="store_true", default=False,
+                     help="After the run, snapshot per-test durations from the master into .test_durations.json")
+    parser.addoption("--merge-results", nargs="*", default=None, metavar="XLSX",
+                     help="Merge shard result files (globs) and test_results_backup_*.xlsx into the master, then exit")
+    parser.addoption("--breaker-threshold", type=int, default=3,
+                     help="Block the remaining tests of a fixture/precondition after N identical setup failures (0 = off)")
+    parser.addoption("--breaker-cooldown", type=float, default=60.0,
+                     help="Seconds an open breaker waits before letting one test through as a probe (0 = never)")
+    parser.addoption("--precondition-groups", default="on", choices=("on", "off"),
+                     help="Run tests grouped by precondition and reuse the logged-in/cart state within a group")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "http_only: run the test on the requests+lxml engine instead of Chrome")
+    config.addinivalue_line("markers", "resources(block=[...]): resource kinds to block (image, font, media, third_party)")
+    config.addinivalue_line("markers", "page_load(strategy): normal/eager/none wait applied by driver.get() for this test")
+    config.addinivalue_line("markers", "precondition(name): anonymous/user/admin/cart, overrides the fixture-based guess")
+    config.addinivalue_line("markers", "invalidates_state: the test breaks its precondition state (logout, checkout...)")
+    config.addinivalue_line("markers", "state(reads=[...], writes=[...], per_account=False): shared data the test reads/writes (orders, cart, users, products)")
+    config.addinivalue_line("markers", "unit: pure unit test (bw_core), not written to the master, no preflight/browser")
+    global RUN_ID
+    worker_input = getattr(config, "workerinput", None)
+    if worker_input and worker_input.get("bw_run_id"):
+        # mọi worker xdist dùng chung RUN_ID của controller (tên shard / screenshot / backup)
+        RUN_ID = worker_input["bw_run_id"]
+    time.sleep = _accounted_sleep
+
+
+def pytest_unconfigure(config):
+    time.sleep = _real_sleep
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_configure_node(node):
+    """Controller xdist: truyền RUN_ID xuống từng worker."""
+    node.workerinput["bw_run_id"] = RUN_ID
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """Controller xdist: nhận lý do abort từ preflight của worker (xem apply_preflight)."""
+    reason = getattr(node, "workeroutput", {}).get("bw_preflight_abort")
+    if reason:
+        node.config._bw_preflight_abort = reason
+
+
+# --------------------------
+# pytest-xdist: mỗi worker ghi shard riêng, controller gộp một lần vào master
+# --------------------------
+def xdist_worker_id(config):
+    """'gw0', 'gw1'... khi chạy trong worker xdist, ngược lại ''."""
+    worker_input = getattr(config, "workerinput", None)
+    if worker_input:
+        return worker_input.get("workerid", "")
+    return os.environ.get("PYTEST_XDIST_WORKER", "")
+
+
+def _is_xdist_controller(config):
+    return not xdist_worker_id(config) and config.pluginmanager.getplugin("dsession") is not None
+
+
+def _shard_path(worker_id):
+    return os.path.join(os.getcwd(), f"test_results_shard_{RUN_ID}_{worker_id}.json")
+
+
+def write_result_shard(worker_id, results):
+    """Ghi kết quả của một worker ra file shard (JSON, ghi tạm rồi os.replace)."""
+    path = _shard_path(worker_id)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+    return path
+
+
+def collect_result_shards():
+    """Đọc mọi shard của RUN_ID hiện tại; trả về (results, [shard_path, ...])."""
+    import glob
+    results, paths = [], []
+    for path in sorted(glob.glob(os.path.join(os.getcwd(), f"test_results_shard_{RUN_ID}_*.json"))):
+        try:
+            with open(path, encoding="utf-8") as f:
+                results.extend(json.load(f))
+            paths.append(path)
+        except Exception as e:
+            print(f"[pytest] Could not read result shard {path}: {e}")
+    return results, paths
+
+
+def remove_result_shards(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+
+# --------------------------
+# Duration-aware scheduler: ước lượng thời lượng từ lịch sử Duration (s) trong master,
+# chia test cho các worker xdist theo LPT (longest-processing-time-first)
+# --------------------------
+DEFAULT_ESTIMATE = 5.0    # giây, cho test chưa có lịch sử và module cũng chưa có
+HISTORY_RUNS = 5          # số lần chạy gần nhất dùng để ước lượng mỗi test
+_duration_history = None
+
+
+def load_duration_history(path=None):
+    """{pretty_id: thời lượng ước lượng (median của HISTORY_RUNS lần chạy gần nhất)}."""
+    global _duration_history
+    if _duration_history is not None and path is None:
+        return _duration_history
+    history = {}
+    try:
+        df = pd.read_excel(path or MASTER_FILE, engine="openpyxl", usecols=["ID", "Duration (s)", "Result"])
+        df = df[~df["Result"].astype(str).str.upper().isin(["SKIPPED", "BLOCKED"])]
+        df["Duration (s)"] = pd.to_numeric(df["Duration (s)"], errors="coerce")
+        for pid, grp in df.dropna(subset=["Duration (s)"]).groupby("ID"):
+            history[str(pid)] = float(grp["Duration (s)"].tail(HISTORY_RUNS).median())
+    except Exception:
+        pass
+    if path is None:
+        _duration_history = history
+    return history
+
+
+def estimate_durations(nodeids, history=None):
+    """
+    Thời lượng ước lượng cho từng nodeid. Test chưa có lịch sử lấy median của các test
+    cùng module (cùng file trong nodeid, không dùng tiền tố pretty ID vì test_loc và test_login
+    đều là "TL") có lịch sử, rồi median toàn bộ lịch sử, cuối cùng là DEFAULT_ESTIMATE.
+    """
+    history = load_duration_history() if history is None else history
+    pretty = [pretty_id_for_nodeid(n) for n in nodeids]
+    modules = [n.split("::")[0] for n in nodeids]
+    by_module = {}
+    for pid, module in zip(pretty, modules):
+        if pid in history:
+            by_module.setdefault(module, []).append(history[pid])
+
+    def _median(values):
+        values = sorted(values)
+        mid = len(values) // 2
+        return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+    overall = _median(list(history.values())) if history else DEFAULT_ESTIMATE
+    estimates = []
+    for pid, module in zip(pretty, modules):
+        if pid in history:
+            estimates.append(history[pid])
+        elif module in by_module:
+            estimates.append(_median(by_module[module]))
+        else:
+            estimates.append(overall)
+    return estimates
+
+
+# --------------------------
+# State markers: test khai báo resource dữ liệu nó đọc / ghi, ví dụ
+#   @pytest.mark.state(reads=["orders"], writes=["cart"])
+# Chỉ test ghi mới tạo xung đột: test ghi một resource xung đột với mọi test đọc/ghi resource đó,
+# hai test chỉ đọc thì không. Scheduler (xdist lpt, --shard) gom mỗi cụm test xung đột vào cùng
+# một worker / shard để chúng chạy tuần tự, phần còn lại chạy song song.
+# per_account=True: resource thuộc tài khoản test đang dùng (giỏ hàng, đơn của chính user). Mỗi
+# process lease tài khoản riêng từ AccountPool nên resource loại này không xung đột giữa worker.
+# "reads" chỉ khai báo khi assertion của test phụ thuộc dữ liệu mà test khác có thể đổi giữa chừng.
+# --------------------------
+STATE_RESOURCES = ("orders", "cart", "users", "products")
+
+
+def state_access(item):
+    """(reads, writes) của test; ghi cũng tính là đọc. Resource per_account có hậu tố ACCOUNT_SCOPE."""
+    reads, writes = set(), set()
+    for marker in item.iter_markers("state"):
+        suffix = ACCOUNT_SCOPE if marker.kwargs.get("per_account") else ""
+        unknown = (set(marker.kwargs.get("reads", ())) | set(marker.kwargs.get("writes", ()))) - set(STATE_RESOURCES)
+        if unknown:
+            raise pytest.UsageError(f"{item.nodeid}: unknown state resource(s) {sorted(unknown)}; use {STATE_RESOURCES}")
+        reads.update(r + suffix for r in marker.kwargs.get("reads", ()))
+        writes.update(w + suffix for w in marker.kwargs.get("writes", ()))
+    return sorted(reads | writes), sorted(writes)
+
+
+def _state_index_path():
+    return os.path.join(os.getcwd(), f".state_index_{RUN_ID}.json")
+
+
+def write_state_index(items):
+    """Worker xdist ghi {nodeid: [reads, writes]} cho controller (controller không có item/marker)."""
+    path = _state_index_path()
+    if os.path.exists(path):
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({it.nodeid: state_access(it) for it in items}, f)
+    os.replace(tmp, path)
+
+
+def load_state_index():
+    return _read_json(_state_index_path(), {})
+
+
+def _make_lpt_scheduling(config, log):
+    from xdist.scheduler import LoadScheduling
+
+    class LptScheduling(LoadScheduling):
+        """
+        LoadScheduling của xdist với hàng đợi riêng cho từng worker, chia theo LPT trên thời lượng lịch sử;
+        các test xung đột state (ghi cùng resource) nằm trong một đơn vị và chạy tuần tự trên một worker.
+        Vẫn cân bằng lại như LoadScheduling: worker hết hàng lấy đơn vị cuối của worker còn nhiều việc nhất,
+        test còn dở của worker chết (hoặc test được đánh dấu chạy lại) được giao cho worker khác.
+        """
+
+        def __init__(self, config, log=None):
+            super().__init__(config, log)
+            self.queues = {}       # node -> [[index, ...], ...] các đơn vị chưa gửi, theo thứ tự chạy
+            self.orphans = []      # đơn vị không còn chủ (worker chết), ai rảnh trước nhận trước
+            self.estimates = []
+
+        def _queued(self, node):
+            return sum(self.estimates[i] for unit in self.queues.get(node, ()) for i in unit)
+
+        def _sync_pending(self):
+            self.pending[:] = [i for units in [self.orphans, *self.queues.values()] for unit in units for i in unit]
+
+        def _next_unit(self, node):
+            if self.orphans:
+                return self.orphans.pop(0)
+            queue = self.queues.setdefault(node, [])
+            if queue:
+                return queue.pop(0)
+            donors = [n for n, q in self.queues.items() if q and n is not node]
+            if donors:
+                return self.queues[max(donors, key=self._queued)].pop()
+            return None
+
+        def check_schedule(self, node, duration=0):
+            if node.shutting_down:
+                return
+            # giữ ít nhất 2 test đang chờ trên worker như LoadScheduling
+            while len(self.node2pending[node]) < 2:
+                unit = self._next_unit(node)
+                if not unit:
+                    break
+                self.node2pending[node].extend(unit)
+                node.send_runtest_some(unit)
+            self._sync_pending()
+            if not self.pending:
+                node.shutdown()
+
+        def mark_test_pending(self, item):
+            self.orphans.append([self.collection.index(item)])
+            self._sync_pending()
+            for node in self.node2pending:
+                self.check_schedule(node)
+
+        def remove_node(self, node):
+            pending = self.node2pending.pop(node)
+            queue = self.queues.pop(node, [])
+            crashitem = self.collection[pending.pop(0)] if pending else None
+            # một đơn vị duy nhất để các test xung đột còn lại vẫn chạy tuần tự, đúng thứ tự cũ
+            orphan = pending + [i for unit in queue for i in unit]
+            if orphan:
+                self.orphans.append(orphan)
+                self._sync_pending()
+                for other in self.node2pending:
+                    self.check_schedule(other)
+            return crashitem
+
+        def schedule(self):
+            assert self.collection_is_completed
+            if self.collection is not None:
+                for node in self.nodes:
+                    self.check_schedule(node)
+                return
+            if not self._check_nodes_have_same_collection():
+                self.log("**Different tests collected, aborting run**")
+                return
+            self.collection = next(iter(self.node2collection.values()))
+            if not self.collection:
+                return
+            self.estimates = estimate_durations(self.collection)
+            units = conflict_units(self.collection, load_state_index())
+            groups, loads = lpt_partition(self.estimates, len(self.nodes), units)
+            unit_of = {i: tuple(unit) for unit in units for i in unit}
+            for node, group, load in zip(self.nodes, groups, loads):
+                print(f"[pytest] LPT schedule: {node.gateway.id} <- {len(group)} tests, ~{load:.1f}s")
+                self.queues[node] = [list(u) for u in dict.fromkeys(unit_of[i] for i in group)]
+            self._sync_pending()
+            for node in self.nodes:
+                self.check_schedule(node)
+
+    return LptScheduling(config, log)
+
+
+@pytest.hookimpl(optionalhook=True, tryfirst=True)
+def pytest_xdist_make_scheduler(config, log):
+    if config.getoption("--schedule") == "lpt" and config.getvalue("dist") == "load":
+        return _make_lpt_scheduling(config, log)
+    return None
+
+
+# --------------------------
+# Impact selection: --changed "/manageBill,app/views/cart.php" chỉ chạy các test có view
+# (đã ghi nhận trong master qua cột View / Views / Page URL, hoặc khai báo tc(view=...))
+# giao với các view bị ảnh hưởng. Test chưa từng chạy và không khai báo view vẫn được chạy.
+# --------------------------
+def _norm_view(name):
+    return re.sub(r"\W+", "", str(name)).lower()
+
+
+def views_for_change(entry):
+    """Route ('/manage/bills'), file template ('app/views/manageBill.php') hoặc tên view -> tập view."""
+    entry = entry.strip().replace("\\", "/")
+    if not entry:
+        return set()
+    if entry in VIEW_MAP.values():
+        return {entry}
+    views = set()
+    if entry.startswith("/") or "://" in entry:
+        view = view_for_route(entry if "://" in entry else APP_BASE_URL + entry)
+        if view and (entry.strip("/") or view == VIEW_MAP.get("/")):
+            views.add(view)
+    # khớp đúng tên file với segment cuối của route hoặc tên view, không khớp tiền tố:
+    # manageBill.php không kéo theo "Manage Bill Detail" (manageDetailBill)
+    stem = _norm_view(os.path.splitext(os.path.basename(entry.rstrip("/")))[0])
+    if stem:
+        for route, view in VIEW_MAP.items():
+            if stem in (_norm_view(route.rstrip("/").rsplit("/", 1)[-1]), _norm_view(view)):
+                views.add(view)
+    return views
+
+
+def visited_views(drv):
+    """Các view mà driver đã mở trong test hiện tại (driver.get + URL cuối; HttpPage dùng history)."""
+    urls = list(getattr(drv, "_bw_nav", None) or getattr(drv, "_history", None) or [])
+    try:
+        urls.append(drv.current_url)
+    except Exception:
+        pass
+    return {v for v in (view_for_route(u) for u in urls if u and not str(u).startswith(("about:", "data:"))) if v}
+
+
+def build_view_index(path=None):
+    """{pretty_id: {view, ...}} từ mọi lần chạy đã ghi trong master."""
+    index = {}
+    try:
+        df = pd.read_excel(path or MASTER_FILE, engine="openpyxl",
+                           usecols=lambda c: c in ("ID", "View", "Views", "Page URL"))
+    except Exception:
+        return index
+    for row in df.fillna("").astype(str).to_dict("records"):
+        views = {v.strip() for v in row.get("Views", "").split(";")}
+        views.add(row.get("View", "").strip())
+        views.add(view_for_route(row.get("Page URL", "")))
+        index.setdefault(row.get("ID", ""), set()).update(v for v in views if v)
+    return index
+
+
+def _changed_entries(value):
+    entries = []
+    for part in str(value).split(","):
+        part = part.strip()
+        if part and os.path.isfile(part):
+            with open(part, encoding="utf-8") as f:
+                entries.extend(line.strip() for line in f if line.strip())
+        elif part:
+            entries.append(part)
+    return entries
+
+
+def select_impacted(config, items):
+    value = config.getoption("--changed")
+    if not value:
+        return
+    entries = _changed_entries(value)
+    changed = set()
+    for entry in entries:
+        views = views_for_change(entry)
+        if not views:
+            print(f"\n[pytest] --changed: cannot map {entry!r} to a view -> running the whole suite")
+            return
+        changed |= views
+    index = build_view_index()
+    selected, deselected, unknown = [], [], 0
+    for item in items:
+        views = set(index.get(generate_pretty_nodeid(item), ()))
+        marker = item.get_closest_marker("tc")
+        if marker and marker.kwargs.get("view"):
+            views.add(marker.kwargs["view"])
+        if not views:
+            unknown += 1
+            selected.append(item)
+        elif views & changed:
+            selected.append(item)
+        else:
+            deselected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
+    print(f"\n[pytest] Impact selection for views {sorted(changed)}: {len(selected)} tests "
+          f"({unknown} without view history), {len(deselected)} deselected")
+
+
+# --------------------------
+# History order: --history-first chạy trước các test FAILED ở lần chạy gần nhất, rồi các test
+# flaky (PASSED lẫn FAILED trong FLAKY_RUNS lần gần nhất, đổi kết quả nhiều nhất đứng trước).
+# --stop-on-new-failure dừng session ở test đầu tiên fail mà lần trước không fail.
+# --------------------------
+FLAKY_RUNS = 10           # số lần chạy gần nhất dùng để đánh giá flaky
+
+
+def load_result_history(path=None):
+    """{pretty_id: [PASSED/FAILED, ...]} theo thứ tự thời gian, tối đa FLAKY_RUNS lần gần nhất."""
+    history = {}
+    try:
+        df = pd.read_excel(path or MASTER_FILE, engine="openpyxl", usecols=["ID", "Result"])
+    except Exception:
+        return history
+    df["Result"] = df["Result"].astype(str).str.upper()
+    df = df[df["Result"].isin(["PASSED", "FAILED"])]
+    for pid, grp in df.groupby("ID", sort=False):
+        history[str(pid)] = list(grp["Result"].tail(FLAKY_RUNS))
+    return history
+
+
+def history_rank(results):
+    """(0, ...) fail lần trước, (1, -số lần đổi kết quả) flaky, (2, 0) còn lại / chưa có lịch sử."""
+    if not results:
+        return (2, 0)
+    if results[-1] == "FAILED":
+        return (0, 0)
+    if len(set(results)) > 1:
+        return (1, -sum(a != b for a, b in zip(results, results[1:])))
+    return (2, 0)
+
+
+def known_failures(config):
+    """pretty_id của các test đã FAILED ở lần chạy gần nhất của chúng (cache trên config)."""
+    if not hasattr(config, "_bw_known_failures"):
+        config._bw_known_failures = {pid for pid, res in load_result_history().items() if res[-1] == "FAILED"}
+    return config._bw_known_failures
+
+
+def order_by_history(config, items, precondition_key=None):
+    if not config.getoption("--history-first"):
+        return
+    history = load_result_history()
+    config._bw_known_failures = {pid for pid, res in history.items() if res[-1] == "FAILED"}
+    ranks = {it.nodeid: history_rank(history.get(generate_pretty_nodeid(it))) for it in items}
+    # sort ổn định; trong mỗi bậc vẫn giữ nhóm precondition (nếu có) để tái dùng state đăng nhập
+    items.sort(key=lambda it: (ranks[it.nodeid][0], ranks[it.nodeid][1],
+                               precondition_key(it) if precondition_key else 0))
+    failed = sum(1 for r in ranks.values() if r[0] == 0)
+    flaky = sum(1 for r in ranks.values() if r[0] == 1)
+    print(f"\n[pytest] History order: {failed} failed last run, {flaky} flaky, "
+          f"{len(items) - failed - flaky} others")
+
+
+# --------------------------
+# Time budget: --time-budget 120 chọn tập test có tổng trọng số priority lớn nhất mà tổng thời
+# lượng ước lượng (lịch sử Duration) vừa N giây: knapsack 0/1, thời lượng làm tròn lên theo bước
+# TIME_BUDGET_STEP (tự nới ra với budget lớn). Với xdist -n, budget nhân theo số worker.
+# --------------------------
+PRIORITY_WEIGHTS = {"critical": 8, "high": 4, "medium": 2, "low": 1}
+TIME_BUDGET_STEP = 0.1    # giây
+TIME_BUDGET_CELLS = 20000
+
+
+def priority_weight(item):
+    meta = extract_metadata_for_item(item, generate_pretty_nodeid(item))
+    return PRIORITY_WEIGHTS.get(str(meta.get("priority") or "Medium").strip().lower(), PRIORITY_WEIGHTS["medium"])
+
+
+def _worker_loads(items, keep, estimates, workers):
+    """Tải từng worker khi chia các test trong keep như scheduler (LPT + cụm xung đột state)."""
+    idx = sorted(keep)
+    units = conflict_units([items[i].nodeid for i in idx], {items[i].nodeid: state_access(items[i]) for i in idx})
+    groups, loads = lpt_partition([estimates[i] for i in idx], workers, units)
+    return [[idx[j] for j in g] for g in groups], loads
+
+
+def _fit_workers(items, keep, estimates, weights, budget, workers):
+    """
+    Knapsack trên budget * workers giả định chia đều hoàn hảo; cụm xung đột và test dài có thể làm
+    một worker vượt budget. Bỏ dần test có weight/giây thấp nhất khỏi worker nặng nhất cho tới khi
+    mọi worker <= budget, rồi thử thêm lại các test bị bỏ còn vừa.
+    """
+    keep = set(keep)
+    density = lambda i: (weights[i] / max(estimates[i], 1e-6), -estimates[i])
+    groups, loads = _worker_loads(items, keep, estimates, workers)
+    while keep and max(loads) > budget:
+        heaviest = groups[loads.index(max(loads))]
+        keep.discard(min(heaviest, key=density))
+        groups, loads = _worker_loads(items, keep, estimates, workers)
+    for i in sorted(set(range(len(items))) - keep, key=density, reverse=True):
+        if estimates[i] > budget:
+            continue
+        _, loads = _worker_loads(items, keep | {i}, estimates, workers)
+        if max(loads) <= budget:
+            keep.add(i)
+    return keep
+
+
+def select_time_budget(config, items):
+    budget = config.getoption("--time-budget")
+    if not budget or not items:
+        return
+    workers = getattr(config.option, "numprocesses", None)
+    workers = workers if isinstance(workers, int) and workers > 1 else 1
+    capacity = budget * workers
+    estimates = estimate_durations([it.nodeid for it in items])
+    weights = [priority_weight(it) for it in items]
+    step = max(TIME_BUDGET_STEP, capacity / TIME_BUDGET_CELLS)
+    costs = [max(1, int(-(-d // step))) for d in estimates]
+    keep = set(knapsack(weights, costs, int(capacity // step)))
+    if workers > 1:
+        keep = _fit_workers(items, keep, estimates, weights, budget, workers)
+    selected = [it for i, it in enumerate(items) if i in keep]
+    deselected = [i for i in range(len(items)) if i not in keep]
+    if deselected:
+        config.hook.pytest_deselected(items=[items[i] for i in deselected])
+    print(f"\n[pytest] Time budget {budget:g}s: {len(selected)} tests, ~{sum(estimates[i] for i in keep):.1f}s, "
+          f"priority weight {sum(weights[i] for i in keep)}/{sum(weights)}; left out {len(deselected)}:")
+    for i in sorted(deselected, key=lambda i: (-weights[i], estimates[i])):
+        print(f"[pytest]   - {generate_pretty_nodeid(items[i])} (weight {weights[i]}, ~{estimates[i]:.1f}s) {items[i].nodeid}")
+    items[:] = selected
+
+
+# --------------------------
+# Incremental mode: --incremental bỏ qua test có fingerprint (source test + source fixture +
+# params/marker + token phiên bản app) trùng với lần chạy PASSED gần nhất trong CACHE_MAX_AGE,
+# và chép dòng kết quả đó sang báo cáo lần này với cột "Cached From" = Run ID gốc.
+# Token phiên bản: --app-version / BOOKSTORE_BUILD, nếu không có thì ETag / Last-Modified của
+# trang chủ và các file css/js của app. Không lấy được token -> chạy toàn bộ.
+# --------------------------
+CACHE_MAX_AGE = 7 * 24 * 3600
+APP_ASSET_LIMIT = 30
+
+
+def app_version_token(config):
+    token = config.getoption("--app-version") or os.environ.get("BOOKSTORE_BUILD", "")
+    if token:
+        return token
+    import hashlib
+    from urllib.parse import urljoin, urlparse
+    parts = []
+    try:
+        import lxml.html
+        http = _new_http_session()
+        resp = http.get(f"{APP_BASE_URL}/home", timeout=10)
+        parts.append(f"home {resp.headers.get('ETag', '')} {resp.headers.get('Last-Modified', '')}")
+        doc = lxml.html.fromstring(resp.content)
+        assets = sorted({urljoin(resp.url, u) for u in doc.xpath("//link[@rel='stylesheet']/@href | //script/@src")})
+        host = urlparse(APP_BASE_URL).netloc
+        for url in [u for u in assets if urlparse(u).netloc == host][:APP_ASSET_LIMIT]:
+            r = http.head(url, timeout=5, allow_redirects=True)
+            headers = [r.headers.get(h, "") for h in ("ETag", "Last-Modified", "Content-Length")]
+            if any(headers):
+                parts.append(f"{url} {' '.join(headers)}")
+    except Exception as e:
+        print(f"[pytest] App version probe failed: {e}")
+        return ""
+    if not any(p.split(" ", 1)[1].strip() for p in parts):
+        return ""
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def load_cached_passes(path=None):
+    """
+    {(pretty_id, fingerprint): dòng master} của các fingerprint mà lần chạy thật gần nhất là PASSED
+    và chưa quá CACHE_MAX_AGE. Dòng chép lại từ cache (có "Cached From") không phải bằng chứng mới:
+    bỏ qua, để tuổi luôn tính từ lần test thật sự chạy.
+    """
+    cached = {}
+    try:
+        df = pd.read_excel(path or MASTER_FILE, engine="openpyxl")
+    except Exception:
+        return cached
+    if "Fingerprint" not in df.columns:
+        return cached
+    now = time.time()
+    for row in df.fillna("").astype(str).to_dict("records"):
+        if not row.get("Fingerprint") or row.get("Cached From"):
+            continue
+        key = (row["ID"], row["Fingerprint"])
+        try:
+            age = now - datetime.strptime(row.get("Run ID", ""), "%Y%m%d_%H%M%S").timestamp()
+        except Exception:
+            age = CACHE_MAX_AGE + 1
+        if row.get("Result", "").upper() == "PASSED" and age <= CACHE_MAX_AGE:
+            cached[key] = row
+        else:
+            cached.pop(key, None)
+    return cached
+
+
+def select_uncached(config, items):
+    if not config.getoption("--incremental") or not items:
+        return
+    token = app_version_token(config)
+    if not token:
+        print("\n[pytest] --incremental: no app version token (set --app-version or BOOKSTORE_BUILD) -> running all tests")
+        return
+    cached = load_cached_passes()
+    selected, skipped = [], []
+    for item in items:
+        item._bw_fingerprint = item_fingerprint(item, token)
+        row = cached.get((generate_pretty_nodeid(item), item._bw_fingerprint))
+        (skipped if row else selected).append((item, row))
+    if skipped:
+        config.hook.pytest_deselected(items=[it for it, _ in skipped])
+    # xdist: mọi worker collect như nhau, chỉ gw0 chép dòng cache để controller không gộp trùng
+    if xdist_worker_id(config) in ("", "gw0"):
+        for item, row in skipped:
+            record = dict(row)
+            record["Cached From"] = row.get("Run ID", "")
+            record["Run ID"] = RUN_ID
+            record["Notes"] = "; ".join(filter(None, [row.get("Notes", ""), "Cached: fingerprint unchanged"]))
+            _test_results.append(record)
+    items[:] = [it for it, _ in selected]
+    print(f"\n[pytest] Incremental (app {token}): {len(skipped)} tests cached, {len(items)} to run")
+
+
+# --------------------------
+# Preflight: trước khi chạy, probe song song APP_BASE_URL và các route chính của VIEW_MAP.
+# App không kết nối được -> mọi test bị skip (--preflight skip) hoặc dừng session (abort);
+# route trả 5xx -> skip các test có view thuộc route đó. Mỗi test bị skip có một dòng SKIPPED
+# trong báo cáo với lý do từ preflight.
+# --------------------------
+PREFLIGHT_ROUTES = ("/home", "/login", "/register", "/search", "/about", "/cart", "/payHistory", "/manageBill")
+PREFLIGHT_TIMEOUT = (0.5, 5)     # (connect, read) giây
+
+
+def _probe(url, timeout=PREFLIGHT_TIMEOUT):
+    """Chuỗi rỗng nếu URL trả lời được (kể cả 3xx/4xx), ngược lại mô tả lỗi."""
+    import requests
+    try:
+        resp = requests.get(url, timeout=timeout, allow_redirects=False)
+    except requests.exceptions.ConnectTimeout:
+        return "connect timeout"
+    except requests.exceptions.ReadTimeout:
+        return "read timeout"
+    except requests.exceptions.ConnectionError:
+        return "connection failed"
+    except Exception as e:
+        return type(e).__name__
+    return f"HTTP {resp.status_code}" if resp.status_code >= 500 else ""
+
+
+def preflight_check(routes=PREFLIGHT_ROUTES):
+    """(lỗi của APP_BASE_URL hoặc "", {route: lỗi} của các route hỏng)."""
+    from concurrent.futures import ThreadPoolExecutor
+    urls = [APP_BASE_URL] + [APP_BASE_URL + r for r in routes]
+    with ThreadPoolExecutor(max_workers=len(urls)) as ex:
+        errors = list(ex.map(_probe, urls))
+    return errors[0], {r: e for r, e in zip(routes, errors[1:]) if e}
+
+
+def _skipped_record(item, reason, result="SKIPPED", note="Preflight"):
+    env = item.config.getoption("--env")
+    browser = _profile_label(_browser_profile(item.config))
+    return {
+        "ID": generate_pretty_nodeid(item),
+        "Test Case Title": extract_metadata_for_item(item, generate_pretty_nodeid(item)).get("title") or item.name,
+        "Precondition": f"{browser.upper()} / {env.upper()}",
+        "Expected Output": "Test execution completed",
+        "Actual Result": reason,
+        "Result": result,
+        "Duration (s)": "0.00",
+        "Browser": browser,
+        "Environment": env,
+        "Notes": note,
+        "Run ID": RUN_ID,
+    }
+
+
+def apply_preflight(config, items):
+    mode = config.getoption("--preflight")
+    if mode == "off" or not items:
+        return
+    start = time.time()
+    base_error, route_errors = preflight_check()
+    if not base_error and not route_errors:
+        return
+    if base_error:
+        reason = f"Preflight: {APP_BASE_URL} unreachable ({base_error})"
+        blocked = list(items)
+    else:
+        broken = {view_for_route(APP_BASE_URL + r): f"{r} {e}" for r, e in route_errors.items()}
+        index = build_view_index()
+        blocked = []
+        for item in items:
+            views = set(index.get(generate_pretty_nodeid(item), ()))
+            marker = item.get_closest_marker("tc")
+            if marker and marker.kwargs.get("view"):
+                views.add(marker.kwargs["view"])
+            if views & set(broken):
+                blocked.append(item)
+        reason = "Preflight: " + "; ".join(f"{v}: {e}" for v, e in sorted(broken.items()))
+    print(f"\n[pytest] {reason} -> {len(blocked)}/{len(items)} tests skipped ({time.time() - start:.2f}s)")
+    # với xdist mọi worker đều collect toàn bộ -> chỉ gw0 ghi dòng SKIPPED, nhưng worker nào cũng
+    # phải dừng khi abort (controller không tự collect nên không bao giờ thấy preflight)
+    record = xdist_worker_id(config) in ("", "gw0")
+    if record:
+        _test_results.extend(_skipped_record(item, reason) for item in blocked)
+    if mode == "abort":
+        if record:
+            blocked_ids = {id(it) for it in blocked}
+            _test_results.extend(_skipped_record(it, "Not run: session aborted by preflight")
+                                 for it in items if id(it) not in blocked_ids)
+        workeroutput = getattr(config, "workeroutput", None)
+        if workeroutput is not None:
+            # pytest.exit trong worker bị xdist coi là crash (và khởi động lại worker) -> bỏ chọn toàn bộ,
+            # controller đọc lý do qua workeroutput và kết thúc với INTERRUPTED
+            config.hook.pytest_deselected(items=list(items))
+            items[:] = []
+            workeroutput["bw_preflight_abort"] = reason
+            return
+        pytest.exit(reason, returncode=pytest.ExitCode.INTERRUPTED)
+    for item in blocked:
+        item.add_marker(pytest.mark.skip(reason=reason))
+
+
+# --------------------------
+# Sharding: --shard i/n chia test cho n process / máy theo LPT trên thời lượng lịch sử, và
+# --merge-results gộp master của các shard + test_results_backup_*.xlsx vào master, bỏ dòng trùng.
+# Mọi shard phải dùng cùng một bảng thời lượng thì phép chia mới khớp nhau, nên shard đọc
+# .test_durations.json (chỉ cập nhật khi chạy với --store-durations) chứ không đọc master đang thay đổi.
+# --------------------------
+DURATIONS_FILE = os.path.join(os.getcwd(), ".test_durations.json")
+
+
+def shard_history(config):
+    path = config.getoption("--shard-history")
+    if path:
+        return _read_json(path, {}) if path.endswith(".json") else load_duration_history(path)
+    if os.path.exists(DURATIONS_FILE):
+        return _read_json(DURATIONS_FILE, {})
+    print("\n[pytest] No .test_durations.json (run once with --store-durations): shards are split by count")
+    return {}
+
+
+def store_durations():
+    """Chụp thời lượng ước lượng hiện tại từ master vào DURATIONS_FILE cho --shard."""
+    history = load_duration_history(MASTER_FILE)
+    if history:
+        _write_json(DURATIONS_FILE, dict(sorted(history.items())))
+        print(f"[pytest] Stored {len(history)} test durations in {DURATIONS_FILE}")
+
+def parse_shard(value):
+    """'2/4' -> (2, 4); shard đánh số từ 1."""
+    try:
+        index, total = (int(x) for x in str(value).split("/"))
+    except Exception:
+        raise pytest.UsageError(f"--shard expects i/n (e.g. 1/4), got {value!r}")
+    if total < 1 or not 1 <= index <= total:
+        raise pytest.UsageError(f"--shard {value}: need 1 <= i <= n")
+    return index, total
+
+
+def select_shard(config, items):
+    value = config.getoption("--shard")
+    if not value:
+        return
+    index, total = parse_shard(value)
+    # chia trên collection sắp theo nodeid: không phụ thuộc thứ tự sort / lọc của các bước sau
+    ordered = sorted(items, key=lambda it: it.nodeid)
+    nodeids = [it.nodeid for it in ordered]
+    estimates = estimate_durations(nodeids, shard_history(config))
+    units = conflict_units(nodeids, {it.nodeid: state_access(it) for it in ordered})
+    groups, loads = lpt_partition(estimates, total, units)
+    keep = {nodeids[i] for i in groups[index - 1]}
+    selected = [it for it in items if it.nodeid in keep]
+    deselected = [it for it in items if it.nodeid not in keep]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
+    print(f"\n[pytest] Shard {index}/{total}: {len(selected)} tests, ~{loads[index - 1]:.1f}s "
+          f"(all shards: {', '.join(f'{l:.0f}s' for l in loads)})")
+
+
+def merge_result_files(paths, master=None):
+    """
+    Gộp các file kết quả (.xlsx) vào master, bỏ các dòng mới trùng hoàn toàn (kể cả Run ID) với master
+    hoặc với nhau; dòng đã có trong master không bao giờ bị xoá.
+    File backup test_results_backup_*.xlsx đã gộp thành công sẽ bị xoá; file shard giữ nguyên.
+    Trả về (số dòng thêm mới, số dòng trùng bị bỏ).
+    """
+    master = master or MASTER_FILE
+    frames = []
+    for path in paths:
+        try:
+            frames.append(pd.read_excel(path, engine="openpyxl"))
+        except Exception as e:
+            print(f"[pytest] Skip {path}: {e}")
+    if not frames:
+        return 0, 0
+    lock_path = master + ".lock"
+    lock = _acquire_lock(lock_path, timeout=30)
+    if not lock:
+        raise PermissionError("Could not acquire lock on master file")
+    try:
+        old = pd.read_excel(master, engine="openpyxl") if os.path.exists(master) else pd.DataFrame()
+        incoming = pd.concat(frames, ignore_index=True, sort=False)
+        merged, added, dropped = merge_rows(old, incoming)
+        tmp_master = os.path.join(os.path.dirname(master) or ".", f"test_results_master_merge_{RUN_ID}.xlsx")
+        merged.to_excel(tmp_master, index=False, engine="openpyxl")
+        os.replace(tmp_master, master)
+    finally:
+        _release_lock(lock)
+    for path in paths:
+        if os.path.basename(path).startswith("test_results_backup_"):
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+    return added, dropped
+
+
+def pytest_cmdline_main(config):
+    sources = config.getoption("--merge-results")
+    if sources is None:
+        return None
+    import glob
+    paths = []
+    for pattern in list(sources) + [os.path.join(os.getcwd(), "test_results_backup_*.xlsx")]:
+        for path in sorted(glob.glob(pattern)):
+            if os.path.abspath(path) != os.path.abspath(MASTER_FILE) and path not in paths:
+                paths.append(path)
+    if not paths:
+        print("[pytest] Nothing to merge.")
+        return 0
+    added, dropped = merge_result_files(paths)
+    print(f"[pytest] Merged {len(paths)} files into {MASTER_FILE}: {added} new rows, {dropped} duplicates dropped")
+    return 0
+
+
+
+
+# --------------------------
+# Page-load strategy + readiness contract theo view
+# Browser được launch với --page-load-strategy (normal/eager/none); với eager/none driver.get()
+# sau đó tự chờ theo strategy của test (marker page_load) / của view, rồi chờ contract của view.
+# --------------------------
+PAGE_LOAD_STRATEGIES = ("normal", "eager", "none")
+VIEW_READINESS = {
+    "Home": {"strategy": "eager", "css": "form[name='search-form']", "state": "present"},
+    "Login": {"strategy": "none", "css": "form#singinForm", "state": "visible"},
+    "Register": {"strategy": "none", "css": "input[name='email']", "state": "visible"},
+    "Search Results": {"strategy": "eager", "css": "h4", "state": "present"},
+    "Manage Bills": {"strategy": "none", "css": "table tbody", "state": "present"},
+    "Manage Bill Detail": {"strategy": "eager", "css": "table", "state": "present"},
+    "Payment History": {"strategy": "eager", "css": "table", "state": "present"},
+    "Bill Detail": {"strategy": "eager", "css": "h4", "state": "visible"},
+    "About": {"strategy": "eager", "css": "footer", "state": "present"},
+    "Cart": {"strategy": "eager", "css": "footer", "state": "present"},
+}
+_READY_STATES = {"normal": ("complete",), "eager": ("interactive", "complete")}
+CONTRACT_TIMEOUT = 3      # giây; contract có thể tự khai báo "timeout"
+
+
+def _wait_for_page(drv, url, timeout=None):
+    """
+    Chờ sau driver.get() khi browser launch với eager/none: document mới theo strategy hiệu lực,
+    rồi contract của view (nếu có). Launch "normal" thì get() native đã chờ load xong -> bỏ qua.
+    Contract không đạt (selector không có khi document đã complete, hoặc quá CONTRACT_TIMEOUT)
+    được ghi vào drv._bw_readiness_misses -> cột Notes, không chờ hết timeout.
+    """
+    if getattr(drv, "_bw_launch_strategy", "normal") == "normal":
+        return True
+    contract = VIEW_READINESS.get(view_for_route(url), {})
+    strategy = getattr(drv, "_bw_page_load", None) or contract.get("strategy") or drv._bw_launch_strategy
+    states = _READY_STATES.get(strategy, ())
+    css = contract.get("css")
+    visible = contract.get("state") == "visible"
+    script = (
+        "if (window.__bwNavMarker) return 0;"
+        "var states = arguments[0];"
+        "if (states.length && states.indexOf(document.readyState) < 0) return 0;"
+        "if (!arguments[1]) return 1;"
+        "var el = document.querySelector(arguments[1]);"
+        "if (!el) return document.readyState === 'complete' ? 2 : 0;"
+        "if (!arguments[2]) return 1;"
+        "var r = el.getBoundingClientRect(), s = getComputedStyle(el);"
+        "return r.width > 0 && r.height > 0 && s.visibility !== 'hidden' && s.display !== 'none' ? 1 : 0;"
+    )
+    end = time.time() + (timeout or contract.get("timeout", CONTRACT_TIMEOUT))
+    state = 0
+    while time.time() < end:
+        try:
+            state = drv.execute_script(script, list(states), css or "", visible)
+            if state == 1:
+                return True
+            if state == 2:
+                break    # trang server-render đã complete mà không có selector -> không chờ thêm
+        except Exception:
+            pass
+        time.sleep(0.05)
+    miss = (f"Readiness contract {'missing' if state == 2 else 'timed out'}: {view_for_route(url) or url} "
+            f"(strategy={strategy}, css={css})")
+    try:
+        drv._bw_readiness_misses = getattr(drv, "_bw_readiness_misses", []) + [miss]
+    except Exception:
+        pass
+    return False
+
+
+def _url_origin(url):
+    from urllib.parse import urlsplit
+    parts = urlsplit(str(url))
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _install_readiness_get(drv, launch_strategy):
+    native_get = drv.get
+    drv._bw_launch_strategy = launch_strategy
+    drv._bw_page_load = None
+
+    def get(url):
+        try:
+            # đánh dấu document hiện tại để biết khi nào document mới thay thế nó
+            # (bỏ qua URL có fragment: điều hướng cùng document sẽ không xóa được marker)
+            if "#" not in str(url):
+                drv.execute_script("window.__bwNavMarker = true;")
+        except Exception:
+            pass
+        native_get(url)
+        drv._bw_nav = getattr(drv, "_bw_nav", []) + [str(url)]
+        origin = _url_origin(url)
+        if origin:
+            # origin đã mở kể từ lần reset trước: BrowserPool.reset dọn / kiểm tra storage của từng origin
+            drv._bw_origins = getattr(drv, "_bw_origins", set()) | {origin}
+        if getattr(drv, "_bw_state", None):
+            drv._bw_visited = getattr(drv, "_bw_visited", []) + [str(url)]
+        if not str(url).startswith(("about:", "data:")):
+            _wait_for_page(drv, url)
+    drv.get = get
+
+
+# --------------------------
+# Page settle: thay time.sleep cố định sau click / submit bằng wait_until_settled():
+# script theo dõi DOM (MutationObserver) + fetch/XHR đang chạy được cài vào mọi document
+# (CDP Page.addScriptToEvaluateOnNewDocument, fallback inject vào document hiện tại).
+# Trang "settled" khi readyState complete, không có request đang chạy và DOM im lặng quiet_ms
+# tính từ lúc bắt đầu chờ (không phải từ thay đổi cuối của document cũ); navigation=True còn đòi
+# document mới, vì click / submit có thể chưa kịp bắt đầu điều hướng khi gọi hàm.
+# Mỗi lần chờ ghi (thời gian chờ thật, sleep được thay, settled?) vào drv._bw_settle_log -> cột Notes.
+# --------------------------
+SETTLE_QUIET_MS = 300
+SETTLE_TIMEOUT = 10
+_SETTLE_SCRIPT = (
+    "(function(){"
+    "if (window.__bwSettle) return;"
+    "var s = window.__bwSettle = {inflight: 0, last: Date.now(), leaving: false,"
+    "  doc: String(performance.timeOrigin) + ':' + Math.random()};"
+    "var touch = function(){ s.last = Date.now(); };"
+    "new MutationObserver(touch).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});"
+    "window.addEventListener('beforeunload', function(){ s.leaving = true; });"
+    "if (window.fetch) { var f = window.fetch; window.fetch = function(){"
+    "  s.inflight++; touch();"
+    "  return f.apply(this, arguments).finally(function(){ s.inflight--; touch(); }); }; }"
+    "var send = XMLHttpRequest.prototype.send;"
+    "XMLHttpRequest.prototype.send = function(){"
+    "  s.inflight++; touch();"
+    "  this.addEventListener('loadend', function(){ s.inflight--; touch(); });"
+    "  return send.apply(this, arguments); };"
+    "})();"
+)
+# mốc bắt đầu chờ: quiet window tính lại từ đây, trả về id của document hiện tại
+_SETTLE_BEGIN = _SETTLE_SCRIPT + "var s = window.__bwSettle; s.last = Date.now(); return s.doc;"
+_SETTLED_CHECK = (
+    "var s = window.__bwSettle;"
+    "if (!s) return null;"
+    "if (s.leaving || document.readyState !== 'complete') return [s.doc, false];"
+    "return [s.doc, s.inflight <= 0 && Date.now() - s.last >= arguments[0]];"
+)
+
+
+def wait_until_settled(drv, quiet_ms=SETTLE_QUIET_MS, timeout=SETTLE_TIMEOUT, replaces=None, navigation=None):
+    """
+    Chờ điều hướng xong, không còn fetch/XHR và DOM không đổi trong quiet_ms tính từ lúc bắt đầu chờ.
+    navigation=True: bắt buộc phải có document mới (submit form / reload) trước khi coi là settled.
+    replaces: số giây của time.sleep() được thay thế (chỉ để báo cáo). Trả về số giây đã chờ.
+    """
+    start = time.time()
+    settled = True
+    if getattr(drv, "engine", "") != "http":
+        if not getattr(drv, "_bw_settle_cdp", False):
+            try:
+                drv.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": _SETTLE_SCRIPT})
+            except Exception:
+                pass
+            drv._bw_settle_cdp = True
+        try:
+            start_doc = drv.execute_script(_SETTLE_BEGIN)
+        except Exception:
+            start_doc = None    # điều hướng đã bắt đầu, document cũ không còn
+        settled = False
+        end = start + timeout
+        while time.time() < end:
+            try:
+                state = drv.execute_script(_SETTLED_CHECK, quiet_ms)
+                if state is None:
+                    drv.execute_script(_SETTLE_SCRIPT)
+                elif state[1] and not (navigation and start_doc is not None and state[0] == start_doc):
+                    settled = True
+                    break
+            except Exception:
+                pass    # document đang được thay thế
+            time.sleep(0.05)
+    waited = time.time() - start
+    try:
+        drv._bw_settle_log = getattr(drv, "_bw_settle_log", []) + [(waited, replaces, settled)]
+    except Exception:
+        pass
+    return waited
+
+
+def settle_summary(log):
+    """'Settle: 3 waits 0.84s (replaced 4.60s of fixed sleeps)' từ drv._bw_settle_log."""
+    if not log:
+        return ""
+    waited = sum(entry[0] for entry in log)
+    replaced = sum(entry[1] for entry in log if entry[1])
+    timeouts = sum(1 for entry in log if not entry[2])
+    text = f"Settle: {len(log)} waits {waited:.2f}s"
+    text += f" (replaced {replaced:.2f}s of fixed sleeps)" if replaced else ""
+    return text + (f", {timeouts} timed out" if timeouts else "")
+
+
+@pytest.fixture(name="wait_until_settled")
+def wait_until_settled_fixture(driver):
+    """wait_until_settled(replaces=3) trong test: chờ trang của driver hiện tại ổn định."""
+    def _settle(replaces=None, navigation=None, quiet_ms=SETTLE_QUIET_MS, timeout=SETTLE_TIMEOUT):
+        return wait_until_settled(driver, quiet_ms=quiet_ms, timeout=timeout, replaces=replaces,
+                                  navigation=navigation)
+    return _settle
+
+
+# --------------------------
+# Utility: pretty nodeid
+# --------------------------
+def generate_pretty_nodeid(item):
+    try:
+        fpath = getattr(item, "fspath", None)
+        if fpath:
+            file = os.path.basename(fpath)
+        else:
+            file = os.path.basename(item.nodeid.split("::", 1)[0])
+    except Exception:
+        file = "unknown"
+    try:
+        funcname = getattr(item, "name", None) or item.nodeid.split("::")[-1]
+    except Exception:
+        funcname = "test_unknown"
+    return _pretty_id(file, funcname)
+
+
+def pretty_id_for_nodeid(nodeid):
+    """Như generate_pretty_nodeid nhưng chỉ từ nodeid (controller xdist không có item)."""
+    return _pretty_id(os.path.basename(nodeid.split("::", 1)[0]), nodeid.split("::")[-1])
+
+
+def _pretty_id(file, funcname):
+    import zlib
+    file_prefix = "".join([w[0].upper() for w in file.replace(".py", "").split("_") if w])
+    slug = re.sub(r"^test_", "", funcname)
+    # crc32 thay cho hash(): hash() của str bị random hoá mỗi process nên ID không ổn định giữa các run
+    numeric = zlib.crc32(slug.encode("utf-8")) % 1000
+    return f"{file_prefix}-T{numeric:03d}"
+
+
+# --------------------------
+# Fixture: log_step
+# --------------------------
+@pytest.fixture
+def log_step(request):
+    """
+    Sử dụng trong test: log_step("Test Data: keyword=abc; qty=1")
+    """
+    pretty_id = generate_pretty_nodeid(request.node)
+    _test_steps.setdefault(pretty_id, [])
+    def _log(step_text):
+        _test_steps[pretty_id].append(step_text)
+    return _log
+
+
+# --------------------------
+# Screenshot helper
+# --------------------------
+def try_capture_screenshot_for_pretty_id(pretty_id, driver_obj=None):
+    global _driver_instance
+    screenshot_path = ""
+    try:
+        if not driver_obj:
+            driver_obj = globals().get("_driver_instance", None)
+        if not driver_obj:
+            print(f"[DEBUG] No driver available to take screenshot for {pretty_id}")
+            return ""
+        try:
+            sid = getattr(driver_obj, "session_id", None)
+            print(f"[DEBUG] Taking screenshot for {pretty_id}, session_id={sid}")
+        except Exception:
+            pass
+        sc_dir = os.path.join(os.getcwd(), "screenshots")
+        os.makedirs(sc_dir, exist_ok=True)
+        sc_file = f"{pretty_id}_{RUN_ID}.png"
+        screenshot_path = os.path.join(sc_dir, sc_file)
+        try:
+            ok = driver_obj.save_screenshot(screenshot_path)
+            print(f"[DEBUG] save_screenshot returned: {ok} -> {screenshot_path}")
+        except Exception as e:
+            print(f"[DEBUG] save_screenshot raised: {e}, trying fallback get_screenshot_as_file")
+            try:
+                driver_obj.get_screenshot_as_file(screenshot_path)
+                print(f"[DEBUG] get_screenshot_as_file succeeded -> {screenshot_path}")
+            except Exception as e2:
+                print(f"[DEBUG] get_screenshot_as_file also failed: {e2}")
+                screenshot_path = ""
+        if screenshot_path and os.path.exists(screenshot_path):
+            return screenshot_path
+        else:
+            print(f"[DEBUG] Screenshot file not found after attempts: {screenshot_path}")
+            return ""
+    except Exception as e:
+        print(f"[DEBUG] Unexpected error when capturing screenshot: {e}")
+        return ""
+
+
+# --------------------------
+# Chromedriver resolver: resolve một lần mỗi session, cache đường dẫn + version vào manifest
+# --------------------------
+DRIVER_MANIFEST = os.path.join(os.getcwd(), ".chromedriver_manifest.json")
+_chromedriver_path = None
+
+
+def _detect_chrome_version():
+    """Đọc version Chrome đã cài mà không cần mạng; trả về "" nếu không xác định được."""
+    if os.name == "nt":
+        try:
+            import winreg
+            for hive in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+                try:
+                    with winreg.OpenKey(hive, r"Software\Google\Chrome\BLBeacon") as key:
+                        return str(winreg.QueryValueEx(key, "version")[0])
+                except OSError:
+                    continue
+        except Exception:
+            pass
+        return ""
+    import subprocess
+    for exe in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser",
+                "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"):
+        if not (shutil.which(exe) or os.path.exists(exe)):
+            continue
+        try:
+            out = subprocess.run([exe, "--version"], capture_output=True, text=True, timeout=10).stdout
+            m = re.search(r"(\d+\.\d+\.\d+\.\d+)", out or "")
+            if m:
+                return m.group(1)
+        except Exception:
+            continue
+    return ""
+
+
+def _major(version):
+    return (version or "").split(".", 1)[0]
+
+
+def _read_driver_manifest():
+    try:
+        with open(DRIVER_MANIFEST, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+            return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _write_driver_manifest(path, browser_version, source):
+    entry = {
+        "path": path,
+        "browser_version": browser_version,
+        "source": source,
+        "resolved_at": datetime.now().isoformat(),
+    }
+    lock = _acquire_lock(DRIVER_MANIFEST + ".lock", timeout=10)
+    try:
+        with open(DRIVER_MANIFEST, "w", encoding="utf-8") as fh:
+            json.dump(entry, fh, indent=2)
+    except Exception as e:
+        print(f"[pytest] Could not write chromedriver manifest: {e}")
+    finally:
+        if lock:
+            _release_lock(lock)
+
+
+def resolve_chromedriver(config=None):
+    """
+    Thứ tự ưu tiên:
+    1) binary được pin qua --chromedriver hoặc biến môi trường CHROMEDRIVER_PATH (chạy offline)
+    2) manifest cũ nếu file còn tồn tại và cùng major version với Chrome đang cài
+    3) webdriver_manager (cần mạng) -> ghi manifest
+    4) chromedriver trên PATH; None để Selenium Manager tự xử lý
+    """
+    global _chromedriver_path
+    if _chromedriver_path is not None:
+        return _chromedriver_path or None
+
+    pinned = ""
+    try:
+        if config:
+            pinned = config.getoption("--chromedriver") or ""
+    except Exception:
+        pass
+    pinned = pinned or os.environ.get("CHROMEDRIVER_PATH", "")
+    browser_version = _detect_chrome_version()
+
+    if pinned:
+        if not os.path.exists(pinned):
+            raise RuntimeError(f"Pinned chromedriver not found: {pinned}")
+        _write_driver_manifest(pinned, browser_version, "pinned")
+        _chromedriver_path = pinned
+        print(f"[pytest] Using pinned chromedriver: {pinned}")
+        return pinned
+
+    cached = _read_driver_manifest()
+    cached_path = cached.get("path", "")
+    if cached_path and os.path.exists(cached_path):
+        if not browser_version or _major(cached.get("browser_version")) == _major(browser_version):
+            _chromedriver_path = cached_path
+            print(f"[pytest] Using cached chromedriver: {cached_path} (Chrome {cached.get('browser_version') or '?'})")
+            return cached_path
+
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager
+        path = ChromeDriverManager().install()
+        _write_driver_manifest(path, browser_version, "webdriver_manager")
+        _chromedriver_path = path
+        return path
+    except Exception as e:
+        print(f"[pytest] webdriver_manager failed ({e}), falling back to local chromedriver")
+
+    path = shutil.which("chromedriver") or cached_path
+    if path and os.path.exists(path):
+        _chromedriver_path = path
+        return path
+    _chromedriver_path = ""
+    return None
+
+
+# --------------------------
+# Browser pool: giữ Chrome "ấm" để các test mượn/trả thay vì launch + quit mỗi test
+# --------------------------
+LEAN_CHROME_ARGS = [
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-breakpad",
+    "--disable-dev-shm-usage",
+    "--disable-features=Translate,OptimizationHints,MediaRouter,AutofillServerCommunication",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--hide-scrollbars",
+    "--force-device-scale-factor=1",
+]
+
+
+def _browser_profile(config=None):
+    """
+    Profile chạy browser lấy từ command line:
+    - headed: Chrome có giao diện, maximize như trước
+    - headless: --headless, viewport cố định
+    - lean: headless + tắt GPU/extension/background networking/component update...
+    """
+    profile = {"browser": "chrome", "name": "headed", "viewport": (1366, 768), "network_log": False,
+               "page_load": "normal"}
+    if not config:
+        return profile
+    try:
+        profile["network_log"] = config.getoption("--resource-policy") != "off"
+        profile["page_load"] = config.getoption("--page-load-strategy")
+        profile["browser"] = (config.getoption("--browser") or "chrome").lower()
+        if config.getoption("--lean"):
+            profile["name"] = "lean"
+        elif config.getoption("--headless"):
+            profile["name"] = "headless"
+        w, h = str(config.getoption("--viewport")).lower().split("x", 1)
+        profile["viewport"] = (int(w), int(h))
+    except Exception:
+        pass
+    return profile
+
+
+def _profile_label(profile):
+    if profile["name"] == "headed":
+        return profile["browser"]
+    w, h = profile["viewport"]
+    return f"{profile['browser']} ({profile['name']} {w}x{h})"
+
+
+def _build_chrome_options(profile=None):
+    from selenium import webdriver
+    profile = profile or _browser_profile()
+    options = webdriver.ChromeOptions()
+    options.page_load_strategy = profile.get("page_load", "normal")
+    if profile["name"] == "headed":
+        options.add_argument("--start-maximized")
+    else:
+        w, h = profile["viewport"]
+        options.add_argument("--headless=new")
+        options.add_argument(f"--window-size={w},{h}")
+    if profile["name"] == "lean":
+        for arg in LEAN_CHROME_ARGS:
+            options.add_argument(arg)
+    if profile.get("network_log"):
+        # cần cho thống kê request bị chặn (collect_resource_stats)
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    return options
+
+
+def _launch_chrome(config=None):
+    try:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+    except Exception as e:
+        raise RuntimeError(f"Cannot import selenium: {e}")
+    profile = _browser_profile(config)
+    if profile["browser"] not in ("chrome", "chromium"):
+        raise RuntimeError(f"Unsupported --browser '{profile['browser']}' (only chrome is available)")
+    path = resolve_chromedriver(config)
+    service = Service(path) if path else Service()
+    drv = webdriver.Chrome(service=service, options=_build_chrome_options(profile))
+    record_browser_pids(_driver_pid(drv))
+    _install_readiness_get(drv, profile["page_load"])
+    if profile["name"] != "headed":
+        # maximize_window() trong các module test sẽ làm mất viewport cố định khi chạy headless
+        w, h = profile["viewport"]
+        drv.maximize_window = lambda: drv.set_window_size(w, h)
+    return drv
+
+
+def _append_result_note(pretty_id, note):
+    """Gắn ghi chú vào record đã có của pretty_id (dùng cho sự kiện xảy ra sau makereport)."""
+    for r in reversed(_test_results):
+        if r.get("ID") == pretty_id:
+            r["Notes"] = f"{r['Notes']}; {note}" if r.get("Notes") else note
+            return True
+    return False
+
+
+# --------------------------
+# Browser health: ping session, đo RSS renderer, dọn process chrome/chromedriver mồ côi
+# psutil là tuỳ chọn; thiếu psutil thì không đo RSS (không recycle theo RSS) và bỏ qua bước dọn process.
+# Chỉ kill process mà chính run này đã launch (ghi trong .browser_pids/<pid pytest>.json kèm
+# create_time để không nhầm PID bị tái sử dụng); dọn browser của run cũ đã chết là opt-in
+# (--kill-stale-browsers). Chrome của Puppeteer / Playwright / user khác không bao giờ bị đụng tới.
+# --------------------------
+def _driver_pid(drv):
+    try:
+        return drv.service.process.pid
+    except Exception:
+        return None
+
+
+def session_alive(drv):
+    """Ping session WebDriver; False khi chrome/chromedriver đã crash hoặc treo."""
+    try:
+        return bool(drv.session_id) and drv.execute_script("return 1") == 1
+    except Exception:
+        return False
+
+
+def browser_rss_mb(drv):
+    """Tổng RSS (MB) của các renderer process thuộc chromedriver của drv; None khi không đo được (thiếu psutil)."""
+    pid = getattr(drv, "_bw_pid", None)
+    if not pid:
+        return None
+    try:
+        import psutil
+        total = 0
+        for proc in psutil.Process(pid).children(recursive=True):
+            try:
+                if "--type=renderer" in " ".join(proc.cmdline()):
+                    total += proc.memory_info().rss
+            except psutil.Error:
+                continue
+        return total / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def kill_process_tree(pid):
+    """Kill chromedriver và toàn bộ chrome con của nó (khi quit() không thành công)."""
+    if not pid:
+        return 0
+    try:
+        import psutil
+        root = psutil.Process(pid)
+        procs = root.children(recursive=True) + [root]
+    except Exception:
+        return 0
+    for proc in procs:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+    return len(procs)
+
+
+BROWSER_PID_DIR = os.path.join(os.getcwd(), ".browser_pids")
+_pid_lock = threading.Lock()
+
+
+def _proc_started(pid):
+    """create_time của process (None nếu process không còn / thiếu psutil)."""
+    try:
+        import psutil
+        return psutil.Process(int(pid)).create_time()
+    except Exception:
+        return None
+
+
+def _pid_file(owner=None):
+    return os.path.join(BROWSER_PID_DIR, f"{owner or os.getpid()}.json")
+
+
+def record_browser_pids(driver_pid):
+    """Ghi chromedriver vừa launch + các chrome con của nó vào pid file của process pytest này."""
+    if not driver_pid:
+        return
+    pids = [driver_pid]
+    try:
+        import psutil
+        pids += [p.pid for p in psutil.Process(driver_pid).children(recursive=True)]
+    except Exception:
+        pass
+    with _pid_lock:
+        path = _pid_file()
+        data = _read_json(path, {"owner": _proc_started(os.getpid()), "pids": {}})
+        for pid in pids:
+            data["pids"][str(pid)] = _proc_started(pid)
+        os.makedirs(BROWSER_PID_DIR, exist_ok=True)
+        _write_json(path, data)
+
+
+def _kill_recorded(path):
+    data = _read_json(path, {})
+    killed = 0
+    for pid, started in (data.get("pids") or {}).items():
+        # chỉ kill khi process vẫn là process đã ghi (cùng create_time)
+        if started is not None and _proc_started(pid) == started:
+            killed += kill_process_tree(int(pid))
+    try:
+        os.remove(path)
+    except Exception:
+        pass
+    return killed
+
+
+def kill_run_browsers():
+    """Kill chrome/chromedriver do chính process này launch mà quit() chưa dọn được."""
+    with _pid_lock:
+        killed = _kill_recorded(_pid_file()) if os.path.exists(_pid_file()) else 0
+    if killed:
+        print(f"[pytest] Killed {killed} leftover chrome/chromedriver processes of this run")
+    return killed
+
+
+def kill_stale_browsers():
+    """--kill-stale-browsers: dọn browser đã ghi bởi các run pytest trước mà process chủ đã chết."""
+    if not os.path.isdir(BROWSER_PID_DIR):
+        return 0
+    killed = 0
+    for name in os.listdir(BROWSER_PID_DIR):
+        path = os.path.join(BROWSER_PID_DIR, name)
+        try:
+            owner = int(name.split(".")[0])
+        except ValueError:
+            continue
+        if owner == os.getpid():
+            continue
+        owner_started = _read_json(path, {}).get("owner")
+        if owner_started is not None and _proc_started(owner) == owner_started:
+            continue    # run đó vẫn đang chạy
+        killed += _kill_recorded(path)
+    if killed:
+        print(f"[pytest] Killed {killed} chrome/chromedriver processes left by earlier runs")
+    return killed
+
+
+STORAGE_TYPES = "local_storage,indexeddb,cache_storage,service_workers,websql,file_systems"
+
+
+def _storage_leaks(drv, origins):
+    """localStorage / sessionStorage còn sót trên từng origin qua CDP DOMStorage; None nếu không có CDP."""
+    try:
+        drv.execute_cdp_cmd("DOMStorage.enable", {})
+    except Exception:
+        return None
+    leaks = []
+    for origin in sorted(origins):
+        for local, label in ((True, "localStorage"), (False, "sessionStorage")):
+            try:
+                entries = drv.execute_cdp_cmd("DOMStorage.getDOMStorageItems", {
+                    "storageId": {"securityOrigin": origin, "isLocalStorage": local}}).get("entries", [])
+            except Exception:
+                continue
+            if entries:
+                leaks.append(f"{label} {origin}: {len(entries)} keys")
+    try:
+        drv.execute_cdp_cmd("DOMStorage.disable", {})
+    except Exception:
+        pass
+    return leaks
+
+
+class BrowserPool:
+    """
+    Pool các phiên Chrome dùng chung trong một session pytest.
+    - acquire(): lấy browser rảnh / browser đã prefetch hoặc launch mới
+    - release(): reset cookies / localStorage / sessionStorage / tab rồi trả về pool;
+      nếu sau reset vẫn còn state (leak) thì browser bị loại bỏ để không ảnh hưởng test sau
+    - prefetch: launch browser kế tiếp trên thread nền trong lúc test hiện tại chạy,
+      số lượng giới hạn bởi số test cần browser còn lại; quit() cũng chạy nền
+    - health: tái chế browser sau recycle_after test hoặc khi RSS renderer vượt max_rss_mb,
+      thay session chết (ping thất bại) và kill process của browser không quit được
+    """
+
+    def __init__(self, factory, size=1, prefetch=0, plan=None, recycle_after=0, max_rss_mb=0):
+        self.factory = factory
+        self.size = max(0, int(size))
+        self.prefetch = max(0, int(prefetch))
+        self.recycle_after = max(0, int(recycle_after))
+        self.max_rss_mb = max(0.0, float(max_rss_mb))
+        self._plan = {nodeid: i for i, nodeid in enumerate(plan or [])}
+        self._remaining = len(self._plan) if self._plan else float("inf")
+        self._position = -1
+        self._dropped = set()    # nodeid trong plan sẽ không chạy (bị circuit breaker chặn)
+        self._idle = []
+        self._pending = []    # futures của browser đang launch nền
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._events = []     # sự kiện recycle / session chết, driver fixture gắn vào kết quả
+        self.launched = 0
+        self.reused = 0
+        self.prefetched = 0
+        self.recycled = 0
+        self.dead = 0
+        self.leaks = []   # [(pretty_id, [leak, ...])]
+
+    def _pool_executor(self):
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=max(2, self.prefetch + 1), thread_name_prefix="browser-pool")
+        return self._executor
+
+    def _launch(self):
+        drv = self.factory()
+        drv._bw_pid = _driver_pid(drv)
+        drv._bw_uses = 0
+        with self._lock:    # _launch cũng chạy trên thread prefetch
+            self.launched += 1
+        return drv
+
+    def acquire(self, nodeid=None, state=None):
+        if nodeid in self._plan:
+            self._position = self._plan[nodeid]
+            self._update_remaining()
+        drv = None
+        while drv is None:
+            with self._lock:
+                candidate = None
+                if self._idle:
+                    # ưu tiên browser còn giữ đúng state precondition của test này
+                    same = [d for d in self._idle if getattr(d, "_bw_state", None) == state]
+                    candidate = same[-1] if same else self._idle[-1]
+                    self._idle.remove(candidate)
+                future = self._pending.pop(0) if candidate is None and self._pending else None
+            if candidate is not None:
+                if session_alive(candidate):
+                    kept = getattr(candidate, "_bw_state", None)
+                    if kept and kept != state:
+                        leaks = self.reset(candidate)
+                        if leaks:
+                            self.leaks.append((nodeid, leaks))
+                            self._discard(candidate)
+                            continue
+                    self.reused += 1
+                    drv = candidate
+                else:
+                    self.dead += 1
+                    self._events.append("Dead browser session replaced")
+                    self._discard(candidate, kill=True)
+            elif future is not None:
+                try:
+                    drv = future.result()
+                    self.prefetched += 1
+                except Exception as e:
+                    print(f"[pytest] Prefetched browser failed to start: {e}")
+            else:
+                drv = self._launch()
+        drv._bw_uses = getattr(drv, "_bw_uses", 0) + 1
+        self._in_use += 1
+        self._top_up()
+        return drv
+
+    def _update_remaining(self):
+        later = sum(1 for n in self._dropped if self._plan[n] > self._position)
+        self._remaining = len(self._plan) - self._position - 1 - later
+
+    def drop(self, nodeids):
+        """Bỏ khỏi plan các test sẽ bị skip lúc chạy để prefetch không launch browser thừa cho chúng."""
+        if not self._plan:
+            return
+        self._dropped.update(n for n in nodeids if n in self._plan)
+        self._update_remaining()
+
+    def _top_up(self):
+        """Giữ đủ số browser sẵn sàng cho các test kế tiếp (không vượt quá số test còn lại)."""
+        if not self.prefetch:
+            return
+        target = min(self.prefetch, self._remaining)
+        with self._lock:
+            # browser đang dùng sẽ quay lại pool nếu pool giữ browser rảnh
+            ready = len(self._idle) + len(self._pending) + (self._in_use if self.size else 0)
+            missing = target - ready
+            for _ in range(max(0, missing)):
+                self._pending.append(self._pool_executor().submit(self._launch))
+
+    def _recycle_reason(self, drv):
+        uses = getattr(drv, "_bw_uses", 0)
+        if self.recycle_after and uses >= self.recycle_after:
+            return f"Browser recycled after {uses} tests"
+        if self.max_rss_mb:
+            rss = browser_rss_mb(drv)
+            if rss is not None and rss > self.max_rss_mb:
+                return f"Browser recycled: renderer RSS {rss:.0f} MB > {self.max_rss_mb:.0f} MB"
+        return ""
+
+    def release(self, drv, pretty_id="", keep_state=None):
+        """keep_state: state precondition mà test vừa chạy muốn giữ lại cho test kế tiếp cùng nhóm."""
+        self._in_use = max(0, self._in_use - 1)
+        if not session_alive(drv):
+            self.dead += 1
+            self._events.append("Browser session died during test (chrome/chromedriver crashed or hung)")
+            self._discard(drv, kill=True)
+            self._top_up()
+            return []
+        try:
+            self._reset_page(drv)
+            if keep_state and getattr(drv, "_bw_state", None) == keep_state and state_survived(drv, keep_state):
+                leaks = []
+            else:
+                leaks = self.reset(drv)
+        except Exception as e:
+            leaks = [f"reset failed: {e}"]
+        reason = "" if leaks else self._recycle_reason(drv)
+        if leaks:
+            self.leaks.append((pretty_id, leaks))
+            print(f"[pytest] Browser state leaked after {pretty_id}: {leaks} -> discarding browser")
+            self._discard(drv)
+            self._top_up()
+        elif reason:
+            self.recycled += 1
+            self._events.append(reason)
+            print(f"[pytest] {reason} ({pretty_id})")
+            self._discard(drv)
+            self._top_up()
+        elif self._remaining > 0 and len(self._idle) < self.size:
+            with self._lock:
+                self._idle.append(drv)
+        else:
+            self._discard(drv)
+        return leaks
+
+    def pop_events(self):
+        events, self._events = self._events, []
+        return events
+
+    def _reset_page(self, drv):
+        """Phần reset không đụng tới cookie/storage: tab thừa, alert, URL bị chặn, implicit wait."""
+        handles = drv.window_handles
+        for h in handles[1:]:
+            try:
+                drv.switch_to.window(h)
+                drv.close()
+            except Exception:
+                pass
+        drv.switch_to.window(handles[0])
+        try:
+            drv.switch_to.alert.dismiss()
+        except Exception:
+            pass
+        try:
+            drv.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+        except Exception:
+            pass
+        drv.implicitly_wait(0)
+        drv._bw_active_handle = None
+        drv._bw_page_load = None
+        drv._bw_nav = []
+        drv._bw_settle_log = []
+        drv._bw_readiness_misses = []
+
+    def reset(self, drv):
+        """
+        Xóa state của browser, trả về danh sách state còn sót lại sau khi reset.
+        Cookie xóa / kiểm tra trên mọi origin; storage trên mọi origin đã mở từ lần reset trước
+        (kể cả origin hiện tại và APP_BASE_URL), không chỉ origin của trang đang mở.
+        """
+        self._reset_page(drv)
+        origins = set(getattr(drv, "_bw_origins", ())) | {_url_origin(APP_BASE_URL)}
+        try:
+            origins.add(_url_origin(drv.current_url))
+        except Exception:
+            pass
+        origins.discard(None)
+        try:
+            drv.execute_script("try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}")
+        except Exception:
+            pass
+        for origin in origins:
+            try:
+                drv.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": STORAGE_TYPES})
+            except Exception:
+                pass
+            try:
+                # sessionStorage thuộc tab, clearDataForOrigin không xóa được
+                drv.execute_cdp_cmd("DOMStorage.clear", {"storageId": {"securityOrigin": origin, "isLocalStorage": False}})
+            except Exception:
+                pass
+        try:
+            drv.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        except Exception:
+            pass
+        try:
+            drv.delete_all_cookies()
+        except Exception:
+            pass
+        drv._bw_state = None
+        drv._bw_state_who = None
+        drv._bw_visited = []
+        drv._bw_origins = set()
+        leaks = []
+        if getattr(drv, "_bw_contexts", None):
+            leaks.append(f"{len(drv._bw_contexts)} browser contexts still open")
+        if len(drv.window_handles) != 1:
+            leaks.append(f"{len(drv.window_handles)} windows open")
+        try:
+            cookies = drv.execute_cdp_cmd("Network.getAllCookies", {}).get("cookies", [])
+        except Exception:
+            cookies = drv.get_cookies()
+        if cookies:
+            leaks.append("cookies: " + ",".join(sorted({c.get("name", "") for c in cookies})))
+        storage = _storage_leaks(drv, origins)
+        if storage is None:
+            # không có CDP (browser khác Chrome): chỉ kiểm tra được origin hiện tại
+            try:
+                sizes = drv.execute_script(
+                    "try { return [window.localStorage.length, window.sessionStorage.length]; } catch (e) { return [0, 0]; }"
+                ) or [0, 0]
+                storage = [f"{label}: {n} keys" for label, n in zip(("localStorage", "sessionStorage"), sizes) if n]
+            except Exception:
+                storage = []
+        leaks.extend(storage)
+        drv.get("about:blank")
+        return leaks
+
+    def close_all(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            idle, self._idle = self._idle, []
+        for fut in pending:
+            if not fut.cancel():
+                try:
+                    idle.append(fut.result())
+                except Exception:
+                    pass
+        for drv in idle:
+            self._discard(drv)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        killed = kill_run_browsers()
+        print(f"\n[pytest] Browser pool: launched={self.launched}, reused={self.reused}, "
+              f"prefetched={self.prefetched}, recycled={self.recycled}, dead={self.dead}, "
+              f"leaks={len(self.leaks)}, leftovers_killed={killed}")
+
+    def _discard(self, drv, kill=False):
+        """quit() browser (trên thread nền nếu có); kill cả cây process nếu quit không được."""
+        pid = getattr(drv, "_bw_pid", None)
+
+        def _do_quit():
+            try:
+                drv.quit()
+            except Exception:
+                kill_process_tree(pid)
+                return
+            if kill:
+                kill_process_tree(pid)
+        if self._executor is not None:
+            self._executor.submit(_do_quit)
+        else:
+            _do_quit()
+
+
+def _browser_test_plan(session):
+    """nodeid của các test sẽ mượn browser, theo đúng thứ tự chạy."""
+    if xdist_worker_id(session.config):
+        # worker xdist chỉ nhận một phần items và không biết trước phần nào -> không có plan
+        return []
+    plan = []
+    for it in getattr(session, "items", []):
+        # test đã bị skip lúc collect (preflight...) sẽ không mượn browser
+        if it.get_closest_marker("skip") or uses_http_engine(it):
+            continue
+        if "driver" in getattr(it, "fixturenames", ()):
+            plan.append(it.nodeid)
+    return plan
+
+
+@pytest.fixture(scope="session")
+def browser_pool(request):
+    config = request.config
+    if config.getoption("--kill-stale-browsers"):
+        kill_stale_browsers()
+    pool = BrowserPool(lambda: _launch_chrome(config), size=config.getoption("--pool-size"),
+                       prefetch=config.getoption("--prefetch"), plan=_browser_test_plan(request.session),
+                       recycle_after=config.getoption("--recycle-after"),
+                       max_rss_mb=config.getoption("--recycle-rss-mb"))
+    config._bw_browser_pool = pool
+    yield pool
+    pool.close_all()
+
+
+# --------------------------
+# HTTP-only engine: requests + lxml cho các test chỉ đọc markup tĩnh
+# Test opt-in bằng @pytest.mark.http_only -> fixture `driver` trả về HttpPage thay vì Chrome
+# --------------------------
+_http_adapter = None
+
+
+def _shared_http_adapter():
+    """Một HTTPAdapter dùng chung => connection pool dùng chung giữa các HttpPage."""
+    global _http_adapter
+    if _http_adapter is None:
+        from requests.adapters import HTTPAdapter
+        _http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+    return _http_adapter
+
+
+def _new_http_session():
+    try:
+        import requests
+    except Exception as e:
+        raise RuntimeError(f"Cannot import requests: {e}")
+    s = requests.Session()
+    adapter = _shared_http_adapter()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers["User-Agent"] = "Mozilla/5.0 (BookwormsTests; http-only)"
+    return s
+
+
+def _selenium_exception(name):
+    try:
+        from selenium.common import exceptions
+        return getattr(exceptions, name)
+    except Exception:
+        return type(name, (Exception,), {})
+
+
+_HIDDEN_TAGS = {"head", "script", "style", "template", "meta", "title", "link", "noscript"}
+_ENTER_KEYS = ("\n", "\ue006", "\ue007")  # newline, Keys.RETURN, Keys.ENTER
+# breakpoint của Bootstrap (min-width px): d-none d-lg-block chỉ ẩn khi viewport < 992px
+_BOOTSTRAP_BREAKPOINTS = (("", 0), ("sm", 576), ("md", 768), ("lg", 992), ("xl", 1200), ("xxl", 1400))
+_DISPLAY_CLASS = re.compile(r"^d-(?:(sm|md|lg|xl|xxl)-)?([a-z-]+)$")
+
+
+def _class_display(classes, viewport_width):
+    """Giá trị display mà các class d-* / d-{bp}-* của Bootstrap cho ra ở viewport này (None nếu không có)."""
+    by_bp = {}
+    for cls in classes:
+        m = _DISPLAY_CLASS.match(cls)
+        if m:
+            by_bp[m.group(1) or ""] = m.group(2)
+    display = None
+    for bp, min_width in _BOOTSTRAP_BREAKPOINTS:
+        if bp in by_bp and viewport_width >= min_width:
+            display = by_bp[bp]
+    return display
+
+
+def _node_hidden(node, viewport_width):
+    """Bản thân node bị ẩn (không xét tổ tiên)."""
+    if not isinstance(node.tag, str):
+        return True
+    tag = node.tag.lower()
+    style = (node.get("style") or "").replace(" ", "").lower()
+    return (tag in _HIDDEN_TAGS or node.get("hidden") is not None
+            or "display:none" in style or "visibility:hidden" in style
+            or _class_display((node.get("class") or "").split(), viewport_width) == "none"
+            or (tag == "input" and (node.get("type") or "").lower() == "hidden"))
+
+
+class HttpElement:
+    """Bọc một lxml element với API giống WebElement (phần các test đọc markup hay dùng)."""
+
+    def __init__(self, page, el):
+        self._page = page
+        self._el = el
+
+    @property
+    def tag_name(self):
+        return str(self._el.tag).lower()
+
+    @property
+    def text(self):
+        if not self.is_displayed():
+            return ""
+        width = self._page.viewport_width
+        parts = [self._el.text or ""]
+        stack = list(reversed(self._el))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+                continue
+            # tail thuộc về cha nên vẫn hiển thị kể cả khi node bị ẩn
+            if node.tail:
+                stack.append(node.tail)
+            if _node_hidden(node, width):
+                continue
+            if node.text:
+                parts.append(node.text)
+            stack.extend(reversed(node))
+        return re.sub(r"\s+", " ", " ".join(parts)).strip()
+
+    def get_attribute(self, name):
+        if name in ("textContent", "innerText"):
+            return self.text
+        if name == "innerHTML":
+            from lxml import html as lxml_html
+            return "".join(lxml_html.tostring(c, encoding="unicode") for c in self._el)
+        value = self._el.get(name)
+        if value is not None and name in ("href", "src", "action"):
+            from urllib.parse import urljoin
+            return urljoin(self._page.current_url, value)
+        return value
+
+    def get_dom_attribute(self, name):
+        return self._el.get(name)
+
+    def is_displayed(self):
+        node = self._el
+        while node is not None:
+            if _node_hidden(node, self._page.viewport_width):
+                return False
+            node = node.getparent()
+        return True
+
+    def is_enabled(self):
+        return self._el.get("disabled") is None
+
+    def is_selected(self):
+        return self._el.get("checked") is not None or self._el.get("selected") is not None
+
+    def find_element(self, by="id", value=None):
+        return self._page._find(self._el, by, value, single=True)
+
+    def find_elements(self, by="id", value=None):
+        return self._page._find(self._el, by, value, single=False)
+
+    def clear(self):
+        if self.tag_name == "textarea":
+            self._el.text = ""
+        else:
+            self._el.set("value", "")
+
+    def send_keys(self, *values):
+        text = "".join(str(v) for v in values)
+        submit = any(k in text for k in _ENTER_KEYS)
+        for k in _ENTER_KEYS:
+            text = text.replace(k, "")
+        if self.tag_name == "textarea":
+            self._el.text = (self._el.text or "") + text
+        else:
+            self._el.set("value", (self._el.get("value") or "") + text)
+        if submit:
+            # Enter trong input = implicit submission: trình duyệt gửi kèm nút submit mặc định của form
+            self.submit(submitter=self._default_submitter())
+
+    def click(self):
+        tag = self.tag_name
+        if tag == "a":
+            href = self._el.get("href") or ""
+            if href and not href.startswith("#") and not href.lower().startswith("javascript:"):
+                self._page.get(self.get_attribute("href"))
+            return
+        btn_type = (self._el.get("type") or ("submit" if tag == "button" else "")).lower()
+        if tag in ("button", "input") and btn_type in ("submit", "image"):
+            self.submit(submitter=self)
+
+    def _form(self):
+        if self.tag_name == "form":
+            return self._el
+        return next((a for a in self._el.iterancestors() if isinstance(a.tag, str) and a.tag.lower() == "form"), None)
+
+    def _default_submitter(self):
+        """Nút submit đầu tiên của form chứa element (None nếu không có)."""
+        form = self._form()
+        if form is None:
+            return None
+        for node in form.iter("button", "input"):
+            btn_type = (node.get("type") or ("submit" if node.tag.lower() == "button" else "")).lower()
+            if btn_type in ("submit", "image") and node.get("disabled") is None:
+                return HttpElement(self._page, node)
+        return None
+
+    def submit(self, submitter=None, headers=None):
+        form = self._form()
+        if form is None:
+            return
+        self._page._submit_form(form, submitter, headers=headers)
+
+    def screenshot(self, filename):
+        return False
+
+    def value_of_css_property(self, name):
+        m = re.search(rf"(?:^|;)\s*{re.escape(name)}\s*:\s*([^;]+)", self._el.get("style") or "")
+        return m.group(1).strip() if m else ""
+
+
+def http_script_kind(script):
+    """Loại script mà HttpPage.execute_script giả lập được ("scroll" / "click" / "ready"), ngược lại ""."""
+    s = str(script).replace(" ", "")
+    if "scrollIntoView" in s or "scrollTo" in s:
+        return "scroll"
+    if "arguments[0].click()" in s:
+        return "click"
+    if "document.readyState" in s:
+        return "ready"
+    return ""
+
+
+_EXECUTE_SCRIPT_CALL = re.compile(r"execute_(?:async_)?script\(\s*(?:[rRuU]?(['\"])(.*?)(?<!\\)\1)?", re.S)
+
+
+def http_only_blocker(item):
+    """
+    Lý do test http_only không chạy được trên HttpPage ("" nếu được): source của test và fixture
+    trong cùng module gọi execute_script với script engine không giả lập được (hoặc script không
+    phải literal).
+    """
+    funcs = [getattr(item, "obj", None)]
+    module = getattr(getattr(item, "module", None), "__name__", None)
+    info = getattr(item, "_fixtureinfo", None)
+    for defs in (getattr(info, "name2fixturedefs", None) or {}).values():
+        funcs.extend(fd.func for fd in defs if getattr(fd.func, "__module__", None) == module)
+    for func in funcs:
+        try:
+            source = inspect.getsource(func)
+        except Exception:
+            continue
+        for m in _EXECUTE_SCRIPT_CALL.finditer(source):
+            script = m.group(2)
+            if script is None:
+                return f"{func.__name__} passes a non-literal script to execute_script"
+            if not http_script_kind(script):
+                return f"{func.__name__} runs JavaScript the HTTP engine cannot emulate: {script[:60]}"
+    return ""
+
+
+def apply_http_only_gate(config, items):
+    """Test http_only có JavaScript ngoài khả năng của HttpPage chạy trên Chrome thay vì lỗi giữa chừng."""
+    for item in items:
+        if not item.get_closest_marker("http_only"):
+            continue
+        reason = http_only_blocker(item)
+        if reason:
+            item._bw_http_blocker = reason
+            print(f"\n[pytest] http_only ignored for {item.nodeid}: {reason}")
+
+
+def uses_http_engine(item):
+    return bool(item.get_closest_marker("http_only")) and not getattr(item, "_bw_http_blocker", "")
+
+
+class HttpPage:
+    """
+    "Driver" không cần browser: GET trang bằng requests (connection pool dùng chung),
+    parse bằng lxml và hỗ trợ find_element(s) theo các kiểu By của Selenium.
+    Không chạy JavaScript; execute_script chỉ hiểu click() / scrollIntoView mà các test dùng.
+    """
+
+    engine = "http"
+
+    def __init__(self, session=None, timeout=10, viewport_width=1366):
+        self.http = session or _new_http_session()
+        self.timeout = timeout
+        self.viewport_width = viewport_width  # để resolve các class d-{bp}-* giống Chrome của profile
+        self.session_id = None
+        self.current_url = "about:blank"
+        self.page_source = ""
+        self.status_code = None
+        self._doc = None
+        self._history = []
+
+    # --- navigation ---
+    def _load(self, resp):
+        ctype = resp.headers.get("content-type", "").lower()
+        if "charset" not in ctype:
+            resp.encoding = "utf-8"
+        self.status_code = resp.status_code
+        self.current_url = resp.url
+        self.page_source = resp.text
+        self._history.append(resp.url)
+        try:
+            from lxml import html as lxml_html
+        except Exception as e:
+            raise RuntimeError(f"Cannot import lxml: {e}")
+        self._doc = lxml_html.document_fromstring(self.page_source) if self.page_source.strip() else None
+
+    def get(self, url):
+        self._load(self.http.get(url, timeout=self.timeout))
+
+    def refresh(self):
+        if self._history:
+            self._history.pop()
+            self.get(self.current_url)
+
+    def back(self):
+        if len(self._history) > 1:
+            self._history.pop()
+            self.get(self._history.pop())
+
+    def _submit_form(self, form, submitter=None, headers=None):
+        from urllib.parse import urljoin
+        data = []
+        for field in form.iter("input", "select", "textarea"):
+            name = field.get("name")
+            if not name or field.get("disabled") is not None:
+                continue
+            tag = field.tag.lower()
+            ftype = (field.get("type") or "").lower()
+            if tag == "input" and ftype in ("submit", "button", "image", "reset", "file"):
+                continue
+            if tag == "input" and ftype in ("checkbox", "radio") and field.get("checked") is None:
+                continue
+            if tag == "select":
+                opts = [o for o in field.iter("option") if o.get("selected") is not None] or list(field.iter("option"))[:1]
+                data.extend((name, o.get("value", o.text_content())) for o in opts)
+            elif tag == "textarea":
+                data.append((name, field.text or ""))
+            else:
+                data.append((name, field.get("value", "on" if ftype in ("checkbox", "radio") else "")))
+        if submitter is not None and submitter._el.get("name"):
+            data.append((submitter._el.get("name"), submitter._el.get("value", "")))
+        action = urljoin(self.current_url, form.get("action") or self.current_url)
+        if (form.get("method") or "get").lower() == "post":
+            resp = self.http.post(action, data=data, headers=headers, timeout=self.timeout)
+        else:
+            resp = self.http.get(action, params=data, headers=headers, timeout=self.timeout)
+        self._load(resp)
+
+    # --- lookup ---
+    @property
+    def title(self):
+        if self._doc is None:
+            return ""
+        t = self._doc.find(".//title")
+        return re.sub(r"\s+", " ", t.text_content()).strip() if t is not None else ""
+
+    def find_element(self, by="id", value=None):
+        return self._find(self._doc, by, value, single=True)
+
+    def find_elements(self, by="id", value=None):
+        return self._find(self._doc, by, value, single=False)
+
+    def _find(self, root, by, value, single):
+        nodes = [] if root is None else self._query(root, by, value)
+        if single:
+            if not nodes:
+                raise _selenium_exception("NoSuchElementException")(f"HTTP engine: no element for {by}={value!r}")
+            return HttpElement(self, nodes[0])
+        return [HttpElement(self, n) for n in nodes]
+
+    def _query(self, root, by, value):
+        if by == "id":
+            return root.xpath(".//*[@id=$v]", v=value)
+        if by == "name":
+            return root.xpath(".//*[@name=$v]", v=value)
+        if by == "tag name":
+            return root.xpath(".//*[local-name()=$v]", v=value.lower())
+        if by == "class name":
+            return root.xpath(".//*[contains(concat(' ', normalize-space(@class), ' '), $v)]", v=f" {value} ")
+        if by in ("link text", "partial link text"):
+            links = root.xpath(".//a")
+            if by == "link text":
+                return [a for a in links if HttpElement(self, a).text == value]
+            return [a for a in links if value in HttpElement(self, a).text]
+        if by == "xpath":
+            return [n for n in root.xpath(value) if hasattr(n, "tag")]
+        if by == "css selector":
+            try:
+                from lxml.cssselect import CSSSelector
+                return [n for n in CSSSelector(value)(root) if n is not root]
+            except ImportError as e:
+                raise RuntimeError(f"CSS selectors need the 'cssselect' package: {e}")
+            except Exception as e:
+                raise _selenium_exception("InvalidSelectorException")(f"HTTP engine: unsupported selector {value!r}: {e}")
+        raise ValueError(f"HTTP engine: unsupported locator strategy {by!r}")
+
+    # --- WebDriver compatibility ---
+    def execute_script(self, script, *args):
+        kind = http_script_kind(script)
+        if kind == "scroll":
+            return None
+        if kind == "click" and args:
+            return args[0].click()
+        if kind == "ready":
+            return "complete"
+        raise _selenium_exception("JavascriptException")(f"HTTP engine cannot run JavaScript: {script[:80]}")
+
+    def get_cookies(self):
+        return [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path} for c in self.http.cookies]
+
+    def add_cookie(self, cookie):
+        self.http.cookies.set(cookie["name"], cookie["value"], path=cookie.get("path", "/"))
+
+    def delete_all_cookies(self):
+        self.http.cookies.clear()
+
+    def save_screenshot(self, filename):
+        return False
+
+    get_screenshot_as_file = save_screenshot
+
+    def maximize_window(self):
+        pass
+
+    def set_window_size(self, *a, **k):
+        pass
+
+    def implicitly_wait(self, *a, **k):
+        pass
+
+    def quit(self):
+        self.http.close()
+
+
+@pytest.fixture
+def page(request):
+    """Engine HTTP thuần (requests + lxml), dùng trực tiếp hoặc qua marker http_only."""
+    global _driver_instance
+    pg = HttpPage(viewport_width=_browser_profile(request.config)["viewport"][0])
+    _driver_instance = pg
+    try:
+        request.node._driver = pg
+    except Exception:
+        pass
+    yield pg
+    pg.quit()
+    _driver_instance = None
+
+
+# --------------------------
+# Test account pool: mỗi worker / mỗi role mượn một tài khoản riêng để cart và lịch sử đơn
+# hàng không bị các worker song song giẫm lên nhau. Pool khai báo trong test_accounts.json,
+# lease ghi ở test_accounts.leases.json (có lock); hết tài khoản thì đăng ký thêm hàng loạt.
+# --------------------------
+ACCOUNTS_FILE = os.path.join(os.getcwd(), "test_accounts.json")
+LEASES_FILE = os.path.join(os.getcwd(), "test_accounts.leases.json")
+ACCOUNT_BATCH = 4
+LEASE_TTL = 6 * 3600   # lease cũ hơn mức này (process chủ không xác định được) coi như bỏ
+
+DEFAULT_ACCOUNTS = {
+    "user": [
+        {"email": "user@gmail.com", "password": "123456", "traits": ["orders"]},
+        {"email": "duy123@gmail.com", "password": "duy123", "traits": []},
+    ],
+    "admin": [
+        {"email": "admin@gmail.com", "password": "123123", "traits": []},
+    ],
+}
+
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _lease_is_stale(lease):
+    pid = lease.get("pid")
+    try:
+        import psutil
+        if pid and not psutil.pid_exists(pid):
+            return True
+    except Exception:
+        pass
+    return time.time() - lease.get("ts", 0) > LEASE_TTL
+
+
+def register_account(email, password, name="Bookworms Test"):
+    """Đăng ký một tài khoản qua form /register (engine HTTP, giữ nguyên hidden field/CSRF)."""
+    pg = HttpPage()
+    try:
+        pg.get(f"{APP_BASE_URL}/register")
+        values = {"name": name, "email": email, "password": password, "password_confirmation": password}
+        for field, value in values.items():
+            for el in pg.find_elements("name", field):
+                el.clear()
+                el.send_keys(value)
+        pg.find_element("name", "email").submit()
+        return "register" not in (pg.current_url or "")
+    except Exception as e:
+        print(f"[pytest] Could not register test account {email}: {e}")
+        return False
+    finally:
+        pg.quit()
+
+
+class AccountPool:
+    """
+    Lease tài khoản test theo (role, traits) cho worker hiện tại, giữ đến hết session.
+    - Tài khoản đang được worker khác lease sẽ không được cấp lại (trừ lease đã chết)
+    - role "user" hết tài khoản -> đăng ký ACCOUNT_BATCH tài khoản mới cùng lúc
+    - ưu tiên tài khoản có ít trait thừa nhất, để lease không traits không chiếm mất tài khoản
+      hiếm như "orders"; tài khoản có trait thừa chỉ được dùng khi không đăng ký thêm được
+    - không đáp ứng được (admin, hoặc traits mà tài khoản mới không có như "orders")
+      -> dùng chung tài khoản ít trait thừa nhất, cảnh báo ngay lúc lease và trong tổng kết session
+    """
+
+    def __init__(self, owner, batch=ACCOUNT_BATCH):
+        self.owner = owner
+        self.batch = batch
+        self._leased = {}     # {(role, traits): account}
+        self._lock = threading.Lock()
+        self.provisioned = 0
+        self.shared = []
+
+    def _file_lock(self):
+        lock = _acquire_lock(ACCOUNTS_FILE + ".lock", timeout=30)
+        if not lock:
+            raise PermissionError("Could not acquire lock on test account pool")
+        return lock
+
+    def _accounts(self):
+        accounts = _read_json(ACCOUNTS_FILE, None)
+        if accounts is None:
+            accounts = json.loads(json.dumps(DEFAULT_ACCOUNTS))
+            _write_json(ACCOUNTS_FILE, accounts)
+        return accounts
+
+    def _pick(self, accounts, leases, role, traits, max_extra=None):
+        held = {a["email"] for a in self._leased.values()}
+        free = []
+        for acc in accounts.get(role, []):
+            if acc["email"] in held or not set(traits) <= set(acc.get("traits", [])):
+                continue
+            lease = leases.get(acc["email"])
+            if lease and lease.get("owner") != self.owner and not _lease_is_stale(lease):
+                continue
+            free.append(acc)
+        if max_extra is not None:
+            free = [a for a in free if self._extra(a, traits) <= max_extra]
+        # min() giữ thứ tự khai báo khi số trait thừa bằng nhau
+        return min(free, key=lambda a: self._extra(a, traits), default=None)
+
+    @staticmethod
+    def _extra(acc, traits):
+        """Số trait của tài khoản mà lease không cần."""
+        return len(set(acc.get("traits", [])) - set(traits))
+
+    def lease(self, role="user", traits=()):
+        key = (role, tuple(sorted(traits)))
+        with self._lock:
+            if key in self._leased:
+                return self._leased[key]
+            lock = self._file_lock()
+            try:
+                accounts = self._accounts()
+                leases = _read_json(LEASES_FILE, {})
+                acc = self._pick(accounts, leases, role, traits, max_extra=0)
+                if acc is None and role == "user" and not traits:
+                    new = self.provision(role, self.batch)
+                    accounts.setdefault(role, []).extend(new)
+                    _write_json(ACCOUNTS_FILE, accounts)
+                    acc = new[0] if new else None
+                if acc is None:
+                    acc = self._pick(accounts, leases, role, traits)
+                if acc is None:
+                    candidates = [a for a in accounts.get(role, []) if set(traits) <= set(a.get("traits", []))]
+                    if not candidates:
+                        raise RuntimeError(f"No test account for role={role} traits={list(traits)} in {ACCOUNTS_FILE}")
+                    # tài khoản chính worker này đang giữ vẫn cô lập với worker khác -> dùng lại trước
+                    held = {a["email"] for a in self._leased.values()}
+                    acc = min(candidates, key=lambda a: (a["email"] not in held, self._extra(a, traits)))
+                    holder = leases.get(acc["email"], {}).get("owner", "?")
+                    if acc["email"] not in held and holder != self.owner:
+                        self.shared.append(acc["email"])
+                        print(f"[pytest] WARNING: no free {role} account {list(traits)} -> {acc['email']} is SHARED "
+                              f"with {holder}; its cart/orders are not isolated from that worker")
+                else:
+                    leases[acc["email"]] = {"owner": self.owner, "pid": os.getpid(), "ts": time.time(), "role": role}
+                    _write_json(LEASES_FILE, leases)
+            finally:
+                _release_lock(lock)
+            self._leased[key] = acc
+            return acc
+
+    def is_shared(self, email):
+        return email in self.shared
+
+    def provision(self, role, count):
+        """Đăng ký count tài khoản mới song song; chỉ trả về tài khoản đăng ký thành công."""
+        import uuid
+        from concurrent.futures import ThreadPoolExecutor
+        fresh = [{"email": f"bw_{role}_{RUN_ID}_{uuid.uuid4().hex[:8]}@mail.com", "password": "123456",
+                  "traits": [], "provisioned": RUN_ID} for _ in range(max(1, count))]
+        with ThreadPoolExecutor(max_workers=len(fresh)) as ex:
+            ok = list(ex.map(lambda a: register_account(a["email"], a["password"]), fresh))
+        created = [a for a, good in zip(fresh, ok) if good]
+        self.provisioned += len(created)
+        print(f"[pytest] Provisioned {len(created)}/{len(fresh)} {role} test accounts")
+        return created
+
+    def release_all(self):
+        if not self._leased:
+            return
+        lock = _acquire_lock(ACCOUNTS_FILE + ".lock", timeout=10)
+        try:
+            leases = _read_json(LEASES_FILE, {})
+            for acc in self._leased.values():
+                if leases.get(acc["email"], {}).get("owner") == self.owner:
+                    leases.pop(acc["email"], None)
+            _write_json(LEASES_FILE, leases)
+        except Exception as e:
+            print(f"[pytest] Could not release test account leases: {e}")
+        finally:
+            if lock:
+                _release_lock(lock)
+        self._leased = {}
+
+
+@pytest.fixture(scope="session")
+def account_pool(request):
+    owner = f"{RUN_ID}:{xdist_worker_id(request.config) or 'main'}"
+    pool = AccountPool(owner)
+    yield pool
+    if pool.shared:
+        print(f"\n[pytest] Test accounts shared with other workers: {', '.join(sorted(set(pool.shared)))}")
+    pool.release_all()
+
+
+@pytest.fixture
+def lease_account(account_pool):
+    """Factory: lease_account("user", traits=("orders",)) -> {"email", "password", ...}."""
+    return account_pool.lease
+
+
+@pytest.fixture
+def user_account(account_pool):
+    return account_pool.lease("user")
+
+
+@pytest.fixture
+def admin_account(account_pool):
+    return account_pool.lease("admin")
+
+
+# --------------------------
+# Session cache: đăng nhập một lần cho mỗi tài khoản (HTTP POST /login, form trong browser nếu
+# không được), lưu cookie jar (PHPSESSID...) vào .session_cache.json; các test sau chỉ inject cookie.
+# Cookie cache được kiểm tra hạn (expiry / SESSION_TTL) và thử bằng một request HTTP trước khi dùng.
+# --------------------------
+SESSION_CACHE_FILE = os.path.join(os.getcwd(), ".session_cache.json")
+SESSION_TTL = 20 * 60     # PHP mặc định gc session sau 24 phút không dùng
+LOGIN_PAGE_URL = f"{APP_BASE_URL}/login"
+
+
+def _cookies_expired(entry):
+    now = time.time()
+    if now - entry.get("created", 0) > SESSION_TTL:
+        return True
+    return any(c.get("expiry") and c["expiry"] < now for c in entry.get("cookies", []))
+
+
+def _set_http_cookies(http, cookies):
+    for c in cookies:
+        # cookiejar không khớp domain không có dấu chấm (localhost) -> để trống = host-only
+        domain = c.get("domain", "").lstrip(".")
+        http.cookies.set(c["name"], c["value"], domain=domain if "." in domain else "", path=c.get("path", "/"))
+
+
+def session_cookies_valid(cookies):
+    """Gửi cookie lên trang home bằng engine HTTP; hợp lệ nếu server vẫn coi là đã đăng nhập."""
+    pg = HttpPage()
+    try:
+        _set_http_cookies(pg.http, cookies)
+        pg.get(f"{APP_BASE_URL}/home")
+        return bool(pg.find_elements("css selector", LOGGED_IN_CSS))
+    except Exception:
+        return False
+    finally:
+        pg.quit()
+
+
+def load_cached_session(email):
+    entry = _read_json(SESSION_CACHE_FILE, {}).get(email)
+    if not entry or _cookies_expired(entry):
+        return None
+    return entry
+
+
+def store_cached_session(email, role, cookies):
+    lock = _acquire_lock(SESSION_CACHE_FILE + ".lock", timeout=10)
+    try:
+        cache = _read_json(SESSION_CACHE_FILE, {})
+        cache[email] = {"role": role, "cookies": cookies, "created": time.time(), "run_id": RUN_ID}
+        _write_json(SESSION_CACHE_FILE, cache)
+    except Exception as e:
+        print(f"[pytest] Could not write session cache: {e}")
+    finally:
+        if lock:
+            _release_lock(lock)
+
+
+def inject_cookies(drv, cookies):
+    """Nạp cookie vào browser (context) hiện tại; CDP không cần mở trang trước, add_cookie thì cần."""
+    if getattr(drv, "engine", "") == "http":
+        _set_http_cookies(drv.http, cookies)
+        return
+    try:
+        for c in cookies:
+            params = {"name": c["name"], "value": c["value"], "url": APP_BASE_URL, "path": c.get("path", "/")}
+            if c.get("expiry"):
+                params["expires"] = c["expiry"]
+            drv.execute_cdp_cmd("Network.setCookie", params)
+        return
+    except Exception:
+        pass
+    drv.get(f"{APP_BASE_URL}/about")
+    for c in cookies:
+        drv.add_cookie({k: v for k, v in c.items() if k in ("name", "value", "path", "expiry", "secure", "httpOnly")})
+
+
+def ui_login(drv, account, timeout=15):
+    """Đăng nhập qua form /login (chỉ dùng khi cache không có / hết hạn)."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    drv.get(LOGIN_PAGE_URL)
+    email = drv.find_element("name", "email")
+    email.clear()
+    email.send_keys(account["email"])
+    pwd = drv.find_element("name", "password")
+    pwd.clear()
+    pwd.send_keys(account["password"])
+    pwd.send_keys("\n")
+    WebDriverWait(drv, timeout).until(lambda d: d.find_elements("css selector", LOGGED_IN_CSS))
+    return drv.get_cookies()
+
+
+def _selenium_cookies(jar):
+    """Cookie của requests -> dạng dict như driver.get_cookies() để inject / lưu cache."""
+    from urllib.parse import urlparse
+    host = urlparse(APP_BASE_URL).hostname
+    cookies = []
+    for c in jar:
+        # cookie host-only: cookiejar ghi domain "localhost.local" -> dùng lại host của app
+        domain = c.domain if c.domain_specified and c.domain else host
+        cookie = {"name": c.name, "value": c.value, "domain": domain, "path": c.path or "/",
+                  "secure": bool(c.secure), "httpOnly": c.has_nonstandard_attr("HttpOnly")}
+        if c.expires:
+            cookie["expiry"] = int(c.expires)
+        cookies.append(cookie)
+    return cookies
+
+
+def http_login(account, session=None):
+    """
+    Đăng nhập không cần browser: GET /login, POST form như khi click nút đăng nhập (kèm hidden field
+    như CSRF token, name/value của nút submit và header X-CSRF-TOKEN chỉ cho request này nếu trang có
+    <meta name="csrf-token">), theo redirect.
+    Trả về cookie đã xác thực (dạng Selenium) hoặc None nếu không đăng nhập được.
+    """
+    pg = HttpPage(session=session or _new_http_session())
     try:
-        from filelock import FileLock
-        lock = FileLock(lock_path, timeout=timeout)
-        lock.acquire()
-        return lock
-    except Exception:
-        # fallback: create a lock file atomically by O_EXCL
-        end = time.time() + timeout
-        while time.time() < end:
-            try:
-                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_RDWR)
-                try:
-                    os.write(fd, str(os.getpid()).encode())
-                except Exception:
-                    pass
-                os.close(fd)
-                return lock_path
-            except FileExistsError:
-                time.sleep(0.5)
+        pg.get(LOGIN_PAGE_URL)
+        headers = None
+        meta = pg.find_elements("css selector", "meta[name='csrf-token'], meta[name='_token']")
+        if meta and meta[0].get_attribute("content"):
+            headers = {"X-CSRF-TOKEN": meta[0].get_attribute("content")}
+        email = pg.find_element("name", "email")
+        email.clear()
+        email.send_keys(account["email"])
+        pwd = pg.find_element("name", "password")
+        pwd.clear()
+        pwd.send_keys(account["password"])
+        pwd.submit(submitter=pwd._default_submitter(), headers=headers)
+        if not pg.find_elements("css selector", LOGGED_IN_CSS):
+            return None
+        return _selenium_cookies(pg.http.cookies)
+    except Exception as e:
+        print(f"[pytest] HTTP login failed for {account.get('email')}: {e}")
         return None
 
-def _release_lock(lock):
+
+def mint_sessions(accounts, max_workers=16, store=False):
+    """
+    Đăng nhập song song nhiều tài khoản qua http_login (dùng chung connection pool).
+    Trả về {email: cookies}; store=True thì ghi luôn vào session cache cho fixture dùng lại.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    accounts = list(accounts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(accounts) or 1))) as ex:
+        minted = dict(zip((a["email"] for a in accounts), ex.map(http_login, accounts)))
+    if store:
+        for acc in accounts:
+            if minted.get(acc["email"]):
+                store_cached_session(acc["email"], acc.get("role", ""), minted[acc["email"]])
+    return {email: cookies for email, cookies in minted.items() if cookies}
+
+
+def authenticate(drv, account, role):
+    """
+    Đưa drv vào trạng thái đăng nhập bằng account, theo thứ tự rẻ nhất:
+    cookie cache ('cache') -> đăng nhập HTTP rồi inject ('http') -> form trong browser ('ui').
+    """
+    entry = load_cached_session(account["email"])
+    if entry and session_cookies_valid(entry["cookies"]):
+        inject_cookies(drv, entry["cookies"])
+        return "cache"
+    cookies = http_login(account)
+    how = "http"
+    if cookies:
+        inject_cookies(drv, cookies)
+    else:
+        cookies = ui_login(drv, account)
+        how = "ui"
+    store_cached_session(account["email"], role, cookies)
+    return how
+
+
+@pytest.fixture
+def session_for(request, driver, account_pool, precondition_state, log_step):
+    """
+    Factory: session_for("admin") / session_for("user", traits=("orders",)) -> account dict.
+    Lease tài khoản từ account pool rồi đăng nhập driver bằng cookie cache (UI login chỉ khi cache hỏng).
+    Truyền account={...} để dùng tài khoản cụ thể thay vì lease.
+    """
+    def _session_for(role="user", traits=(), account=None):
+        account = account or account_pool.lease(role, traits=traits)
+        if account_pool.is_shared(account["email"]):
+            log_step(f"Cảnh báo: tài khoản {account['email']} đang dùng chung với worker khác (không cô lập)")
+        if precondition_state.ready(role, account["email"]):
+            return account
+        try:
+            how = authenticate(driver, account, role)
+        except Exception as e:
+            # đăng nhập hỏng trong thân test vẫn tính cho breaker của precondition
+            circuit_breaker(request.config).failure(f"precondition:{role}", _failure_cause(e),
+                                                    generate_pretty_nodeid(request.node))
+            try:
+                e._bw_breaker_counted = True
+            except Exception:
+                pass
+            raise
+        circuit_breaker(request.config).success(f"precondition:{role}")
+        log_step(f"Precondition: Đăng nhập {role} {account['email']} bằng "
+                 + {"cache": "cookie cache", "http": "HTTP login + inject cookie"}.get(how, "form /login trong browser"))
+        precondition_state.mark(role, account["email"])
+        return account
+    return _session_for
+
+
+@pytest.fixture(scope="function")
+def admin_logged_in_driver(driver, log_step, session_for):
+    """Driver đã đăng nhập Admin (phiên lấy từ cookie cache qua session_for, chỉ đi qua form khi cache hết hạn)."""
+    log_step("Precondition: Đăng nhập Admin.")
+    session_for("admin")
+    return driver
+
+
+# --------------------------
+# Browser contexts: mỗi test một context kiểu incognito (CDP Target.createBrowserContext)
+# trong cùng một Chrome; cookies/storage tách biệt theo context
+# --------------------------
+class ContextDriver:
+    """
+    Proxy tới driver "host", gắn với một tab trong một browser context riêng.
+    Mọi lệnh đi qua proxy sẽ switch host sang tab của context trước khi chạy, nên nhiều
+    context có thể cùng mở trong một Chrome (ví dụ admin và khách ẩn danh) mà không lẫn cookie.
+    Lưu ý: WebElement lấy từ context này không dùng được khi host đang ở context khác.
+    """
+
+    def __init__(self, host, context_id, handle):
+        object.__setattr__(self, "_host", host)
+        object.__setattr__(self, "context_id", context_id)
+        object.__setattr__(self, "handle", handle)
+
+    def _activate(self):
+        host = self._host
+        if getattr(host, "_bw_active_handle", None) != self.handle:
+            host.switch_to.window(self.handle)
+            host._bw_active_handle = self.handle
+
+    def __getattr__(self, name):
+        self._activate()
+        return getattr(self._host, name)
+
+    def __repr__(self):
+        return f"<ContextDriver context={self.context_id} handle={self.handle}>"
+
+
+def open_browser_context(host, profile=None):
+    profile = profile or _browser_profile()
+    if not getattr(host, "_bw_default_handle", None):
+        host._bw_default_handle = host.current_window_handle
+    before = set(host.window_handles)
+    context_id = host.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+    params = {"url": "about:blank", "browserContextId": context_id}
+    if profile["name"] != "headed":
+        params["width"], params["height"] = profile["viewport"]
+    target_id = host.execute_cdp_cmd("Target.createTarget", params)["targetId"]
+    handles = host.window_handles
+    handle = target_id if target_id in handles else next(iter(set(handles) - before), target_id)
+    host.switch_to.window(handle)
+    host._bw_active_handle = handle
+    host.__dict__.setdefault("_bw_contexts", set()).add(context_id)
+    return ContextDriver(host, context_id, handle)
+
+
+def close_browser_context(ctx):
+    """Dispose context (đóng luôn các tab của nó); trả về danh sách lỗi/leak nếu có."""
+    host = ctx._host
+    problems = []
     try:
-        # filelock.FileLock
-        if hasattr(lock, 'release'):
-            lock.release()
-            return
+        host.switch_to.window(host._bw_default_handle)
     except Exception:
         pass
+    host._bw_active_handle = None
     try:
-        # fallback path string
-        if isinstance(lock, str) and os.path.exists(lock):
-            os.remove(lock)
+        host.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": ctx.context_id})
+    except Exception as e:
+        problems.append(f"dispose context failed: {e}")
+    host.__dict__.get("_bw_contexts", set()).discard(ctx.context_id)
+    try:
+        alive = host.execute_cdp_cmd("Target.getBrowserContexts", {}).get("browserContextIds", [])
+        if ctx.context_id in alive:
+            problems.append(f"context {ctx.context_id} still alive")
     except Exception:
         pass
+    return problems
 
 
-# --------------------------
-# pytest options
-# --------------------------
-def pytest_addoption(parser):
-    parser.addoption("--browser", default="chrome")
-    parser.addoption("--env", default="local")
-    parser.addoption("--perf-threshold", type=float, default=2.0,
-                     help="Threshold in seconds to classify a long-running test as Performance test")
+@pytest.fixture
+def new_browser_context(request, driver):
+    """
+    Factory mở thêm context cô lập trên cùng Chrome với `driver`, ví dụ:
+        anon = new_browser_context()
+    Các context được dispose khi test kết thúc.
+    """
+    host = driver._host if isinstance(driver, ContextDriver) else driver
+    opened = []
+
+    def _open():
+        ctx = open_browser_context(host, _browser_profile(request.config))
+        opened.append(ctx)
+        return ctx
+    yield _open
+    for ctx in opened:
+        close_browser_context(ctx)
+    if isinstance(driver, ContextDriver):
+        driver._activate()
 
 
 # --------------------------
-# VIEW_MAP (dựa trên router PHP bạn cung cấp)
-# --------------------------
-VIEW_MAP = {
-    "/": "Home",
-    "/home": "Home",
-    "/about": "About",
-    "/search": "Search Results",
-    "/product_all": "Product List",
-    "/product": "Product By Type",
-    "/detail": "Product Detail",
-    "/cart": "Cart",
-    "/addCart": "Cart Action",
-    "/del": "Cart Action",
-    "/delCart": "Cart Action",
-    "/pay": "Checkout",
-    "/payHistory": "Payment History",
-    "/detailBill": "Bill Detail",
-    "/cancleBill": "Bill Action",
-    "/recieved": "Bill Action",
-    "/received": "Bill Action",
-    "/manageProduct": "Manage Products",
-    "/manage": "Manage Product Detail",
-    "/create": "Create Product",
-    "/manageBill": "Manage Bills",
-    "/manageDetailBill": "Manage Bill Detail",
-    "/users": "Manage Users",
-    "/userInfo": "User Info",
-    "/passChange": "User Password Change",
-    "/manage/product": "Manage Products",
-    "/manage/create": "Manage Create Product",
-    "/manage/product/": "Manage Product Detail",
-    "/manage/bills": "Manage Bills",
-    "/manage/bill": "Manage Bill Detail",
+# Resource policy: chặn image/font/media/third-party qua DevTools cho test không cần hình ảnh
+# Khai báo theo Category dự đoán trước khi chạy, hoặc marker:
+#   @pytest.mark.resources(block=["image", "font"])   /   @pytest.mark.resources(block=[])
+# --------------------------
+RESOURCE_PATTERNS = {
+    "image": ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp"],
+    "font": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"],
+    "media": ["*.mp4", "*.webm", "*.ogg", "*.mp3", "*.wav", "*.m4a"],
+    "third_party": [
+        "*://fonts.googleapis.com/*", "*://fonts.gstatic.com/*",
+        "*://*.google-analytics.com/*", "*://*.googletagmanager.com/*", "*://*.doubleclick.net/*",
+        "*://*.facebook.com/*", "*://*.facebook.net/*", "*://*.fbcdn.net/*",
+    ],
+}
+NON_VISUAL_BLOCK = ["image", "font", "media", "third_party"]
+CATEGORY_RESOURCE_POLICY = {
+    "UI": [],            # test giao diện cần tải đủ hình/font
+    "Performance": [],   # đo thời gian thật, không can thiệp
+    "UX": NON_VISUAL_BLOCK,
+    "Functional": NON_VISUAL_BLOCK,
 }
+_resource_sizes = {}   # url -> bytes (học từ các lần tải không bị chặn / HEAD)
 
 
-# --------------------------
-# Utility: pretty nodeid
-# --------------------------
-def generate_pretty_nodeid(item):
+def _predict_category(item):
+    """Category dự đoán trước khi chạy test (cùng heuristics với báo cáo, nhưng chưa có driver/steps)."""
+    pretty_id = generate_pretty_nodeid(item)
     try:
-        fpath = getattr(item, "fspath", None)
-        if fpath:
-            file = os.path.basename(fpath)
-        else:
-            file = os.path.basename(item.nodeid.split("::", 1)[0])
+        meta = extract_metadata_for_item(item, pretty_id)
+        ui_or_ux, _ = detect_ui_or_ux(item, pretty_id, meta=meta, test_steps=[])
+        if ui_or_ux:
+            return ui_or_ux
+        return auto_detect_type_and_view(item, pretty_id, None, meta=meta).get("category") or "Functional"
     except Exception:
-        file = "unknown"
+        return "Functional"
+
+
+def resource_policy_for(item, config=None):
+    """Trả về (nhãn policy, [loại resource bị chặn])."""
     try:
-        funcname = getattr(item, "name", None) or item.nodeid.split("::")[-1]
+        if config and config.getoption("--resource-policy") == "off":
+            return "off", []
     except Exception:
-        funcname = "test_unknown"
-    file_prefix = "".join([w[0].upper() for w in file.replace(".py", "").split("_") if w])
-    slug = re.sub(r"^test_", "", funcname)
-    numeric = abs(hash(slug)) % 1000
-    return f"{file_prefix}-T{numeric:03d}"
+        pass
+    m = item.get_closest_marker("resources")
+    if m:
+        block = m.kwargs.get("block", m.args[0] if m.args else [])
+        if isinstance(block, str):
+            block = [block]
+        return "marker", [b for b in block if b in RESOURCE_PATTERNS]
+    category = _predict_category(item)
+    return category, list(CATEGORY_RESOURCE_POLICY.get(category, []))
 
 
-# --------------------------
-# Fixture: log_step
-# --------------------------
-@pytest.fixture
-def log_step(request):
+def apply_resource_policy(drv, block):
+    urls = [p for kind in block for p in RESOURCE_PATTERNS.get(kind, [])]
+    try:
+        drv.get_log("performance")  # bỏ log còn sót từ test trước
+    except Exception:
+        pass
+    try:
+        drv.execute_cdp_cmd("Network.enable", {})
+        drv.execute_cdp_cmd("Network.setBlockedURLs", {"urls": urls})
+        return True
+    except Exception as e:
+        print(f"[DEBUG] Could not apply resource policy: {e}")
+        return False
+
+
+HEAD_BUDGET = 10.0      # tổng số giây HEAD nền được dùng trong cả session
+_head_lock = threading.Lock()
+_head_state = {"spent": 0.0, "queued": set(), "executor": None}
+
+
+def _head_size(url):
+    """HEAD lấy content-length của resource chưa từng tải được; chạy nền, dừng khi hết HEAD_BUDGET."""
+    with _head_lock:
+        if url in _resource_sizes or _head_state["spent"] >= HEAD_BUDGET:
+            return
+    start = time.time()
+    size = 0
+    try:
+        resp = _new_http_session().head(url, timeout=2, allow_redirects=True)
+        size = int(resp.headers.get("content-length") or 0)
+    except Exception:
+        pass
+    with _head_lock:
+        _head_state["spent"] += time.time() - start
+        _resource_sizes[url] = size
+
+
+def _queue_head_sizes(urls):
+    """Đưa URL chưa biết kích thước vào hàng HEAD nền để các test sau ước lượng được."""
+    with _head_lock:
+        if _head_state["spent"] >= HEAD_BUDGET:
+            return
+        urls = [u for u in dict.fromkeys(urls) if u and u not in _resource_sizes and u not in _head_state["queued"]]
+        if not urls:
+            return
+        _head_state["queued"].update(urls)
+        if _head_state["executor"] is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _head_state["executor"] = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resource-head")
+        executor = _head_state["executor"]
+    for url in urls:
+        executor.submit(_head_size, url)
+
+
+def collect_resource_stats(drv):
     """
-    Sử dụng trong test: log_step("Test Data: keyword=abc; qty=1")
+    Đọc performance log: số request bị chặn và số byte tiết kiệm được (cận dưới: chỉ tính resource
+    đã biết kích thước từ lần tải không bị chặn hoặc HEAD nền). Không gọi mạng trong hook báo cáo.
     """
-    pretty_id = generate_pretty_nodeid(request.node)
-    _test_steps.setdefault(pretty_id, [])
-    def _log(step_text):
-        _test_steps[pretty_id].append(step_text)
-    return _log
+    try:
+        entries = drv.get_log("performance")
+    except Exception:
+        return None
+    urls = {}
+    blocked = []
+    for entry in entries:
+        try:
+            msg = json.loads(entry["message"])["message"]
+        except Exception:
+            continue
+        method = msg.get("method", "")
+        params = msg.get("params", {})
+        rid = params.get("requestId")
+        if method == "Network.requestWillBeSent":
+            urls[rid] = params.get("request", {}).get("url", "")
+        elif method == "Network.loadingFinished" and urls.get(rid):
+            _resource_sizes[urls[rid]] = int(params.get("encodedDataLength") or 0)
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            blocked.append(urls.get(rid, ""))
+    saved = sum(_resource_sizes.get(url, 0) for url in blocked)
+    _queue_head_sizes(u for u in blocked if u not in _resource_sizes)
+    return {"requests": len(blocked), "bytes": saved}
 
 
 # --------------------------
-# Screenshot helper
+# Precondition groups: gom test theo precondition (anonymous / user / admin / cart) để chạy liền
+# nhau, và cho test kế tiếp cùng nhóm mượn lại browser còn nguyên state đăng nhập / giỏ hàng.
+# Fixture thiết lập state hỏi precondition_state.ready() để bỏ qua bước đăng nhập,
+# gọi precondition_state.mark() khi thiết lập xong.
 # --------------------------
-def try_capture_screenshot_for_pretty_id(pretty_id, driver_obj=None):
-    global _driver_instance
-    screenshot_path = ""
+PRECONDITIONS = ("anonymous", "user", "admin", "cart")
+PRECONDITION_FIXTURES = (
+    ("ensure_cart_has_item", "cart"),
+    ("admin_logged_in_driver", "admin"),
+    ("admin_account", "admin"),
+    ("account", "user"),
+    ("user_account", "user"),
+)
+# route (segment cuối của URL) làm mất state
+STATE_BREAKING_ROUTES = {
+    "user": ("logout",),
+    "admin": ("logout",),
+    "cart": ("logout", "pay", "del", "delCart"),
+}
+LOGGED_IN_CSS = "a[href*='logout']"
+
+
+def precondition_for(item):
+    marker = item.get_closest_marker("precondition")
+    if marker and marker.args and marker.args[0] in PRECONDITIONS:
+        return marker.args[0]
+    names = getattr(item, "fixturenames", ())
+    for fixture, state in PRECONDITION_FIXTURES:
+        if fixture in names:
+            return state
+    return "anonymous"
+
+
+def is_unit(item):
+    return item.get_closest_marker("unit") is not None
+
+
+def pytest_collection_modifyitems(session, config, items):
+    # unit test (bw_core) không qua các bước chọn/preflight, không ghi master; luôn chạy trước
+    unit = [it for it in items if is_unit(it)]
+    items[:] = [it for it in items if not is_unit(it)]
     try:
-        if not driver_obj:
-            driver_obj = globals().get("_driver_instance", None)
-        if not driver_obj:
-            print(f"[DEBUG] No driver available to take screenshot for {pretty_id}")
-            return ""
+        select_e2e_items(config, items)
+    finally:
+        items[:] = unit + items
+
+
+def select_e2e_items(config, items):
+    # shard trước mọi bước đọc master đang thay đổi (history, --changed, --incremental) để các
+    # shard khởi động lệch giờ vẫn chia cùng một tập test giống hệt nhau
+    select_shard(config, items)
+    apply_http_only_gate(config, items)
+    group_key = None
+    if config.getoption("--precondition-groups") == "on":
+        rank = {name: i for i, name in enumerate(PRECONDITIONS)}
+        group_key = lambda it: rank[precondition_for(it)]
+        # sort ổn định: trong mỗi nhóm giữ nguyên thứ tự collect
+        items.sort(key=group_key)
+    order_by_history(config, items, group_key)
+    select_impacted(config, items)
+    select_uncached(config, items)
+    if xdist_worker_id(config):
+        write_state_index(items)
+    select_time_budget(config, items)
+    apply_preflight(config, items)
+
+
+def state_survived(drv, state):
+    """Sau test: state có còn dùng được không (không đi qua route phá state, vẫn còn đăng nhập)."""
+    from urllib.parse import urlparse
+    breaking = STATE_BREAKING_ROUTES.get(state, ())
+    current = ""
+    try:
+        current = drv.current_url or ""
+    except Exception:
+        return False
+    for url in list(getattr(drv, "_bw_visited", [])) + [current]:
+        if urlparse(url).path.rstrip("/").rsplit("/", 1)[-1] in breaking:
+            return False
+    if current.startswith(APP_BASE_URL):
         try:
-            sid = getattr(driver_obj, "session_id", None)
-            print(f"[DEBUG] Taking screenshot for {pretty_id}, session_id={sid}")
+            return bool(drv.find_elements("css selector", LOGGED_IN_CSS))
         except Exception:
-            pass
-        sc_dir = os.path.join(os.getcwd(), "screenshots")
-        os.makedirs(sc_dir, exist_ok=True)
-        sc_file = f"{pretty_id}_{RUN_ID}.png"
-        screenshot_path = os.path.join(sc_dir, sc_file)
-        try:
-            ok = driver_obj.save_screenshot(screenshot_path)
-            print(f"[DEBUG] save_screenshot returned: {ok} -> {screenshot_path}")
-        except Exception as e:
-            print(f"[DEBUG] save_screenshot raised: {e}, trying fallback get_screenshot_as_file")
+            return False
+    return True
+
+
+class PreconditionState:
+    def __init__(self, drv):
+        self.drv = drv
+
+    def ready(self, state, who=None):
+        """True nếu browser mượn từ pool vẫn giữ state này (và đúng tài khoản `who`) từ test trước."""
+        if getattr(self.drv, "_bw_state", None) != state:
+            return False
+        return who is None or getattr(self.drv, "_bw_state_who", None) == who
+
+    def mark(self, state, who=None):
+        self.drv._bw_state = state
+        self.drv._bw_state_who = who
+        self.drv._bw_visited = []
+
+
+@pytest.fixture
+def precondition_state(driver):
+    return PreconditionState(driver)
+
+
+# --------------------------
+# Circuit breaker: fixture / precondition hỏng (vd. đăng nhập admin) làm mọi test phụ thuộc fail
+# lần lượt, mỗi test tốn một lần mở browser + timeout. Sau --breaker-threshold lỗi giống hệt nhau
+# (cùng fixture hoặc precondition, cùng thông báo lỗi) liên tiếp, các test còn lại dùng fixture /
+# precondition đó bị đánh dấu BLOCKED kèm lỗi gốc thay vì chạy. Sau --breaker-cooldown giây breaker
+# half-open: cho đúng một test chạy thử; test đó setup được thì breaker đóng, lỗi tiếp thì mở lại.
+# Breaker tính riêng trong từng process.
+# --------------------------
+def circuit_breaker(config):
+    if not hasattr(config, "_bw_breaker"):
+        config._bw_breaker = CircuitBreaker(config.getoption("--breaker-threshold"),
+                                            config.getoption("--breaker-cooldown"))
+    return config._bw_breaker
+
+
+def breaker_keys(item):
+    keys = [f"fixture:{name}" for name in getattr(item, "fixturenames", ())]
+    state = precondition_for(item)
+    if state != "anonymous":
+        keys.insert(0, f"precondition:{state}")
+    return keys
+
+
+def _failure_cause(exc):
+    import traceback
+    lines = "".join(traceback.format_exception_only(type(exc), exc)).strip().splitlines()
+    return (lines[0] if lines else "unknown error")[:200]
+
+
+def _fixture_codes(item):
+    """code object của hàm fixture -> tên fixture (tên đăng ký có thể khác tên hàm, vd. name="settle")."""
+    codes = {}
+    info = getattr(item, "_fixtureinfo", None)
+    for name, defs in (getattr(info, "name2fixturedefs", None) or {}).items():
+        for fixturedef in defs:
             try:
-                driver_obj.get_screenshot_as_file(screenshot_path)
-                print(f"[DEBUG] get_screenshot_as_file succeeded -> {screenshot_path}")
-            except Exception as e2:
-                print(f"[DEBUG] get_screenshot_as_file also failed: {e2}")
-                screenshot_path = ""
-        if screenshot_path and os.path.exists(screenshot_path):
-            return screenshot_path
-        else:
-            print(f"[DEBUG] Screenshot file not found after attempts: {screenshot_path}")
-            return ""
-    except Exception as e:
-        print(f"[DEBUG] Unexpected error when capturing screenshot: {e}")
-        return ""
+                codes[inspect.unwrap(fixturedef.func).__code__] = name
+            except Exception:
+                pass
+    return codes
+
+
+def observe_setup(item, call, rep):
+    """Ghi kết quả setup vào breaker: lỗi tính cho fixture có trong traceback và precondition của test."""
+    breaker = circuit_breaker(item.config)
+    names = set(getattr(item, "fixturenames", ()))
+    if rep.passed:
+        # precondition chỉ được reset khi đăng nhập thật sự thành công (session_for)
+        for name in names:
+            breaker.success(f"fixture:{name}")
+        return
+    if not rep.failed or call.excinfo is None:
+        breaker.abandon(generate_pretty_nodeid(item))
+        return
+    cause = _failure_cause(call.excinfo.value)
+    codes = _fixture_codes(item)
+    failed = []
+    for entry in call.excinfo.traceback:
+        try:
+            name = codes.get(entry.frame.code.raw)
+        except Exception:
+            name = None
+        if name in names:
+            failed.append(name)
+    keys = [f"fixture:{name}" for name in dict.fromkeys(failed)]
+    state = precondition_for(item)
+    if state != "anonymous" and not getattr(call.excinfo.value, "_bw_breaker_counted", False):
+        keys.append(f"precondition:{state}")
+    opened = len(breaker.open)
+    for key in keys:
+        breaker.failure(key, cause, generate_pretty_nodeid(item))
+    pool = getattr(item.config, "_bw_browser_pool", None)
+    if pool is not None and len(breaker.open) > opened:
+        pool.drop(it.nodeid for it in item.session.items if breaker.blocked(breaker_keys(it)))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    if is_unit(item):
+        return
+    breaker = circuit_breaker(item.config)
+    hit = breaker.blocked(breaker_keys(item), probe_id=generate_pretty_nodeid(item))
+    if not hit:
+        return
+    key, (cause, first) = hit
+    reason = f"Blocked by {key} (open {breaker.open_for(key):.0f}s, first failed in {first}): {cause}"
+    _test_results.append(_skipped_record(item, reason, result="BLOCKED", note=f"Circuit breaker: {key}"))
+    pytest.skip(reason)
 
 
 # --------------------------
 # Driver fixture
 # --------------------------
 @pytest.fixture
-def driver(request):
+def driver(request, browser_pool):
     global _driver_instance
-    try:
-        from selenium import webdriver
-        from selenium.webdriver.chrome.service import Service
-        from webdriver_manager.chrome import ChromeDriverManager
-    except Exception as e:
-        raise RuntimeError(f"Cannot import selenium/webdriver_manager: {e}")
-
-    driver_inst = webdriver.Chrome(service=Service(ChromeDriverManager().install()))
+    if uses_http_engine(request.node):
+        yield request.getfixturevalue("page")
+        return
+    precondition = precondition_for(request.node)
+    host = browser_pool.acquire(request.node.nodeid, state=precondition)
+    driver_inst = host
+    if request.config.getoption("--contexts"):
+        driver_inst = open_browser_context(host, _browser_profile(request.config))
+    page_load = request.node.get_closest_marker("page_load")
+    if page_load and page_load.args and page_load.args[0] in PAGE_LOAD_STRATEGIES:
+        host._bw_page_load = page_load.args[0]
+    policy, block = resource_policy_for(request.node, request.config)
+    request.node._resource_policy = (policy, block)
+    if block:
+        apply_resource_policy(driver_inst, block)
     _driver_instance = driver_inst
     try:
         request.node._driver = driver_inst
@@ -221,10 +3293,28 @@ def driver(request):
                 _test_screenshots[pretty_id] = p
     except Exception as e:
         print(f"[DEBUG] Error during driver teardown screenshot: {e}")
-    try:
-        driver_inst.quit()
-    except Exception:
-        pass
+    # đọc trước release(): pool reset xoá các log này trên browser
+    misses = getattr(host, "_bw_readiness_misses", [])
+    if misses:
+        _append_result_note(pretty_id, "; ".join(dict.fromkeys(misses)))
+        host._bw_readiness_misses = []
+    settled = settle_summary(getattr(driver_inst, "_bw_settle_log", []))
+    if settled:
+        _append_result_note(pretty_id, settled)
+        driver_inst._bw_settle_log = []
+    leaks = []
+    if isinstance(driver_inst, ContextDriver):
+        leaks += close_browser_context(driver_inst)
+    keep = None
+    if (precondition != "anonymous" and not isinstance(driver_inst, ContextDriver)
+            and getattr(request.node, "_call_outcome", "") == "passed"
+            and not request.node.get_closest_marker("invalidates_state")):
+        keep = precondition
+    leaks += browser_pool.release(host, pretty_id, keep_state=keep)
+    if leaks:
+        _append_result_note(pretty_id, "State leak: " + "; ".join(leaks))
+    for event in browser_pool.pop_events():
+        _append_result_note(pretty_id, event)
     _driver_instance = None
 
 
@@ -329,6 +3419,11 @@ def extract_metadata_for_item(item, pretty_id):
 def _match_view_from_url(url, view_map=None):
     if not url:
         return ""
+    if view_map is None:
+        # "/" nằm trong mọi URL nên phép `in` bên dưới luôn trả về "Home"; ưu tiên so theo segment
+        matched = view_for_route(url)
+        if matched:
+            return matched
     vm = view_map or VIEW_MAP
     for pattern, name in vm.items():
         try:
@@ -571,6 +3666,85 @@ def detect_ui_or_ux(item, pretty_id, driver_obj=None, meta=None, test_steps=None
     return "", debug_text
 
 
+# --------------------------
+# Sleep accounting: time.sleep được thay bằng bản đếm giờ; lời gọi từ file test_*.py và conftest.py
+# (test và fixture, trừ các hàm poll của chính harness trong HARNESS_POLLERS) được cộng vào pretty_id
+# đang chạy -> cột "Sleep (s)", "Test Time (s)" (setup+call+teardown, khác "Duration (s)" chỉ tính
+# call) và "Sleep Share of Test Time (%)", cùng bảng tổng kết theo module cuối session.
+# --------------------------
+_real_sleep = time.sleep
+_sleep_current = None     # pretty_id của test đang chạy
+_test_sleeps = {}         # { pretty_id: giây }
+# vòng chờ có điều kiện của harness: sleep ngắn giữa các lần poll, không phải sleep cố định của test
+HARNESS_POLLERS = ("_acquire_lock", "_wait_for_page", "wait_until_settled", "save_to_excel")
+_harness_codes = None
+
+
+def _is_harness_poller(code):
+    global _harness_codes
+    if _harness_codes is None:
+        _harness_codes = {globals()[name].__code__ for name in HARNESS_POLLERS if name in globals()}
+    return code in _harness_codes
+
+
+def _accounted_sleep(seconds):
+    start = time.perf_counter()
+    _real_sleep(seconds)
+    pretty_id = _sleep_current
+    if not pretty_id:
+        return
+    try:
+        code = sys._getframe(1).f_code
+    except Exception:
+        return
+    caller = os.path.basename(code.co_filename)
+    if (caller.startswith("test_") or caller == "conftest.py") and not _is_harness_poller(code):
+        _test_sleeps[pretty_id] = _test_sleeps.get(pretty_id, 0.0) + time.perf_counter() - start
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    global _sleep_current
+    pretty_id = generate_pretty_nodeid(item)
+    _sleep_current = pretty_id
+    _test_sleeps.pop(pretty_id, None)
+    first = len(_test_results)
+    start = time.perf_counter()
+    yield
+    _sleep_current = None
+    wall = time.perf_counter() - start
+    slept = _test_sleeps.get(pretty_id, 0.0)
+    for record in _test_results[first:]:
+        if record.get("ID") == pretty_id:
+            record["Sleep (s)"] = f"{slept:.2f}"
+            record["Test Time (s)"] = f"{wall:.2f}"
+            record["Sleep Share of Test Time (%)"] = f"{100.0 * slept / wall:.1f}" if wall > 0 else "0.0"
+            record["_module"] = item.nodeid.split("::")[0]
+
+
+def sleep_summary(results, top=10):
+    """In tổng thời gian sleep của run và các module sleep nhiều nhất."""
+    by_module = {}
+    for r in results:
+        if "_module" not in r:
+            continue
+        entry = by_module.setdefault(r["_module"], [0.0, 0.0, 0])
+        entry[0] += float(r.get("Sleep (s)") or 0)
+        entry[1] += float(r.get("Test Time (s)") or 0)
+        entry[2] += 1
+    if not by_module:
+        return
+    slept = sum(e[0] for e in by_module.values())
+    wall = sum(e[1] for e in by_module.values())
+    print(f"\n[pytest] Sleep accounting: {slept:.1f}s of {wall:.1f}s test time in time.sleep "
+          f"({100.0 * slept / wall if wall else 0:.1f}%)")
+    for module, (m_slept, m_wall, count) in sorted(by_module.items(), key=lambda kv: -kv[1][0])[:top]:
+        if m_slept <= 0:
+            break
+        print(f"[pytest]   {module}: {m_slept:.1f}s sleeping over {count} tests "
+              f"({100.0 * m_slept / m_wall if m_wall else 0:.1f}% of its {m_wall:.1f}s)")
+
+
 # --------------------------
 # Hook: runtest makereport - collect result, screenshot, metadata
 # --------------------------
@@ -578,8 +3752,13 @@ def detect_ui_or_ux(item, pretty_id, driver_obj=None, meta=None, test_steps=None
 def pytest_runtest_makereport(item, call):
     outcome = yield
     rep = outcome.get_result()
+    if is_unit(item):
+        return
+    if rep.when == "setup":
+        observe_setup(item, call, rep)
     if rep.when != "call":
         return
+    item._call_outcome = rep.outcome
     pretty_id = generate_pretty_nodeid(item)
     timestamp = datetime.now().isoformat()
     duration = getattr(rep, "duration", 0.0)
@@ -590,7 +3769,10 @@ def pytest_runtest_makereport(item, call):
             longrepr = str(rep.longrepr)
         except Exception:
             longrepr = "Failure (longrepr unavailable)"
-    browser = item.config.getoption("--browser")
+    if getattr(getattr(item, "_driver", None), "engine", "") == "http":
+        browser = "http (requests+lxml)"
+    else:
+        browser = _profile_label(_browser_profile(item.config))
     env = item.config.getoption("--env")
     try:
         test_case_title = getattr(item, "name", None) or item.nodeid.split("::")[-1]
@@ -673,11 +3855,23 @@ def pytest_runtest_makereport(item, call):
         "Environment": env,
         "Screenshot": screenshot_path,
         "View": view_value,
+        "Views": "; ".join(sorted(visited_views(driver_obj_for_detect) | ({view_value} if view_value else set())))
+                 if driver_obj_for_detect is not None else view_value,
         "Category": category_value,
         "Page URL": page_url_value,
-        "Page Title": page_title_value
+        "Page Title": page_title_value,
+        "Run ID": RUN_ID,
+        "Fingerprint": getattr(item, "_bw_fingerprint", "")
     }
 
+    policy, blocked_kinds = getattr(item, "_resource_policy", ("", []))
+    if policy:
+        record["Resource Policy"] = f"{policy}: {'+'.join(blocked_kinds) or 'none'}"
+        stats = collect_resource_stats(driver_obj_for_detect) if blocked_kinds else None
+        if stats:
+            record["Blocked Requests"] = stats["requests"]
+            record["Bytes Saved"] = stats["bytes"]
+
     # include TD_ fields from parsed_kv
     for k, v in parsed_kv.items():
         col_name = f"TD_{k}"
@@ -685,6 +3879,11 @@ def pytest_runtest_makereport(item, call):
 
     _test_results.append(record)
 
+    if result_status == "FAILED" and item.config.getoption("--stop-on-new-failure") \
+            and pretty_id not in known_failures(item.config):
+        record["Notes"] = "; ".join(filter(None, [record.get("Notes", ""), "New failure (not failing in previous run)"]))
+        item.session.shouldstop = f"--stop-on-new-failure: {pretty_id} ({item.nodeid}) failed for the first time"
+
     # Optional: write UI/UX debug into a separate debug log file if env var set
     try:
         if os.environ.get("PYTEST_DEBUG_UIUX", "") == "1":
@@ -763,9 +3962,32 @@ def save_to_excel(df_new, retries=5):
 # Session finish: dynamic columns TD_*
 # --------------------------
 def pytest_sessionfinish(session, exitstatus):
-    if not _test_results:
+    worker_id = xdist_worker_id(session.config)
+    if worker_id:
+        # worker: chỉ ghi shard, controller sẽ gộp và ghi master đúng một lần
+        try:
+            write_result_shard(worker_id, _test_results)
+        except Exception as e:
+            print(f"[pytest] Could not write result shard for {worker_id}: {e}")
+        return
+    results, shards = list(_test_results), []
+    abort_reason = getattr(session.config, "_bw_preflight_abort", None)
+    if abort_reason:
+        print(f"\n[pytest] Session aborted by preflight: {abort_reason}")
+        session.exitstatus = pytest.ExitCode.INTERRUPTED
+    if _is_xdist_controller(session.config):
+        shard_results, shards = collect_result_shards()
+        results += shard_results
+        try:
+            os.remove(_state_index_path())
+        except Exception:
+            pass
+    if not results:
+        # shard rỗng (vd. chỉ chạy unit test với -n): không có gì để gộp lại lần sau
+        remove_result_shards(shards)
         print("\n[pytest] Không có dữ liệu để lưu.")
         return
+    sleep_summary(results)
     base_columns = [
         "ID",
         "Test Case Title",
@@ -777,26 +3999,40 @@ def pytest_sessionfinish(session, exitstatus):
         "Result",
         "Priority",
         "Duration (s)",
+        "Test Time (s)",
+        "Sleep (s)",
+        "Sleep Share of Test Time (%)",
         "Browser",
         "Environment",
         "Screenshot",
         "View",
+        "Views",
         "Category",
         "Page URL",
-        "Page Title"
+        "Page Title",
+        "Resource Policy",
+        "Blocked Requests",
+        "Bytes Saved",
+        "Notes",
+        "Run ID",
+        "Fingerprint",
+        "Cached From"
     ]
     td_cols = set()
-    for r in _test_results:
+    for r in results:
         for k in r.keys():
             if k.startswith("TD_"):
                 td_cols.add(k)
     td_cols = sorted(list(td_cols))
     all_columns = base_columns + td_cols
-    df_new = pd.DataFrame(_test_results)
+    df_new = pd.DataFrame(results)
     for c in all_columns:
         if c not in df_new.columns:
             df_new[c] = ""
     df_new = df_new[all_columns]
-    save_to_excel(df_new)
+    if save_to_excel(df_new):
+        remove_result_shards(shards)
     print("\n[pytest] Kết quả đã được lưu vào test_results_master.xlsx")
+    if session.config.getoption("--store-durations"):
+        store_durations()
     
\ No newline at end of file
@@ -20,6 +20,7 @@ def setup_driver(driver):
     expected="URL chứa 'about', hiển thị đúng hình ảnh và văn bản giới thiệu",
     priority="Low"
 )
+@pytest.mark.http_only
 def test_about_page_content(driver, log_step):
     wait = WebDriverWait(driver, 10)
     
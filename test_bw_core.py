@@ -0,0 +1,189 @@
+import pandas as pd
+import pytest
+
+import bw_core
+from bw_core import (ACCOUNT_SCOPE, CircuitBreaker, conflict_units, item_fingerprint, knapsack, lpt_partition,
+                     merge_rows, view_for_route)
+
+pytestmark = pytest.mark.unit
+
+
+# --------------------------
+# lpt_partition
+# --------------------------
+def test_lpt_partition_balances_longest_first():
+    groups, loads = lpt_partition([8, 7, 6, 5, 4], 2)
+    assert sorted(i for g in groups for i in g) == [0, 1, 2, 3, 4]
+    assert sorted(loads) == [13, 17]
+
+
+def test_lpt_partition_keeps_units_together():
+    groups, loads = lpt_partition([5, 5, 1, 1], 2, units=[[0, 1], [2], [3]])
+    assert any(set(g) >= {0, 1} for g in groups)
+    assert sorted(loads) == [2, 10]
+
+
+def test_lpt_partition_more_bins_than_tests():
+    groups, loads = lpt_partition([3], 4)
+    assert groups.count([]) == 3 and [0] in groups
+    assert sum(loads) == 3
+
+
+# --------------------------
+# conflict_units
+# --------------------------
+def _units(access):
+    nodeids = list(access)
+    return sorted(sorted(nodeids[i] for i in u) for u in conflict_units(nodeids, access))
+
+
+def test_conflict_units_links_writer_with_readers():
+    access = {"a": (["orders"], ["orders"]), "b": (["orders"], []), "c": (["cart"], [])}
+    assert _units(access) == [["a", "b"], ["c"]]
+
+
+def test_conflict_units_readers_stay_independent():
+    access = {"a": (["orders"], []), "b": (["orders"], [])}
+    assert _units(access) == [["a"], ["b"]]
+
+
+def test_conflict_units_ignores_per_account_resources():
+    cart = "cart" + ACCOUNT_SCOPE
+    access = {"a": ([cart], [cart]), "b": ([cart], [cart])}
+    assert _units(access) == [["a"], ["b"]]
+
+
+# --------------------------
+# knapsack
+# --------------------------
+def test_knapsack_picks_best_value_within_capacity():
+    assert knapsack([4, 3, 3, 1], [5, 3, 3, 1], 6) == [1, 2]
+
+
+def test_knapsack_zero_capacity():
+    assert knapsack([1, 2], [1, 1], 0) == []
+
+
+# --------------------------
+# item_fingerprint
+# --------------------------
+class _Marker:
+    def __init__(self, name, *args, **kwargs):
+        self.name, self.args, self.kwargs = name, args, kwargs
+
+
+class _Callspec:
+    def __init__(self, params):
+        self.params = params
+
+
+class _Item:
+    def __init__(self, markers=(), params=None):
+        self.nodeid = "test_x.py::test_a"
+        self.obj = _sample_test
+        self.fixturenames = []
+        self._markers = list(markers)
+        if params is not None:
+            self.callspec = _Callspec(params)
+
+    def iter_markers(self):
+        return iter(self._markers)
+
+
+def _sample_test():
+    return None
+
+
+def test_item_fingerprint_is_stable():
+    assert item_fingerprint(_Item(), "v1") == item_fingerprint(_Item(), "v1")
+
+
+def test_item_fingerprint_changes_with_app_params_and_markers():
+    base = item_fingerprint(_Item(), "v1")
+    assert item_fingerprint(_Item(), "v2") != base
+    assert item_fingerprint(_Item(params={"i": 1}), "v1") != base
+    assert item_fingerprint(_Item(markers=[_Marker("tc", priority="High")]), "v1") != base
+
+
+# --------------------------
+# view_for_route
+# --------------------------
+@pytest.mark.parametrize("url, view", [
+    (bw_core.APP_BASE_URL + "/manageBill", "Manage Bills"),
+    (bw_core.APP_BASE_URL + "/manageDetailBill?mhd=3", "Manage Bill Detail"),
+    (bw_core.APP_BASE_URL + "/manage/bills", "Manage Bills"),
+    (bw_core.APP_BASE_URL + "/manage/product/12", "Manage Products"),
+    (bw_core.APP_BASE_URL + "/", "Home"),
+    (bw_core.APP_BASE_URL + "/nope", ""),
+])
+def test_view_for_route(url, view):
+    assert view_for_route(url) == view
+
+
+def test_view_for_route_other_base():
+    assert view_for_route("http://shop.test/app/cart", base_url="http://shop.test/app") == "Cart"
+
+
+# --------------------------
+# merge_rows
+# --------------------------
+def test_merge_rows_keeps_master_and_drops_incoming_duplicates():
+    old = pd.DataFrame({"ID": ["X", "X", "Y"], "Run ID": ["1", "1", "2"]})
+    incoming = pd.DataFrame({"ID": ["X", "Z", "Z"], "Run ID": ["1", "3", "3"]})
+    merged, added, dropped = merge_rows(old, incoming)
+    assert merged["ID"].tolist() == ["X", "X", "Y", "Z"]
+    assert (added, dropped) == (1, 2)
+
+
+def test_merge_rows_treats_float_and_int_cells_alike():
+    old = pd.DataFrame({"ID": ["X"], "Blocked Requests": [3.0]})
+    incoming = pd.DataFrame({"ID": ["X"], "Blocked Requests": [3]})
+    assert merge_rows(old, incoming)[1:] == (0, 1)
+
+
+def test_merge_rows_into_empty_master_adds_new_columns():
+    merged, added, _ = merge_rows(pd.DataFrame(), pd.DataFrame({"ID": ["A"], "Notes": ["n"]}))
+    assert added == 1 and list(merged.columns) == ["ID", "Notes"]
+
+
+# --------------------------
+# CircuitBreaker
+# --------------------------
+def test_breaker_opens_after_identical_failures():
+    breaker = CircuitBreaker(threshold=2)
+    breaker.failure("fixture:login", "boom", "T-1")
+    assert breaker.blocked(["fixture:login"]) is None
+    breaker.failure("fixture:login", "boom", "T-2")
+    assert breaker.blocked(["fixture:login"]) == ("fixture:login", ("boom", "T-1"))
+
+
+def test_breaker_different_cause_restarts_count():
+    breaker = CircuitBreaker(threshold=2)
+    breaker.failure("fixture:login", "boom", "T-1")
+    breaker.failure("fixture:login", "other", "T-2")
+    assert breaker.blocked(["fixture:login"]) is None
+
+
+def test_breaker_success_closes():
+    breaker = CircuitBreaker(threshold=1)
+    breaker.failure("fixture:login", "boom", "T-1")
+    breaker.success("fixture:login")
+    assert breaker.blocked(["fixture:login"]) is None
+
+
+def test_breaker_half_open_probe(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bw_core.time, "time", lambda: now[0])
+    breaker = CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure("fixture:login", "boom", "T-1")
+    assert breaker.blocked(["fixture:login"], probe_id="T-2")
+    now[0] += 31
+    assert breaker.blocked(["fixture:login"], probe_id="T-3") is None     # T-3 chạy thử
+    assert breaker.blocked(["fixture:login"], probe_id="T-4")             # chỉ một probe mỗi lần
+    breaker.failure("fixture:login", "boom", "T-3")
+    assert breaker.blocked(["fixture:login"], probe_id="T-5")             # probe lỗi -> mở lại, chờ cooldown mới
+    now[0] += 31
+    assert breaker.blocked(["fixture:login"], probe_id="T-6") is None
+    breaker.success("fixture:login")
+    assert breaker.blocked(["fixture:login"], probe_id="T-7") is None
+    assert not breaker.open
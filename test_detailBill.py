@@ -5,8 +5,6 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 BASE_URL = "http://localhost/bookstore/public"
-VALID_EMAIL = "user@gmail.com"  # Cần user có ít nhất 1 đơn hàng
-VALID_PASS = "123456"
 
 def normalize(text):
     """Chuẩn hóa tiếng Việt để so sánh chính xác"""
@@ -16,13 +14,16 @@ def normalize(text):
 def setup_driver(driver):
     driver.maximize_window()
 
-def login_step(driver, wait):
-    driver.get(f"{BASE_URL}/login")
-    wait.until(EC.visibility_of_element_located((By.NAME, "email"))).send_keys(VALID_EMAIL)
-    driver.find_element(By.NAME, "password").send_keys(VALID_PASS)
-    driver.find_element(By.CSS_SELECTOR, "button[type='submit']").click()
-    wait.until(lambda d: "login" not in d.current_url)
+@pytest.fixture
+def account(lease_account):
+    # Cần user có ít nhất 1 đơn hàng; mỗi worker lease một tài khoản riêng từ pool trong conftest
+    return lease_account("user", traits=("orders",))
 
+def login_step(session_for, account):
+    # Đăng nhập bằng cookie cache trong conftest; chỉ đi qua form /login khi cache hết hạn
+    session_for("user", account=account)
+
+@pytest.mark.state(reads=["orders"], per_account=True)
 @pytest.mark.tc(
     title="Xem chi tiết hóa đơn (Detail Bill)",
     desc="Đăng nhập, vào lịch sử, chọn xem chi tiết đơn hàng đầu tiên và kiểm tra dữ liệu hiển thị",
@@ -31,13 +32,13 @@ def login_step(driver, wait):
     expected="Chuyển trang detailBill?mhd=X và hiển thị đúng thông tin",
     priority="High"
 )
-def test_view_detail_bill(driver, log_step):
+def test_view_detail_bill(driver, log_step, account, session_for):
     wait = WebDriverWait(driver, 10)
 
     log_step("Bước 1: Đăng nhập hệ thống")
     try:
-        login_step(driver, wait)
-        log_step(f"Đăng nhập thành công với {VALID_EMAIL}")
+        login_step(session_for, account)
+        log_step(f"Đăng nhập thành công với {account['email']}")
     except Exception as e:
         pytest.fail(f"Lỗi đăng nhập: {e}")
 
@@ -1,16 +1,13 @@
 import pytest
 import time
 import re 
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
 
 # Cấu hình URL
 BASE_URL = "http://localhost/bookstore/public"
-LOGIN_URL = f"{BASE_URL}/home" 
 MANAGE_BILL_URL = f"{BASE_URL}/manageBill" # URL trang quản lý đơn hàng
 
 # ==========================================
@@ -50,68 +47,10 @@ def save_screenshot(driver, test_id, description="debug"):
         return False
 
 
-@pytest.fixture(scope="function")
-def driver():
-    """Khởi tạo và đóng trình duyệt Chrome."""
-    print("\n[Setup] Khởi tạo trình duyệt...")
-    options = webdriver.ChromeOptions()
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option('useAutomationExtension', False)
-    
-    driver = webdriver.Chrome(options=options)
-    yield driver
-    print("\n[Teardown] Đóng trình duyệt...")
-    try:
-        driver.quit()
-    except:
-        pass
-
-
-@pytest.fixture(scope="function")
-def admin_logged_in_driver(driver, log_step): # <-- ĐÃ THÊM log_step
-    """
-    Fixture này tự động đăng nhập với quyền Admin 
-    và trả về driver đã đăng nhập cho test case sử dụng.
-    """
-    wait = WebDriverWait(driver, 10)
-    
-    log_step(f"Di chuyển đến trang đăng nhập: {LOGIN_URL}") # <-- THÊM LOG STEP
-    driver.get(LOGIN_URL)
-    
-    try:
-        # Cố gắng click vào nút login (nếu chưa ở trang login)
-        try:
-            log_step("Cố gắng click vào link/nút 'login'") # <-- THÊM LOG STEP
-            login_link = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a[href*='login']")))
-            login_link.click()
-        except:
-            log_step("Link 'login' không cần thiết (đã ở trang login hoặc đã có form). Tiếp tục điền form.") # <-- THÊM LOG STEP
-            pass
-        
-        # Điền thông tin đăng nhập
-        log_step("Điền thông tin đăng nhập: email=admin@gmail.com, password=123123") # <-- THÊM LOG STEP
-        wait.until(EC.visibility_of_element_located((By.NAME, "email"))).send_keys("admin@gmail.com")
-        pwd = driver.find_element(By.NAME, "password")
-        pwd.clear()
-        pwd.send_keys("123123")
-        pwd.send_keys(Keys.RETURN)
-        
-        # Chờ sau khi đăng nhập xong (kiểm tra sự xuất hiện của menu Quản Lý)
-        log_step("Chờ menu 'Quản Lý' xuất hiện để xác nhận đăng nhập thành công.") # <-- THÊM LOG STEP
-        wait.until(EC.presence_of_element_located((By.XPATH, "//a[contains(., 'Quản Lý')]")))
-        print("\n✅ Đăng nhập Admin thành công.")
-        log_step("Đăng nhập Admin thành công.") # <-- THÊM LOG STEP
-    except Exception as e:
-        log_step(f"Lỗi: Đăng nhập Admin thất bại: {e}") # <-- THÊM LOG STEP
-        pytest.fail(f"❌ Đăng nhập Admin thất bại: {e}")
-        
-    return driver # Trả về driver đã đăng nhập
-
-
 # ==========================================
 # TEST CASE: GỬI ĐƠN HÀNG THÀNH CÔNG (Đã Fix Lỗi)
 # ==========================================
+@pytest.mark.state(writes=["orders"])
 @pytest.mark.tc(title="Gửi đơn hàng (chuyển trạng thái sang Đang vận chuyển)", priority="High", view="Manage Bills") # <-- ĐÃ THÊM MARKER
 def test_confirm_send_order_success(admin_logged_in_driver, log_step): # <-- ĐÃ THÊM log_step
     driver = admin_logged_in_driver 
@@ -57,7 +57,7 @@ def _check_view_shown(driver, expected_fragments=None, expected_keywords=None):
                desc="Click nav 'Trang chủ' -> hiện trang chủ (banner + icons)",
                pre="Server chạy; trang home truy cập được",
                expected="Hiển thị trang chủ gồm banner + category icons")
-def test_nav_home_shows_home(driver, log_step, request):
+def test_nav_home_shows_home(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở trang base URL.
@@ -83,7 +83,7 @@ def test_nav_home_shows_home(driver, log_step, request):
 
         log_step("Bước 3: Click link 'Trang chủ'")
         _safe_click(driver, target)
-        time.sleep(0.5)
+        wait_until_settled(replaces=0.5)
 
         log_step("Bước 4: Kiểm tra trang chủ hiển thị")
         ok, diag = _check_view_shown(driver, expected_fragments=["home"], expected_keywords=["khuyến", "sản phẩm", "bookworm"])
@@ -96,7 +96,7 @@ def test_nav_home_shows_home(driver, log_step, request):
                desc="Click nav 'Giới thiệu' -> hiện trang about (fallback điều hướng nếu không thấy link)",
                pre="Server chạy; /about route tồn tại",
                expected="Hiển thị nội dung Giới thiệu")
-def test_nav_about_shows_about(driver, log_step, request):
+def test_nav_about_shows_about(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở trang base URL.
@@ -144,7 +144,7 @@ def test_nav_about_shows_about(driver, log_step, request):
             except Exception:
                 driver.execute_script("arguments[0].click();", target)
 
-        time.sleep(0.6)
+        wait_until_settled(replaces=0.6)
         log_step("Bước 4: Kiểm tra trang Giới thiệu hiển thị")
         cur = driver.current_url.lower()
         body = driver.find_element(By.TAG_NAME, "body").text.lower()
@@ -174,7 +174,7 @@ def test_nav_about_shows_about(driver, log_step, request):
                desc="Click nav 'Sản phẩm' -> hiện product list",
                pre="Server chạy",
                expected="Hiển thị danh sách sản phẩm")
-def test_nav_products_shows_products(driver, log_step, request):
+def test_nav_products_shows_products(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở base URL.
@@ -206,7 +206,7 @@ def test_nav_products_shows_products(driver, log_step, request):
 
         log_step("Bước 3: Click link 'Sản phẩm'")
         _safe_click(driver, target)
-        time.sleep(0.6)
+        wait_until_settled(replaces=0.6)
 
         log_step("Bước 4: Kiểm tra trang sản phẩm")
         ok, diag = _check_view_shown(driver, expected_fragments=["product", "product_all"], expected_keywords=["sản phẩm", "xem tất cả"])
@@ -217,7 +217,7 @@ def test_nav_products_shows_products(driver, log_step, request):
 
 # Category icons: each test defined clearly
 @pytest.mark.tc(title="Khuyến mãi icon -> view Khuyến mãi")
-def test_icon_sale_shows_sale_view(driver, log_step, request):
+def test_icon_sale_shows_sale_view(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở home.
@@ -234,7 +234,7 @@ def test_icon_sale_shows_sale_view(driver, log_step, request):
         btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[name='sale']")))
         log_step("Bước 3: Click button sale")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
         log_step("Bước 4: Kiểm tra view khuyến mãi")
         ok, diag = _check_view_shown(driver, expected_fragments=["sale", "product"], expected_keywords=["khuyến", "khuyen"])
         assert ok, f"Không hiển thị view Khuyến mãi: {diag}"
@@ -243,7 +243,7 @@ def test_icon_sale_shows_sale_view(driver, log_step, request):
         raise
 
 @pytest.mark.tc(title="Sản phẩm Mới icon -> view Sản phẩm Mới")
-def test_icon_newproduct_shows_newproduct_view(driver, log_step, request):
+def test_icon_newproduct_shows_newproduct_view(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở home.
@@ -259,7 +259,7 @@ def test_icon_newproduct_shows_newproduct_view(driver, log_step, request):
         btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[name='all']")))
         log_step("Bước 3: Click button all")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
         log_step("Bước 4: Kiểm tra view Sản phẩm Mới")
         ok, diag = _check_view_shown(driver, expected_fragments=["product", "all"], expected_keywords=["sản phẩm mới", "sản phẩm"])
         assert ok, f"Không hiển thị view Sản phẩm Mới: {diag}"
@@ -268,7 +268,7 @@ def test_icon_newproduct_shows_newproduct_view(driver, log_step, request):
         raise
 
 @pytest.mark.tc(title="SGK icon -> view Sách Giáo Dục")
-def test_icon_sgk_shows_sgk_view(driver, log_step, request):
+def test_icon_sgk_shows_sgk_view(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở home.
@@ -284,7 +284,7 @@ def test_icon_sgk_shows_sgk_view(driver, log_step, request):
         btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[name='sgk']")))
         log_step("Bước 3: Click sgk")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
         log_step("Bước 4: Kiểm tra view SGK")
         ok, diag = _check_view_shown(driver, expected_fragments=["sgk", "product"], expected_keywords=["sách giáo", "sgk", "giáo dục"])
         assert ok, f"Không hiển thị view SGK: {diag}"
@@ -293,7 +293,7 @@ def test_icon_sgk_shows_sgk_view(driver, log_step, request):
         raise
 
 @pytest.mark.tc(title="Truyện Tranh icon -> view Truyện Tranh")
-def test_icon_comic_shows_comic_view(driver, log_step, request):
+def test_icon_comic_shows_comic_view(driver, log_step, request, wait_until_settled):
     """
     Steps similar: open home -> find button[name='truyentranh'] -> click -> check view
     """
@@ -305,7 +305,7 @@ def test_icon_comic_shows_comic_view(driver, log_step, request):
         btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[name='truyentranh']")))
         log_step("Bước 3: Click truyentranh")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
         log_step("Bước 4: Kiểm tra view Truyện Tranh")
         ok, diag = _check_view_shown(driver, expected_fragments=["truyen", "truyentranh", "comic"], expected_keywords=["truyện tranh", "comic"])
         assert ok, f"Không hiển thị view Truyện Tranh: {diag}"
@@ -314,7 +314,7 @@ def test_icon_comic_shows_comic_view(driver, log_step, request):
         raise
 
 @pytest.mark.tc(title="Kỹ Năng Sống icon -> view Kỹ Năng Sống")
-def test_icon_kynang_shows_kynang_view(driver, log_step, request):
+def test_icon_kynang_shows_kynang_view(driver, log_step, request, wait_until_settled):
     """
     Steps: open home -> find button[name='kynang'] -> click -> check view
     """
@@ -326,7 +326,7 @@ def test_icon_kynang_shows_kynang_view(driver, log_step, request):
         btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[name='kynang']")))
         log_step("Bước 3: Click kynang")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
         log_step("Bước 4: Kiểm tra view Kỹ Năng Sống")
         ok, diag = _check_view_shown(driver, expected_fragments=["kynang", "ky-nang", "skill"], expected_keywords=["kỹ năng", "kynang"])
         assert ok, f"Không hiển thị view Kỹ Năng Sống: {diag}"
@@ -335,7 +335,7 @@ def test_icon_kynang_shows_kynang_view(driver, log_step, request):
         raise
 
 @pytest.mark.tc(title="Tiểu Thuyết icon -> view Tiểu Thuyết")
-def test_icon_tieuthuyet_shows_view(driver, log_step, request):
+def test_icon_tieuthuyet_shows_view(driver, log_step, request, wait_until_settled):
     """
     Steps: open home -> find button[name='tieuthuyet'] -> click -> check view
     """
@@ -347,7 +347,7 @@ def test_icon_tieuthuyet_shows_view(driver, log_step, request):
         btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "button[name='tieuthuyet']")))
         log_step("Bước 3: Click tieuthuyet")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
         log_step("Bước 4: Kiểm tra view Tiểu Thuyết")
         ok, diag = _check_view_shown(driver, expected_fragments=["tieuthuyet", "tieu"], expected_keywords=["tiểu thuyết", "tieuthuyet"])
         assert ok, f"Không hiển thị view Tiểu Thuyết: {diag}"
@@ -376,104 +376,13 @@ def is_user_logged_in(driver):
         pass
     return False
 
-def perform_login(driver, wait, email=None, password=None):
-    """
-    Thực hiện đăng nhập nhanh:
-    - Nếu email/password không truyền vào, lấy từ biến môi trường TEST_USER_EMAIL/TEST_USER_PASS
-    - Tìm form/login link; fallback navigate tới BASE_URL + 'login'
-    Trả True nếu login thành công (heuristic: phát hiện logout/link profile), False nếu thất bại.
-    """
-    email = email or os.environ.get("TEST_USER_EMAIL")
-    password = password or os.environ.get("TEST_USER_PASS")
-    if not email or not password:
-        pytest.skip("No test credentials provided (set TEST_USER_EMAIL and TEST_USER_PASS env vars)")
-
-    # Try find login link first
-    try:
-        login_link = None
-        links = driver.find_elements(By.CSS_SELECTOR, "a")
-        for a in links:
-            href = (a.get_attribute("href") or "").lower()
-            txt = (a.text or "").strip().lower()
-            if "đăng nhập" in txt or "dang nhap" in txt or "/login" in href or "/dang-nhap" in href:
-                login_link = a
-                break
-        if login_link:
-            _safe_click(driver, login_link)
-        else:
-            # fallback navigate
-            driver.get(BASE_URL.rstrip("/") + "/login")
-        time.sleep(0.6)
-    except Exception:
-        try:
-            driver.get(BASE_URL.rstrip("/") + "/login")
-            time.sleep(0.6)
-        except Exception:
-            pass
-
-    # Now fill login form: try common selectors
-    try:
-        # wait for email/username input
-        email_input = None
-        try:
-            email_input = WebDriverWait(driver, 3).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='email'], input[name='email'], input[name='username'], input[name='user']"))
-            )
-        except Exception:
-            # fallback any input
-            inputs = driver.find_elements(By.CSS_SELECTOR, "input")
-            if inputs:
-                email_input = inputs[0]
-
-        password_input = None
-        try:
-            password_input = driver.find_element(By.CSS_SELECTOR, "input[type='password'], input[name='password']")
-        except Exception:
-            # find second input
-            inputs = driver.find_elements(By.CSS_SELECTOR, "input[type='password']")
-            if inputs:
-                password_input = inputs[0]
-
-        if email_input and password_input:
-            try:
-                email_input.clear()
-                email_input.send_keys(email)
-                password_input.clear()
-                password_input.send_keys(password)
-            except Exception:
-                pass
-
-            # try to submit: look for button 'Đăng nhập' or type=submit
-            login_btn = None
-            try:
-                login_btn = driver.find_element(By.CSS_SELECTOR, "button[type='submit'], button.login, input[type='submit']")
-            except Exception:
-                # find by text
-                try:
-                    btns = driver.find_elements(By.TAG_NAME, "button")
-                    for b in btns:
-                        if (b.text or "").strip().lower() in ("đăng nhập", "dang nhap", "login", "sign in"):
-                            login_btn = b
-                            break
-                except Exception:
-                    login_btn = None
-
-            if login_btn:
-                _safe_click(driver, login_btn)
-            else:
-                # fallback press Enter on password input
-                try:
-                    password_input.send_keys("\n")
-                except Exception:
-                    pass
-
-            # wait a bit and check login success
-            time.sleep(1.2)
-            return is_user_logged_in(driver)
-        else:
-            return False
-    except Exception:
-        return False
+def login_credentials():
+    """Tài khoản từ TEST_USER_EMAIL/TEST_USER_PASS nếu có; None -> conftest lease tài khoản user từ pool."""
+    email = os.environ.get("TEST_USER_EMAIL")
+    password = os.environ.get("TEST_USER_PASS")
+    if email and password:
+        return {"email": email, "password": password}
+    return None
 
 # -------------------------
 # New testcases: add-to-cart behavior depending on auth state
@@ -483,7 +392,7 @@ def perform_login(driver, wait, email=None, password=None):
                desc="Nếu chưa đăng nhập, ấn 'Chọn mua' trên 1 sản phẩm sẽ đưa user tới trang login",
                pre="Server chạy; trang home có ít nhất 1 sản phẩm; user chưa đăng nhập",
                expected="Redirect to login page")
-def test_add_to_cart_redirects_login_when_not_authenticated(driver, log_step, request):
+def test_add_to_cart_redirects_login_when_not_authenticated(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở trang home.
@@ -498,7 +407,7 @@ def test_add_to_cart_redirects_login_when_not_authenticated(driver, log_step, re
         log_step("Bước 1: Mở home")
         driver.get(BASE_URL)
         driver.maximize_window()
-        time.sleep(0.4)
+        wait_until_settled(replaces=0.4)
 
         # ensure logged out: if logged in try to click logout link
         if is_user_logged_in(driver):
@@ -507,12 +416,12 @@ def test_add_to_cart_redirects_login_when_not_authenticated(driver, log_step, re
                 logout_candidates = driver.find_elements(By.CSS_SELECTOR, "a[href*='logout'], a[href*='dang-xuat'], .logout")
                 if logout_candidates:
                     _safe_click(driver, logout_candidates[0])
-                    time.sleep(0.6)
+                    wait_until_settled(replaces=0.6)
             except Exception:
                 pass
             # refresh
             driver.get(BASE_URL)
-            time.sleep(0.5)
+            wait_until_settled(replaces=0.5)
             assert not is_user_logged_in(driver), "Không thể đảm bảo user đang ở trạng thái logged-out trước khi test"
 
         log_step("Bước 2: Tìm button 'Chọn mua' (add to cart)")
@@ -532,7 +441,7 @@ def test_add_to_cart_redirects_login_when_not_authenticated(driver, log_step, re
 
         log_step("Bước 3: Click 'Chọn mua' khi chưa đăng nhập")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
 
         log_step("Bước 4: Kiểm tra redirect tới trang login")
         cur = driver.current_url.lower()
@@ -548,15 +457,16 @@ def test_add_to_cart_redirects_login_when_not_authenticated(driver, log_step, re
             pass
         raise
 
+@pytest.mark.state(writes=["cart"], per_account=True)
 @pytest.mark.tc(title="Add to cart goes to Cart when authenticated",
                desc="Nếu đã đăng nhập, ấn 'Chọn mua' sẽ chuyển tới giỏ hàng hoặc hiển thị giỏ hàng",
                pre="Server chạy; test credentials set as env vars TEST_USER_EMAIL & TEST_USER_PASS (or editable)",
                expected="User được dẫn tới /cart hoặc thấy nội dung giỏ hàng")
-def test_add_to_cart_goes_to_cart_when_authenticated(driver, log_step, request):
+def test_add_to_cart_goes_to_cart_when_authenticated(driver, log_step, request, session_for, wait_until_settled):
     """
     Steps:
     1) Mở home.
-    2) Nếu chưa login -> thực hiện login bằng perform_login (dùng TEST_USER_EMAIL/TEST_USER_PASS).
+    2) Nếu chưa login -> nạp phiên user bằng session_for (cookie cache; TEST_USER_EMAIL/TEST_USER_PASS nếu có).
     3) Tìm 1 nút 'Chọn mua' và click.
     4) Chờ redirect hoặc kiểm tra page body chứa 'giỏ hàng'/'cart'/'thêm vào giỏ'...
     Expected: URL chứa 'cart' hoặc trang hiện giỏ hàng.
@@ -566,19 +476,17 @@ def test_add_to_cart_goes_to_cart_when_authenticated(driver, log_step, request):
         log_step("Bước 1: Mở home")
         driver.get(BASE_URL)
         driver.maximize_window()
-        time.sleep(0.4)
+        wait_until_settled(replaces=0.4)
 
         # ensure logged in
         if not is_user_logged_in(driver):
-            log_step("Chưa đăng nhập -> thực hiện login bằng perform_login")
-            logged = perform_login(driver, wait)
-            assert logged, "Không login được bằng thông tin test. Thiết lập TEST_USER_EMAIL & TEST_USER_PASS hoặc kiểm tra form login."
-            time.sleep(0.6)
+            log_step("Chưa đăng nhập -> nạp phiên user bằng session_for")
+            session_for("user", account=login_credentials())
             # after login, go to home again to find add-to-cart buttons
             driver.get(BASE_URL)
-            time.sleep(0.5)
+            wait_until_settled(replaces=0.5)
 
-        assert is_user_logged_in(driver), "Sau khi perform_login vẫn không ở trạng thái logged-in"
+        assert is_user_logged_in(driver), "Sau khi nạp phiên user vẫn không ở trạng thái logged-in"
 
         log_step("Bước 2: Tìm button 'Chọn mua' (add to cart)")
         btn = None
@@ -596,7 +504,7 @@ def test_add_to_cart_goes_to_cart_when_authenticated(driver, log_step, request):
 
         log_step("Bước 3: Click 'Chọn mua'")
         _safe_click(driver, btn)
-        time.sleep(0.8)
+        wait_until_settled(replaces=0.8)
 
         log_step("Bước 4: Kiểm tra vào giỏ hàng hoặc thấy nội dung giỏ")
         cur = driver.current_url.lower()
@@ -2,13 +2,10 @@
 import pytest
 import time
 import re 
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select # <<< IMPORT Select
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
-from webdriver_manager.chrome import ChromeDriverManager 
 
 # ==========================================
 # CẤU HÌNH VÀ HÀM TIỆN ÍCH
@@ -16,7 +13,6 @@ from webdriver_manager.chrome import ChromeDriverManager
 
 # Cấu hình URL
 BASE_URL = "http://localhost/bookstore/public"
-LOGIN_URL = f"{BASE_URL}/home" 
 MANAGE_BILL_URL = f"{BASE_URL}/manageBill" # URL trang quản lý đơn hàng
 
 # HÀM LÀM SẠCH CHUỖI ĐÃ TỐI ƯU HÓA
@@ -56,70 +52,6 @@ def save_screenshot(driver, test_id, description="debug"):
         print(f"[DEBUG] Could not save screenshot: {e}")
         return False
 
-# Fixture driver (Cập nhật để sử dụng ChromeDriverManager)
-@pytest.fixture(scope="function")
-def driver():
-    """Khởi tạo và đóng trình duyệt Chrome."""
-    print("\n[Setup] Khởi tạo trình duyệt...")
-    options = webdriver.ChromeOptions()
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option('useAutomationExtension', False)
-    
-    # Sử dụng ChromeDriverManager
-    driver = webdriver.Chrome(service=webdriver.ChromeService(ChromeDriverManager().install()), options=options)
-    yield driver
-    print("\n[Teardown] Đóng trình duyệt...")
-    try:
-        driver.quit()
-    except:
-        pass
-
-
-@pytest.fixture(scope="function")
-def admin_logged_in_driver(driver, log_step): # <<< THÊM log_step
-    """
-    Fixture này tự động đăng nhập với quyền Admin 
-    và trả về driver đã đăng nhập cho test case sử dụng.
-    """
-    wait = WebDriverWait(driver, 10)
-    
-    log_step("Bắt đầu đăng nhập Admin qua fixture (Precondition).")
-    
-    # 1. Vào trang Login và đăng nhập
-    driver.get(LOGIN_URL)
-    log_step(f"Truy cập URL: {LOGIN_URL}")
-    
-    try:
-        # Cố gắng click vào nút login (nếu chưa ở trang login)
-        try:
-            login_link = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a[href*='login']")))
-            login_link.click()
-            log_step("Click vào nút 'Đăng nhập' (nav link).")
-        except:
-            log_step("Không tìm thấy nút login, giả định đã ở trang login hoặc tiếp tục nhập liệu.")
-            pass
-        
-        # Điền thông tin đăng nhập
-        wait.until(EC.visibility_of_element_located((By.NAME, "email"))).send_keys("admin@gmail.com")
-        log_step("Nhập Email: admin@gmail.com")
-        pwd = driver.find_element(By.NAME, "password")
-        pwd.clear()
-        pwd.send_keys("123123")
-        log_step("Nhập Mật khẩu.")
-        pwd.send_keys(Keys.RETURN)
-        log_step("Gửi form đăng nhập (nhấn ENTER).")
-        
-        # Chờ sau khi đăng nhập xong
-        wait.until(EC.presence_of_element_located((By.XPATH, "//a[contains(., 'Quản Lý')]")))
-        log_step("✅ Đăng nhập Admin thành công.")
-    except Exception as e:
-        log_step(f"❌ Đăng nhập Admin thất bại: {e}")
-        pytest.fail(f"❌ Đăng nhập Admin thất bại: {e}")
-        
-    return driver # Trả về driver đã đăng nhập
-
-
 # ==========================================
 # TEST CASE: LỌC ĐƠN HÀNG THEO TRẠNG THÁI 
 # ==========================================
@@ -140,7 +72,7 @@ FILTER_CASES = [
     view="Manage Bills",
     test_type="Functional" # Loại test này là Functional
 )
-def test_filter_bill_by_status(admin_logged_in_driver, log_step, option_value, dropdown_status, expected_status_text): # <<< THÊM log_step
+def test_filter_bill_by_status(admin_logged_in_driver, log_step, wait_until_settled, option_value, dropdown_status, expected_status_text): # <<< THÊM log_step
     driver = admin_logged_in_driver 
     wait = WebDriverWait(driver, 10)
     test_id = f"TF-{dropdown_status.replace(' ', '_')}"
@@ -172,9 +104,9 @@ def test_filter_bill_by_status(admin_logged_in_driver, log_step, option_value, d
         log_step(f"2. Đã chọn filter: {dropdown_status} (Value={option_value}).")
         
         # 3. Chờ cho bảng cập nhật
-        # Chờ 3 giây để form submit và trang reload/tải dữ liệu mới
-        time.sleep(3) 
-        log_step("3. Chờ 3 giây để dữ liệu mới tải xong sau khi áp dụng filter.")
+        # Chờ form submit và trang reload/tải dữ liệu mới (thay cho sleep 3 giây cố định)
+        waited = wait_until_settled(replaces=3, navigation=True)
+        log_step(f"3. Chờ dữ liệu mới tải xong sau khi áp dụng filter ({waited:.2f}s).")
 
         # 4. Kiểm tra kết quả
         rows = driver.find_elements(By.XPATH, "//table/tbody/tr")
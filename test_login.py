@@ -77,7 +77,7 @@ def test_login_form_elements_present(driver, log_step, request):
                desc="Nhấn toggle password để hiện/ẩn mật khẩu",
                pre="Có trang login hiển thị",
                expected="Password input thay đổi type giữa 'password' và 'text'")
-def test_login_toggle_password_visibility(driver, log_step, request):
+def test_login_toggle_password_visibility(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở /login.
@@ -99,11 +99,11 @@ def test_login_toggle_password_visibility(driver, log_step, request):
         pwd.send_keys("SamplePass123!")
         log_step("Click toggle lần 1 (should show)")
         _safe_click(driver, toggle)
-        time.sleep(0.3)
+        wait_until_settled(replaces=0.3)
         assert pwd.get_attribute("type") == "text", f"Toggle failed to set type text (got {pwd.get_attribute('type')})"
         log_step("Click toggle lần 2 (should hide)")
         _safe_click(driver, toggle)
-        time.sleep(0.3)
+        wait_until_settled(replaces=0.3)
         assert pwd.get_attribute("type") == "password", f"Toggle failed to set type password (got {pwd.get_attribute('type')})"
     except Exception:
         try:
@@ -118,7 +118,7 @@ def test_login_toggle_password_visibility(driver, log_step, request):
                desc="Gửi form login với credential sai -> user không được đăng nhập; hiển thị lỗi nếu có",
                pre="Route /login tồn tại",
                expected="Không được đăng nhập (và/hoặc hiển thị message lỗi)")
-def test_login_with_invalid_credentials_shows_error(driver, log_step, request):
+def test_login_with_invalid_credentials_shows_error(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở /login.
@@ -144,7 +144,7 @@ def test_login_with_invalid_credentials_shows_error(driver, log_step, request):
         _safe_click(driver, btn)
 
         # chờ server/UI xử lý
-        time.sleep(1.0)
+        wait_until_settled(replaces=1.0)
 
         cur = driver.current_url.lower()
         body = driver.find_element(By.TAG_NAME, "body").text.lower()
@@ -214,7 +214,7 @@ def test_login_with_invalid_credentials_shows_error(driver, log_step, request):
                desc="Đăng nhập thành công bằng tài khoản test (env vars TEST_USER_EMAIL/TEST_USER_PASS)",
                pre="TEST_USER_EMAIL & TEST_USER_PASS set",
                expected="Redirect tới trang home hoặc hiển thị thông tin user")
-def test_login_success_redirects_home(driver, log_step, request):
+def test_login_success_redirects_home(driver, log_step, request, wait_until_settled):
     """
     Steps:
     1) Mở /login.
@@ -240,7 +240,7 @@ def test_login_success_redirects_home(driver, log_step, request):
         btn = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
         _safe_click(driver, btn)
         # wait for redirect / presence of logout or profile indicator
-        time.sleep(1.2)
+        wait_until_settled(replaces=1.2, navigation=True)
         cur = driver.current_url.lower()
         body = driver.find_element(By.TAG_NAME, "body").text.lower()
 
@@ -1,89 +1,11 @@
 import pytest
 import time
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
 
 # Cấu hình URL
 BASE_URL = "http://localhost/bookstore/public"
-LOGIN_URL = f"{BASE_URL}/home" 
-
-# --- Cập nhật Fixture driver (Thêm request để tương thích với conftest) ---
-@pytest.fixture(scope="function")
-def driver(request):
-    """Khởi tạo và đóng trình duyệt Chrome."""
-    print("\n[Setup] Khởi tạo trình duyệt...")
-    options = webdriver.ChromeOptions()
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option('useAutomationExtension', False)
-    
-    driver = webdriver.Chrome(options=options)
-    
-    # Gán driver cho request.node để hook pytest_runtest_makereport trong conftest có thể truy cập
-    try:
-        request.node._driver = driver
-    except Exception:
-        pass
-        
-    yield driver
-    print("\n[Teardown] Đóng trình duyệt...")
-    try:
-        driver.quit()
-    except:
-        pass
-
-
-@pytest.fixture(scope="function")
-# THAY ĐỔI: Thêm log_step vào fixture để ghi lại quá trình đăng nhập
-def admin_logged_in_driver(driver, log_step):
-    """
-    Fixture này tự động đăng nhập với quyền Admin 
-    và trả về driver đã đăng nhập cho test case sử dụng.
-    """
-    wait = WebDriverWait(driver, 10)
-    
-    log_step("Precondition: Bắt đầu Đăng nhập Admin")
-    
-    # 1. Vào trang Login
-    driver.get(LOGIN_URL)
-    log_step(f"1. Truy cập trang chủ: {LOGIN_URL}")
-    
-    # 2. Click nút Login và điền thông tin
-    try:
-        # Cố gắng click vào nút login
-        try:
-            login_link = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "a[href*='login']")))
-            login_link.click()
-            log_step("2. Click vào nút Đăng nhập trên header.")
-        except:
-            log_step("2. Nút Login không khả dụng/không tìm thấy, tiếp tục nhập liệu.")
-            pass
-        
-        # Điền thông tin đăng nhập
-        wait.until(EC.visibility_of_element_located((By.NAME, "email"))).send_keys("admin@gmail.com")
-        log_step("3. Điền email: admin@gmail.com")
-        
-        pwd = driver.find_element(By.NAME, "password")
-        pwd.clear()
-        pwd.send_keys("123123")
-        log_step("4. Điền mật khẩu.")
-        
-        # Gửi form
-        pwd.send_keys(Keys.RETURN)
-        log_step("5. Nhấn Enter để Đăng nhập.")
-        
-        # Chờ sau khi đăng nhập xong (kiểm tra sự xuất hiện của menu Quản Lý)
-        wait.until(EC.presence_of_element_located((By.XPATH, "//a[contains(., 'Quản Lý')]")))
-        log_step("6. Xác nhận Đăng nhập Admin thành công (Thấy menu 'Quản Lý').")
-        print("\n✅ Đăng nhập Admin thành công.")
-    except Exception as e:
-        log_step(f"❌ Đăng nhập Admin thất bại: {e}")
-        pytest.fail(f"❌ Đăng nhập Admin thất bại: {e}")
-        
-    return driver # Trả về driver đã đăng nhập
 
 
 @pytest.mark.tc(
@@ -1,13 +1,10 @@
 import pytest
-import time
 import unicodedata
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 BASE_URL = "http://localhost/bookstore/public"
-VALID_EMAIL = "user@gmail.com" 
-VALID_PASS = "123456"
 
 def normalize(text):
     return unicodedata.normalize('NFC', text.strip()) if text else ""
@@ -16,13 +13,16 @@ def normalize(text):
 def setup_driver(driver):
     driver.maximize_window()
 
-def login_step(driver, wait):
-    driver.get(f"{BASE_URL}/login")
-    wait.until(EC.visibility_of_element_located((By.NAME, "email"))).send_keys(VALID_EMAIL)
-    driver.find_element(By.NAME, "password").send_keys(VALID_PASS)
-    driver.find_element(By.CSS_SELECTOR, "button[type='submit']").click()
-    wait.until(lambda d: "login" not in d.current_url)
+@pytest.fixture
+def account(lease_account):
+    # Cần user có ít nhất 1 đơn hàng; mỗi worker lease một tài khoản riêng từ pool trong conftest
+    return lease_account("user", traits=("orders",))
 
+def login_step(session_for, account):
+    # Đăng nhập bằng cookie cache trong conftest; chỉ đi qua form /login khi cache hết hạn
+    session_for("user", account=account)
+
+@pytest.mark.state(writes=["orders"])
 @pytest.mark.tc(
     title="Chức năng Hủy đơn hàng (User)",
     desc="User hủy đơn hàng đang ở trạng thái chờ/đang xử lý thông qua Modal xác nhận",
@@ -30,11 +30,11 @@ def login_step(driver, wait):
     expected="Trạng thái đơn hàng đổi thành 'Đã hủy' hoặc 'Canceled'",
     priority="Critical"
 )
-def test_cancel_order(driver, log_step):
+def test_cancel_order(driver, log_step, account, session_for, wait_until_settled):
     wait = WebDriverWait(driver, 10)
 
     log_step("Bước 1: Đăng nhập và vào Lịch sử mua hàng")
-    login_step(driver, wait)
+    login_step(session_for, account)
     driver.get(f"{BASE_URL}/payHistory")
 
     log_step("Bước 2: Tìm đơn hàng có nút Hủy")
@@ -58,7 +58,7 @@ def test_cancel_order(driver, log_step):
         pytest.fail(f"Lỗi thao tác Modal: {e}")
 
     log_step("Bước 5: Kiểm tra trạng thái sau khi hủy")
-    time.sleep(2) # Chờ reload
+    wait_until_settled(replaces=2, navigation=True) # Chờ reload
     
     # Kiểm tra lại bảng, tìm chữ "Đã hủy" hoặc "Canceled"
     table_text = normalize(driver.find_element(By.TAG_NAME, "table").text)
@@ -19,7 +19,7 @@ def setup_driver(driver):
     priority="Medium"
 )
 @pytest.mark.parametrize("field_to_miss", ["name", "email", "password"])
-def test_register_validation(driver, log_step, field_to_miss):
+def test_register_validation(driver, log_step, wait_until_settled, field_to_miss):
     wait = WebDriverWait(driver, 10)
     
     log_step("Bước 1: Truy cập trang Đăng ký")
@@ -42,7 +42,7 @@ def test_register_validation(driver, log_step, field_to_miss):
     driver.execute_script("arguments[0].click();", submit_btn)
     
     log_step("Bước 5: Kiểm tra kết quả Validate")
-    time.sleep(1) # Chờ phản hồi
+    wait_until_settled(replaces=1) # Chờ phản hồi
     
     # 1. Kiểm tra URL: Nếu vẫn còn chữ 'register' -> Chưa đăng ký thành công -> Pass
     if "register" in driver.current_url:
@@ -1,5 +1,4 @@
 import pytest
-import time
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -7,16 +6,17 @@ from selenium.webdriver.support import expected_conditions as EC
 BASE_URL = "http://localhost/bookstore/public"
 
 @pytest.fixture
-def ensure_cart_has_item(driver, log_step):
+def ensure_cart_has_item(driver, log_step, user_account, session_for, precondition_state, wait_until_settled):
     wait = WebDriverWait(driver, 15)
+    if precondition_state.ready("cart", user_account["email"]):
+        log_step("Chuẩn bị: Giỏ hàng đã có sách từ test trước cùng nhóm, bỏ qua đăng nhập/thêm hàng")
+        return
     
     # Chuẩn bị dữ liệu
     log_step("Chuẩn bị: Đăng nhập tài khoản User")
-    driver.get(f"{BASE_URL}/login")
     try:
-        driver.find_element(By.NAME, "email").send_keys("duy123@gmail.com")
-        driver.find_element(By.NAME, "password").send_keys("duy123")
-        driver.find_element(By.ID, "singinForm").submit()
+        session_for("user", account=user_account)
+        driver.get(f"{BASE_URL}/home")
         wait.until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, 'logout')]")))
     except:
         pytest.fail("Không đăng nhập được để test giỏ hàng")
@@ -28,10 +28,12 @@ def ensure_cart_has_item(driver, log_step):
         
         add_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "form[action='addCart'] button")))
         add_btn.click()
-        time.sleep(2) 
+        wait_until_settled(replaces=2, navigation=True)
+        precondition_state.mark("cart", user_account["email"])
     except:
         pytest.skip("Lỗi khi thêm hàng vào giỏ (có thể hết sách)")
 
+@pytest.mark.state(writes=["cart"], per_account=True)
 @pytest.mark.tc(title="Cart - Kiểm tra bảng giỏ hàng", priority="Medium")
 def test_cart_table_headers(driver, log_step, ensure_cart_has_item):
     log_step("Bước 1: Ấn vào icon Giỏ hàng để xem chi tiết")
@@ -45,6 +47,7 @@ def test_cart_table_headers(driver, log_step, ensure_cart_has_item):
     assert "SỐ LƯỢNG" in header_text
     assert "TIỀN" in header_text
 
+@pytest.mark.state(writes=["cart"], per_account=True)
 @pytest.mark.tc(title="Cart - Kiểm tra chức năng cập nhật", priority="Medium")
 def test_cart_update_form(driver, log_step, ensure_cart_has_item):
     log_step("Bước 1: Vào trang Giỏ hàng")
@@ -54,6 +57,7 @@ def test_cart_update_form(driver, log_step, ensure_cart_has_item):
     form = driver.find_element(By.CSS_SELECTOR, "form[action='updateCart']")
     assert form.is_displayed()
 
+@pytest.mark.state(writes=["cart"], per_account=True)
 @pytest.mark.tc(title="Cart - Kiểm tra popup xác nhận", priority="High")
 def test_cart_modal_structure(driver, log_step, ensure_cart_has_item):
     driver.get(f"{BASE_URL}/cart")
@@ -67,6 +71,7 @@ def test_cart_modal_structure(driver, log_step, ensure_cart_has_item):
     modal = wait.until(EC.visibility_of_element_located((By.ID, "confirm-pay")))
     assert "Xác nhận đặt hàng" in modal.text
 
+@pytest.mark.state(writes=["cart"], per_account=True)
 @pytest.mark.tc(title="Cart - Thử nút Hủy", priority="Medium")
 def test_cart_modal_cancel(driver, log_step, ensure_cart_has_item):
     driver.get(f"{BASE_URL}/cart")
@@ -82,6 +87,7 @@ def test_cart_modal_cancel(driver, log_step, ensure_cart_has_item):
     log_step("Bước 3: Kiểm tra xem popup có đóng lại chưa")
     wait.until(EC.invisibility_of_element_located((By.ID, "confirm-pay")))
 
+@pytest.mark.state(writes=["cart", "orders"], per_account=True)
 @pytest.mark.tc(title="Pay - Luồng thanh toán", priority="High")
 def test_pay_page_elements(driver, log_step, ensure_cart_has_item):
     wait = WebDriverWait(driver, 10)
@@ -3,6 +3,9 @@ from selenium.webdriver.common.by import By
 
 BASE_URL = "http://localhost/bookstore/public"
 
+# Chỉ đọc markup tĩnh -> chạy bằng HTTP engine, không cần Chrome
+pytestmark = pytest.mark.http_only
+
 # --- HEADER ---
 
 @pytest.mark.tc(title="Header - Kiểm tra Topbar", priority="Low")
@@ -5,6 +5,9 @@ from selenium.webdriver.support import expected_conditions as EC
 
 BASE_URL = "http://localhost/bookstore/public"
 
+# Form tìm kiếm submit bình thường, các kiểm tra chỉ đọc markup -> HTTP engine
+pytestmark = pytest.mark.http_only
+
 @pytest.fixture
 def perform_search(driver, log_step):
     wait = WebDriverWait(driver, 10) 